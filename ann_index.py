@@ -0,0 +1,95 @@
+import math
+import faiss
+import numpy as np
+from config import config
+
+INDEX_TYPES = ('flat', 'hnsw', 'ivf', 'ivfpq')
+QUANTIZATIONS = ('none', 'fp16', 'int8')
+
+_SCALAR_QUANTIZERS = {
+    'fp16': faiss.ScalarQuantizer.QT_fp16,
+    'int8': faiss.ScalarQuantizer.QT_8bit,
+}
+
+def resolve_index_type(index_type, num_vectors):
+    """Return the concrete index type, picking one by corpus size when index_type is 'auto'."""
+    if index_type != 'auto':
+        if index_type not in INDEX_TYPES:
+            raise ValueError(f"Unsupported index type '{index_type}'. Please use one of {INDEX_TYPES + ('auto',)}.")
+        return index_type
+    if num_vectors < config['auto_hnsw_min_vectors']:
+        return 'flat'
+    if num_vectors < config['auto_ivfpq_min_vectors']:
+        return 'hnsw'
+    return 'ivfpq'
+
+def index_params(index_type, num_vectors, dimension):
+    """Return the concrete build and search parameters for an index type and corpus size."""
+    quantization = config['vector_quantization']
+    if quantization not in QUANTIZATIONS:
+        raise ValueError(f"Unsupported vector quantization '{quantization}'. Please use one of {QUANTIZATIONS}.")
+    params = _type_params(index_type, num_vectors, dimension)
+    # Product quantization already compresses ivfpq's vectors.
+    if quantization != 'none' and index_type != 'ivfpq':
+        params["quantization"] = quantization
+    return params
+
+def _type_params(index_type, num_vectors, dimension):
+    if index_type == 'hnsw':
+        return {"m": config['hnsw_m'], "ef_search": config['hnsw_ef_search']}
+    if index_type in ('ivf', 'ivfpq'):
+        # k-means wants roughly 39 training points per centroid.
+        nlist = config['ivf_nlist'] or int(4 * math.sqrt(num_vectors))
+        params = {"nlist": max(1, min(nlist, num_vectors // 39)), "nprobe": config['ivf_nprobe']}
+        if index_type == 'ivfpq':
+            # The number of sub-quantizers has to divide the dimension.
+            params["pq_m"] = max(m for m in range(1, min(config['pq_m'], dimension) + 1) if dimension % m == 0)
+            params["pq_nbits"] = max(1, min(config['pq_nbits'], int(math.log2(max(num_vectors, 2)))))
+        return params
+    return {}
+
+def build_index(vectors, index_type, params):
+    """
+    Build a FAISS index of the given type over vectors, training it on a sample first if needed.
+
+    With a "quantization" parameter, the vectors are stored as float16 or 8-bit scalar codes
+    (2 or 1 bytes per dimension instead of 4) and searched in that form.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    dimension = vectors.shape[1]
+    quantizer = _SCALAR_QUANTIZERS.get(params.get("quantization"))
+
+    if index_type == 'flat' and quantizer is not None:
+        index = faiss.IndexScalarQuantizer(dimension, quantizer, faiss.METRIC_L2)
+    elif index_type == 'flat':
+        index = faiss.IndexFlatL2(dimension)
+    elif index_type == 'hnsw' and quantizer is not None:
+        index = faiss.IndexHNSWSQ(dimension, quantizer, params["m"])
+    elif index_type == 'hnsw':
+        index = faiss.IndexHNSWFlat(dimension, params["m"])
+    elif index_type == 'ivf' and quantizer is not None:
+        index = faiss.IndexIVFScalarQuantizer(faiss.IndexFlatL2(dimension), dimension, params["nlist"], quantizer)
+    elif index_type == 'ivf':
+        index = faiss.IndexIVFFlat(faiss.IndexFlatL2(dimension), dimension, params["nlist"])
+    elif index_type == 'ivfpq':
+        index = faiss.IndexIVFPQ(faiss.IndexFlatL2(dimension), dimension, params["nlist"], params["pq_m"], params["pq_nbits"])
+    else:
+        raise ValueError(f"Unsupported index type '{index_type}'. Please use one of {INDEX_TYPES}.")
+
+    if not index.is_trained:
+        sample_size = min(len(vectors), config['index_train_sample'])
+        sample = vectors[np.random.default_rng(0).choice(len(vectors), sample_size, replace=False)]
+        index.train(sample)
+    index.add(vectors)
+    configure_search(index, params)
+    return index
+
+def configure_search(index, params):
+    """Apply search-time parameters, which are not all restored when an index is read back from disk."""
+    # The downcast view does not own the index, so the original object is what gets returned.
+    concrete = faiss.downcast_index(index)
+    if "ef_search" in params and hasattr(concrete, "hnsw"):
+        concrete.hnsw.efSearch = params["ef_search"]
+    if "nprobe" in params and hasattr(concrete, "nprobe"):
+        concrete.nprobe = params["nprobe"]
+    return index
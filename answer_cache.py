@@ -0,0 +1,188 @@
+import os
+import time
+import sqlite3
+import threading
+import concurrent.futures
+import numpy as np
+from config import config
+
+# Directory under cache_path holding one answer cache file per selection of documents.
+ANSWERS_DIR = 'answers'
+
+# Shared by all answer caches; a single worker keeps each cache's writes in the order they were made.
+_WRITER = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="rag-answer-cache")
+
+class AnswerCache:
+    """
+    Semantic cache of answers keyed by the embedding of the standalone question.
+
+    A lookup hits when a stored question's cosine similarity to the new one reaches the threshold.
+    Entries are bounded by LRU size and TTL, and all of them are dropped when the index version changes.
+    The normalized question vectors are kept as one float32 matrix. Each change is written to the
+    SQLite file row by row, on a background thread, so answering never waits for the disk.
+    """
+
+    def __init__(self, cache_file, index_version, threshold=None, max_entries=None, ttl=None):
+        self.cache_file = cache_file
+        self.threshold = threshold if threshold is not None else config['answer_cache_threshold']
+        self.max_entries = max_entries if max_entries is not None else config['answer_cache_size']
+        self.ttl = ttl if ttl is not None else config['answer_cache_ttl']
+        self.index_version = index_version
+        self._lock = threading.Lock()
+        self._pending = None
+        self._matrix = np.empty((0, 0), dtype=np.float32)
+        self._ids = np.empty(0, dtype=np.int64)
+        self._created = np.empty(0, dtype=np.float64)
+        # Larger is more recently used.
+        self._used = np.empty(0, dtype=np.int64)
+        self._answers = []
+        self._next_id = 0
+        self._clock = 0
+        self._load()
+
+    def _connect(self):
+        os.makedirs(os.path.dirname(self.cache_file) or ".", exist_ok=True)
+        conn = sqlite3.connect(self.cache_file)
+        try:
+            with conn:
+                conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS answers ("
+                    "id INTEGER PRIMARY KEY, question TEXT, vector BLOB, answer TEXT, created REAL, used INTEGER)"
+                )
+                conn.execute("INSERT OR IGNORE INTO meta VALUES ('index_version', ?)", (self.index_version,))
+        except sqlite3.Error:
+            conn.close()
+            raise
+        return conn
+
+    def _load(self):
+        try:
+            conn = self._connect()
+        except sqlite3.Error as e:
+            print(f"Warning: Could not read answer cache {self.cache_file}. It may be corrupted. Error: {e}")
+            try:
+                os.remove(self.cache_file)
+            except OSError:
+                pass
+            return
+        try:
+            stored_version = conn.execute("SELECT value FROM meta WHERE key = 'index_version'").fetchone()[0]
+            if stored_version != self.index_version:
+                # The index changed since these answers were cached, so none of them can be trusted.
+                with conn:
+                    conn.execute("DELETE FROM answers")
+                    conn.execute("UPDATE meta SET value = ? WHERE key = 'index_version'", (self.index_version,))
+                return
+            rows = conn.execute("SELECT id, vector, answer, created, used FROM answers ORDER BY used").fetchall()
+        except sqlite3.Error as e:
+            print(f"Warning: Could not read answer cache {self.cache_file}. It may be corrupted. Error: {e}")
+            return
+        finally:
+            conn.close()
+
+        if not rows:
+            return
+        vectors = [np.frombuffer(vector, dtype=np.float32) for _, vector, _, _, _ in rows]
+        if len({len(vector) for vector in vectors}) > 1:
+            return
+        self._matrix = np.vstack(vectors)
+        self._ids = np.array([row[0] for row in rows], dtype=np.int64)
+        self._answers = [row[2] for row in rows]
+        self._created = np.array([row[3] for row in rows], dtype=np.float64)
+        self._used = np.array([row[4] for row in rows], dtype=np.int64)
+        self._clock = int(self._used.max()) + 1
+        self._next_id = int(self._ids.max()) + 1
+        with self._lock:
+            expired = self._expire()
+            if expired:
+                self._submit(deleted=expired)
+
+    def _write(self, inserted=(), deleted=(), touched=()):
+        """Apply one batch of changes to the cache file; runs on the writer thread."""
+        try:
+            conn = self._connect()
+        except sqlite3.Error as e:
+            print(f"Warning: Could not write answer cache {self.cache_file}. Error: {e}")
+            return
+        try:
+            with conn:
+                conn.executemany("INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?, ?, ?)", inserted)
+                conn.executemany("DELETE FROM answers WHERE id = ?", [(entry_id,) for entry_id in deleted])
+                conn.executemany("UPDATE answers SET used = ? WHERE id = ?", touched)
+        except sqlite3.Error as e:
+            print(f"Warning: Could not write answer cache {self.cache_file}. Error: {e}")
+        finally:
+            conn.close()
+
+    def _submit(self, **changes):
+        self._pending = _WRITER.submit(self._write, **changes)
+
+    def flush(self):
+        """Wait until every change made so far is written to the cache file."""
+        pending = self._pending
+        if pending is not None:
+            pending.result()
+
+    def _keep(self, mask):
+        """Keep only the entries where mask is true; return the IDs of the others. Caller holds _lock."""
+        dropped = [int(entry_id) for entry_id in self._ids[~mask]]
+        if dropped:
+            self._matrix = self._matrix[mask]
+            self._ids = self._ids[mask]
+            self._created = self._created[mask]
+            self._used = self._used[mask]
+            self._answers = [answer for answer, keep in zip(self._answers, mask) if keep]
+        return dropped
+
+    def _expire(self):
+        """Drop the expired entries and return their IDs. Caller holds _lock."""
+        if not self.ttl or not len(self._ids):
+            return []
+        return self._keep(self._created >= time.time() - self.ttl)
+
+    @staticmethod
+    def _normalize(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def get(self, vector):
+        """Return the cached answer for the most similar question above the threshold, or None."""
+        query = self._normalize(vector)
+        with self._lock:
+            expired = self._expire()
+            answer, touched = None, []
+            if len(self._ids) and self._matrix.shape[1] == query.shape[0]:
+                similarities = self._matrix @ query
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    self._used[best] = self._clock
+                    self._clock += 1
+                    answer = self._answers[best]
+                    touched = [(int(self._used[best]), int(self._ids[best]))]
+            if expired or touched:
+                self._submit(deleted=expired, touched=touched)
+            return answer
+
+    def set(self, question, vector, answer):
+        vector = self._normalize(vector)
+        with self._lock:
+            deleted = self._expire()
+            if len(self._ids) and self._matrix.shape[1] != vector.shape[0]:
+                # Vectors of another size can never match again, so they are dropped rather than kept.
+                deleted += self._keep(np.zeros(len(self._ids), dtype=bool))
+            entry_id, created, used = self._next_id, time.time(), self._clock
+            self._next_id += 1
+            self._clock += 1
+            self._matrix = np.vstack([self._matrix, vector[None, :]]) if len(self._ids) else vector[None, :].copy()
+            self._ids = np.append(self._ids, entry_id)
+            self._created = np.append(self._created, created)
+            self._used = np.append(self._used, used)
+            self._answers.append(answer)
+            if len(self._ids) > self.max_entries:
+                mask = np.ones(len(self._ids), dtype=bool)
+                mask[np.argsort(self._used)[:len(self._ids) - self.max_entries]] = False
+                deleted += self._keep(mask)
+            inserted = [] if entry_id in deleted else [(entry_id, question, vector.tobytes(), answer, created, used)]
+            self._submit(inserted=inserted, deleted=deleted)
@@ -0,0 +1,92 @@
+import json
+import time
+import concurrent.futures
+from config import config
+
+class BatchManager:
+    """Answer a JSONL file of independent questions concurrently against one loaded index."""
+
+    def __init__(self, rag_manager, concurrency=None):
+        self.rag_manager = rag_manager
+        self.concurrency = concurrency or config['batch_concurrency']
+
+    @staticmethod
+    def read_questions(questions_path):
+        """
+        Read questions from a JSONL file.
+
+        Each line is either a JSON string or an object with a "question" and optionally an "id"
+        and a "chat_history" of [question, answer] pairs. Questions without an id are numbered.
+        """
+        questions = []
+        with open(questions_path, 'r', encoding='utf-8') as f:
+            for line_number, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                item = json.loads(line)
+                if isinstance(item, str):
+                    item = {"question": item}
+                if "question" not in item:
+                    raise ValueError(f"Line {line_number} of {questions_path} has no 'question'.")
+                item.setdefault("id", len(questions) + 1)
+                questions.append(item)
+        return questions
+
+    def _answer(self, item):
+        start = time.perf_counter()
+        result = {"id": item["id"], "question": item["question"]}
+        try:
+            chat_history = [tuple(turn) for turn in item.get("chat_history", [])]
+            result["answer"] = self.rag_manager.ask(item["question"], chat_history)
+        except Exception as e:
+            result["error"] = f"{type(e).__name__}: {e}"
+        result["latency"] = round(time.perf_counter() - start, 4)
+        return result
+
+    def run(self, questions_path, out_path):
+        """Answer every question, appending each result to out_path as soon as it is ready, and return a summary."""
+        questions = self.read_questions(questions_path)
+        print(f"Answering {len(questions)} question(s) with concurrency {self.concurrency}...")
+
+        latencies, errors = [], 0
+        start = time.perf_counter()
+        with open(out_path, 'w', encoding='utf-8') as out, \
+                concurrent.futures.ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            futures = [executor.submit(self._answer, item) for item in questions]
+            for future in concurrent.futures.as_completed(futures):
+                result = future.result()
+                # Results are written from this thread only, in completion order.
+                out.write(json.dumps(result) + "\n")
+                out.flush()
+                latencies.append(result["latency"])
+                errors += "error" in result
+        elapsed = time.perf_counter() - start
+
+        summary = self.summarize(latencies, errors, elapsed)
+        self.print_summary(summary, out_path)
+        return summary
+
+    @staticmethod
+    def summarize(latencies, errors, elapsed):
+        latencies = sorted(latencies)
+
+        def percentile(p):
+            return latencies[min(len(latencies) - 1, int(p * len(latencies)))] if latencies else 0.0
+
+        return {
+            "questions": len(latencies),
+            "errors": errors,
+            "elapsed": elapsed,
+            "questions_per_second": len(latencies) / elapsed if elapsed else 0.0,
+            "latency_mean": sum(latencies) / len(latencies) if latencies else 0.0,
+            "latency_p50": percentile(0.5),
+            "latency_p95": percentile(0.95),
+            "latency_max": latencies[-1] if latencies else 0.0,
+        }
+
+    @staticmethod
+    def print_summary(summary, out_path):
+        print(f"Answered {summary['questions']} question(s) in {summary['elapsed']:.2f}s "
+              f"({summary['questions_per_second']:.2f} questions/s, {summary['errors']} error(s)). Results in {out_path}")
+        print(f"Latency per question: mean {summary['latency_mean']:.2f}s, p50 {summary['latency_p50']:.2f}s, "
+              f"p95 {summary['latency_p95']:.2f}s, max {summary['latency_max']:.2f}s")
@@ -0,0 +1,131 @@
+"""
+Generator of synthetic .txt, .md, .pdf and .docx corpora of a chosen size.
+
+Text is drawn from a fixed vocabulary with a seeded random generator, and sprinkled with error
+codes and identifiers, so the same arguments always produce the same documents.
+"""
+
+import os
+import random
+import zipfile
+from xml.sax.saxutils import escape
+
+FORMATS = ('txt', 'md', 'pdf', 'docx')
+
+_VOCABULARY = (
+    "system index query vector document server client request response cache memory disk network "
+    "latency throughput upload download config setting value error warning retry timeout limit file "
+    "page section table record field user session token model answer question search result chunk "
+    "shard batch worker thread process queue lock update delete insert build load save start stop "
+    "the a an of to in on for with by from and or is are was be can will should must may not every"
+).split()
+
+def _sentence(rng):
+    words = [rng.choice(_VOCABULARY) for _ in range(rng.randint(8, 20))]
+    if rng.random() < 0.1:
+        words.insert(rng.randrange(len(words)), f"ERR-{rng.randint(1000, 9999)}")
+    return " ".join(words).capitalize() + "."
+
+def _paragraphs(rng, size_bytes):
+    paragraphs, total = [], 0
+    while total < size_bytes:
+        paragraph = " ".join(_sentence(rng) for _ in range(rng.randint(3, 8)))
+        paragraphs.append(paragraph)
+        total += len(paragraph) + 2
+    return paragraphs
+
+def write_txt(path, paragraphs):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("\n\n".join(paragraphs) + "\n")
+
+def write_md(path, paragraphs):
+    with open(path, 'w', encoding='utf-8') as f:
+        for i, paragraph in enumerate(paragraphs):
+            if i % 5 == 0:
+                f.write(f"## Section {i // 5 + 1}\n\n")
+            f.write(paragraph + "\n\n")
+
+def write_pdf(path, paragraphs, lines_per_page=40, line_length=90):
+    """Write a PDF with Helvetica text, wrapped into lines and pages, without any PDF library."""
+    lines = []
+    for paragraph in paragraphs:
+        words, line = paragraph.split(), ""
+        for word in words:
+            if len(line) + len(word) + 1 > line_length:
+                lines.append(line)
+                line = word
+            else:
+                line = f"{line} {word}".strip()
+        lines.extend([line, ""])
+    pages = [lines[i:i + lines_per_page] for i in range(0, len(lines), lines_per_page)] or [[""]]
+
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    page_ids = []
+    for page in pages:
+        text = " T* ".join(f"({line.replace(chr(92), '').replace('(', '').replace(')', '')}) Tj" for line in page)
+        stream = f"BT /F1 11 Tf 14 TL 50 750 Td {text} ET"
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents {len(objects)} 0 R /Resources << /Font << /F1 3 0 R >> >> >>")
+        page_ids.append(len(objects))
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(f'{i} 0 R' for i in page_ids)}] /Count {len(page_ids)} >>"
+
+    out = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1")
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    out += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode()
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    with open(path, 'wb') as f:
+        f.write(out)
+
+def write_docx(path, paragraphs):
+    """Write a minimal Word document holding one paragraph per entry."""
+    body = "".join(f"<w:p><w:r><w:t>{escape(paragraph)}</w:t></w:r></w:p>" for paragraph in paragraphs)
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as docx:
+        docx.writestr("[Content_Types].xml", (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            '<Override PartName="/word/document.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+            '</Types>'
+        ))
+        docx.writestr("_rels/.rels", (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="word/document.xml"/>'
+            '</Relationships>'
+        ))
+        docx.writestr("word/document.xml", (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+            f'<w:body>{body}</w:body></w:document>'
+        ))
+
+_WRITERS = {'txt': write_txt, 'md': write_md, 'pdf': write_pdf, 'docx': write_docx}
+
+def generate_corpus(out_dir, num_files, file_size_kb, formats=FORMATS, seed=0):
+    """Write num_files documents of about file_size_kb KiB of text each, cycling through formats. Returns their paths."""
+    os.makedirs(out_dir, exist_ok=True)
+    rng = random.Random(seed)
+    paths = []
+    for i in range(num_files):
+        file_format = formats[i % len(formats)]
+        if file_format not in _WRITERS:
+            raise ValueError(f"Unsupported format '{file_format}'. Please use one of {FORMATS}.")
+        path = os.path.join(out_dir, f"doc_{i:04d}.{file_format}")
+        _WRITERS[file_format](path, _paragraphs(rng, file_size_kb * 1024))
+        paths.append(path)
+    return paths
+
+def generate_questions(num_questions, seed=1):
+    """Return questions built from the corpus vocabulary, so they retrieve real chunks."""
+    rng = random.Random(seed)
+    content_words = [word for word in _VOCABULARY if len(word) > 3]
+    return [
+        f"What does the document say about {rng.choice(content_words)} and {rng.choice(content_words)}?"
+        for _ in range(num_questions)
+    ]
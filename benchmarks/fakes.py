@@ -0,0 +1,76 @@
+"""
+Offline stand-ins for the Ollama embedding and chat models, with configurable latency.
+
+Both are deterministic, so benchmark runs on the same corpus do the same work every time.
+"""
+
+import re
+import time
+import hashlib
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+_WORD = re.compile(r"\w+")
+
+class FakeEmbeddings(Embeddings):
+    """
+    Hashed bag-of-words vectors, so texts sharing words are close, as with a real embedding model.
+
+    Each call sleeps latency_per_call plus latency_per_text for every text, to model a local server.
+    """
+
+    def __init__(self, dimension=384, latency_per_call=0.0, latency_per_text=0.0):
+        self.dimension = dimension
+        self.latency_per_call = latency_per_call
+        self.latency_per_text = latency_per_text
+        self.calls = 0
+        self.texts = 0
+
+    def _vector(self, text):
+        vector = np.zeros(self.dimension, dtype=np.float32)
+        for word in _WORD.findall(text.lower()):
+            digest = hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest()
+            bucket = int.from_bytes(digest[:4], "little") % self.dimension
+            vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts):
+        self.calls += 1
+        self.texts += len(texts)
+        time.sleep(self.latency_per_call + self.latency_per_text * len(texts))
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+class FakeChatModel(BaseChatModel):
+    """Chat model that streams a fixed-length answer after a first-token delay, one token at a time."""
+
+    first_token_latency: float = 0.0
+    token_latency: float = 0.0
+    answer_tokens: int = 32
+
+    @property
+    def _llm_type(self):
+        return "fake-benchmark-chat"
+
+    def _tokens(self, messages):
+        words = _WORD.findall(messages[-1].content) or ["answer"]
+        return [f"{words[i % len(words)]} " for i in range(self.answer_tokens)]
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        text = "".join(chunk.message.content for chunk in self._stream(messages, stop, run_manager, **kwargs))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.first_token_latency)
+        for token in self._tokens(messages):
+            time.sleep(self.token_latency)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
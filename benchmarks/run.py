@@ -0,0 +1,256 @@
+"""
+Offline performance benchmarks for indexing, caching and answering.
+
+Runs RAGManager against a synthetic corpus with the fake models from benchmarks.fakes, writes
+the measurements as JSON and, given a baseline file from an earlier run, reports regressions.
+
+    python -m benchmarks.run --files 20 --file-kb 32 --out results.json --baseline baseline.json
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import contextlib
+from unittest.mock import patch
+import faiss
+import numpy as np
+from config import config
+import rag_manager as rag_module
+from rag_manager import RAGManager, _parse_file
+from cache_manager import CacheManager
+from benchmarks.fakes import FakeEmbeddings, FakeChatModel
+from benchmarks.corpus import FORMATS, generate_corpus, generate_questions
+
+def _metric(value, unit, better="lower"):
+    return {"value": round(value, 6), "unit": unit, "better": better}
+
+@contextlib.contextmanager
+def _environment(workdir, embeddings, chat_model, overrides=None):
+    """Point caches and indexes at workdir, swap in the fake models and silence RAGManager's progress output."""
+    settings = {
+        'cache_path': os.path.join(workdir, "cache"),
+        'index_path': os.path.join(workdir, "indexes"),
+        'cache_max_bytes': 0,
+    }
+    settings.update(overrides or {})
+    with patch.dict(config, settings), \
+            patch.object(rag_module, 'OllamaEmbeddings', lambda **kwargs: embeddings), \
+            patch.object(rag_module, 'ChatOllama', lambda **kwargs: chat_model), \
+            contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+def _timed(function):
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start
+
+def _new_manager(file_paths):
+    return RAGManager(file_paths=file_paths, index_path=config['index_path'])
+
+def bench_index(file_paths, workdir, embeddings, chat_model):
+    """Time a cold build (nothing cached), a warm build from saved shards, and a memory-mapped restore."""
+    results = {}
+    with _environment(workdir, embeddings, chat_model):
+        manager = _new_manager(file_paths)
+        cold = _timed(manager._create_index)
+        num_chunks = manager.vector_store.index.ntotal
+        warm = _timed(_new_manager(file_paths)._create_index)
+
+    with _environment(workdir, embeddings, chat_model, {'index_load_mode': 'mmap'}):
+        _new_manager(file_paths)._create_index()
+        restore = _timed(_new_manager(file_paths)._create_index)
+
+    size_mb = sum(os.path.getsize(path) for path in file_paths) / 2**20
+    results["index.chunks"] = _metric(num_chunks, "chunks", better="none")
+    results["index.cold_seconds"] = _metric(cold, "s")
+    results["index.cold_chunks_per_second"] = _metric(num_chunks / cold, "chunks/s", better="higher")
+    results["index.cold_mb_per_second"] = _metric(size_mb / cold, "MiB/s", better="higher")
+    results["index.warm_seconds"] = _metric(warm, "s")
+    results["index.mmap_restore_seconds"] = _metric(restore, "s")
+    return results
+
+def bench_cache(file_paths, workdir, repeat=5):
+    """Time CacheManager's miss, write and hit paths (including building the Documents) and the file hash lookup, per file."""
+    cache_path = os.path.join(workdir, "cache_bench")
+    shutil.rmtree(cache_path, ignore_errors=True)
+    docs = {path: _parse_file(path, config['chunk_size'], config['chunk_overlap']) for path in file_paths}
+    timings = {"get_miss": [], "set": [], "get_hit": [], "file_hash": []}
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        for round_number in range(repeat):
+            manager = CacheManager(cache_path=os.path.join(cache_path, str(round_number)), max_bytes=0)
+            for path in file_paths:
+                timings["get_miss"].append(_timed(lambda: manager.get(path, "bench-model")))
+                timings["set"].append(_timed(lambda: manager.set(path, "bench-model", docs[path])))
+                timings["get_hit"].append(_timed(lambda: list(manager.get(path, "bench-model"))))
+                timings["file_hash"].append(_timed(lambda: manager.get_file_hash(path)))
+
+    return {f"cache.{name}_ms": _metric(1000 * float(np.median(values)), "ms") for name, values in timings.items()}
+
+def bench_ask(file_paths, workdir, embeddings, chat_model, num_questions):
+    """Time ask() end to end over generated questions and report latency percentiles and throughput."""
+    questions = generate_questions(num_questions)
+    with _environment(workdir, embeddings, chat_model):
+        manager = _new_manager(file_paths)
+        manager.setup()
+        latencies = [_timed(lambda: manager.ask(question, [])) for question in questions]
+
+    latencies_ms = 1000 * np.array(latencies)
+    return {
+        "ask.p50_ms": _metric(float(np.percentile(latencies_ms, 50)), "ms"),
+        "ask.p95_ms": _metric(float(np.percentile(latencies_ms, 95)), "ms"),
+        "ask.p99_ms": _metric(float(np.percentile(latencies_ms, 99)), "ms"),
+        "ask.questions_per_second": _metric(len(latencies) / sum(latencies), "questions/s", better="higher"),
+    }
+
+QUANTIZATION_SETTINGS = {
+    "flat": {},
+    "fp16": {'vector_quantization': 'fp16', 'rescore_factor': 0},
+    "fp16_rescored": {'vector_quantization': 'fp16'},
+    "int8": {'vector_quantization': 'int8', 'rescore_factor': 0},
+    "int8_rescored": {'vector_quantization': 'int8'},
+}
+
+def bench_quantization(file_paths, workdir, embeddings, chat_model, num_questions):
+    """Compare recall@k, search latency and index size of the quantized flat indexes against the exact one."""
+    k = config['k_retriever']
+    vectors = embeddings.embed_documents(generate_questions(num_questions))
+    results, exact = {}, None
+    for name, overrides in QUANTIZATION_SETTINGS.items():
+        with _environment(workdir, embeddings, chat_model, {'index_type': 'flat', 'index_load_mode': 'memory', **overrides}):
+            manager = _new_manager(file_paths)
+            manager._create_index()
+            found, latencies = [], []
+            for vector in vectors:
+                start = time.perf_counter()
+                docs = manager._search_by_vector(vector, k)
+                latencies.append(time.perf_counter() - start)
+                found.append({doc.id for doc in docs})
+        exact = exact or found
+        recall = np.mean([len(ids & exact_ids) / max(1, len(exact_ids)) for ids, exact_ids in zip(found, exact)])
+        results[f"quantization.{name}.recall_at_k"] = _metric(float(recall), "fraction", better="higher")
+        results[f"quantization.{name}.search_p50_ms"] = _metric(1000 * float(np.median(latencies)), "ms")
+        results[f"quantization.{name}.index_mb"] = _metric(len(faiss.serialize_index(manager.vector_store.index)) / 2**20, "MiB")
+    return results
+
+PARTITION_SETTINGS = {
+    "single": {},
+    "partitions_4": {'search_partitions': 4},
+}
+
+def bench_partitions(file_paths, workdir, embeddings, chat_model, num_questions):
+    """Compare building from saved shards and searching a partitioned index against one combined index."""
+    k = config['k_retriever']
+    vectors = embeddings.embed_documents(generate_questions(num_questions))
+    results, exact = {}, None
+    for name, overrides in PARTITION_SETTINGS.items():
+        # The shards are shared by both settings, so only the first builds them.
+        with _environment(workdir, embeddings, chat_model, {'index_type': 'flat', 'index_load_mode': 'mmap', **overrides}):
+            manager = _new_manager(file_paths)
+            manager._create_index()
+            shutil.rmtree(os.path.join(config['index_path'], "assembled"), ignore_errors=True)
+            shutil.rmtree(os.path.join(config['index_path'], "partitions"), ignore_errors=True)
+            build = _timed(manager._create_index)
+            found, latencies = [], []
+            for vector in vectors:
+                start = time.perf_counter()
+                docs = manager._search_by_vector(vector, k)
+                latencies.append(time.perf_counter() - start)
+                found.append({doc.id for doc in docs})
+        exact = exact or found
+        recall = np.mean([len(ids & exact_ids) / max(1, len(exact_ids)) for ids, exact_ids in zip(found, exact)])
+        results[f"partitions.{name}.build_seconds"] = _metric(build, "s")
+        results[f"partitions.{name}.recall_at_k"] = _metric(float(recall), "fraction", better="higher")
+        results[f"partitions.{name}.search_p50_ms"] = _metric(1000 * float(np.median(latencies)), "ms")
+    return results
+
+def run_benchmarks(args, workdir):
+    corpus_dir = os.path.join(workdir, "corpus")
+    file_paths = generate_corpus(corpus_dir, args.files, args.file_kb, formats=args.formats, seed=args.seed)
+    # Backdate the corpus as for documents that were not just edited, which CacheManager recognizes by stat alone.
+    past = time.time() - 3600
+    for path in file_paths:
+        os.utime(path, (past, past))
+    embeddings = FakeEmbeddings(latency_per_call=args.embed_call_latency, latency_per_text=args.embed_text_latency)
+    chat_model = FakeChatModel(first_token_latency=args.chat_first_token_latency, token_latency=args.chat_token_latency)
+
+    results = {}
+    results.update(bench_index(file_paths, os.path.join(workdir, "index_bench"), embeddings, chat_model))
+    results.update(bench_cache(file_paths, workdir))
+    results.update(bench_ask(file_paths, os.path.join(workdir, "ask_bench"), embeddings, chat_model, args.questions))
+    results.update(bench_quantization(file_paths, os.path.join(workdir, "quantization_bench"), embeddings, chat_model, args.questions))
+    results.update(bench_partitions(file_paths, os.path.join(workdir, "partitions_bench"), embeddings, chat_model, args.questions))
+    return results
+
+def compare(results, baseline, tolerance):
+    """Return (name, baseline value, current value, relative change) for metrics that got worse by more than tolerance."""
+    regressions = []
+    for name, metric in results.items():
+        previous = baseline.get(name)
+        if previous is None or metric["better"] == "none" or not previous["value"]:
+            continue
+        change = (metric["value"] - previous["value"]) / previous["value"]
+        worse = change > tolerance if metric["better"] == "lower" else change < -tolerance
+        if worse:
+            regressions.append((name, previous["value"], metric["value"], change))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the offline performance benchmarks.")
+    parser.add_argument("--files", type=int, default=20, help="Number of documents in the synthetic corpus.")
+    parser.add_argument("--file-kb", type=int, default=32, help="Approximate text size of each document in KiB.")
+    parser.add_argument("--formats", type=lambda value: tuple(value.split(",")), default=FORMATS, help="Comma-separated document formats to cycle through.")
+    parser.add_argument("--questions", type=int, default=50, help="Number of questions timed with ask().")
+    parser.add_argument("--embed-call-latency", type=float, default=0.0, help="Seconds the fake embedder sleeps per request.")
+    parser.add_argument("--embed-text-latency", type=float, default=0.0, help="Seconds the fake embedder sleeps per text.")
+    parser.add_argument("--chat-first-token-latency", type=float, default=0.0, help="Seconds before the fake chat model's first token.")
+    parser.add_argument("--chat-token-latency", type=float, default=0.0, help="Seconds the fake chat model takes per token.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the corpus generator.")
+    parser.add_argument("--workdir", type=str, default=None, help="Directory for the corpus, caches and indexes (default: a temporary directory).")
+    parser.add_argument("--out", type=str, default="bench_results.json", help="Where to write the results.")
+    parser.add_argument("--baseline", type=str, default=None, help="Results of an earlier run to compare against.")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="Relative slowdown tolerated before a metric counts as a regression.")
+    args = parser.parse_args(argv)
+
+    if args.workdir:
+        shutil.rmtree(args.workdir, ignore_errors=True)
+        results = run_benchmarks(args, args.workdir)
+    else:
+        with tempfile.TemporaryDirectory() as workdir:
+            results = run_benchmarks(args, workdir)
+
+    report = {
+        "meta": {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "args": {key: value for key, value in vars(args).items() if key not in ("out", "baseline", "workdir")},
+        },
+        "results": results,
+    }
+    with open(args.out, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    for name, metric in results.items():
+        print(f"{name:42} {metric['value']:>14.3f} {metric['unit']}")
+    print(f"Results written to {args.out}")
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.tolerance)
+        for name, previous, current, change in regressions:
+            print(f"REGRESSION {name}: {previous:.3f} -> {current:.3f} ({change:+.1%})")
+        if regressions:
+            return 1
+        print(f"No regressions beyond {args.tolerance:.0%} against {args.baseline}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,47 +1,369 @@
 import os
+import time
 import hashlib
-import pickle
+import sqlite3
+import threading
 from config import config
+from chunk_file import ChunkFile, ChunkWriter, write_chunks
+from embedding_cache import EMBEDDINGS_FILE, compact_embeddings, embeddings_size, trim_embeddings
+from answer_cache import ANSWERS_DIR
+
+# A file modified this close to when its hash was recorded could change again within the same
+# timestamp tick without its stat signature changing, so such entries are re-hashed to be safe.
+RACY_WINDOW_NS = 2_000_000_000
+HASH_BUFFER_SIZE = 1 << 20
+CACHE_FILE_SUFFIXES = ('.chunks', '.pkl', '.tmp')
+# A temporary file younger than this may be a write still in progress, in this or another process.
+TMP_GRACE_SECONDS = 3600
+# The embedding cache is trimmed to this fraction of its share of the limit, so it is not trimmed on every write.
+EMBEDDINGS_LOW_WATER = 0.8
 
 class CacheManager:
-    def __init__(self, cache_path=None):
+    def __init__(self, cache_path=None, max_bytes=None):
         self.cache_path = cache_path or config.get('cache_path', './cache')
+        self.max_bytes = max_bytes if max_bytes is not None else config.get('cache_max_bytes', 0)
         os.makedirs(self.cache_path, exist_ok=True)
+        self._lock = threading.Lock()
+        self._hashes = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.orphans_removed = 0
+        self._conn = sqlite3.connect(os.path.join(self.cache_path, 'cache_index.sqlite'), check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS file_hashes ("
+                "path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, inode INTEGER, hash TEXT, recorded_ns INTEGER)"
+            )
+            # One row per cached chunk file, and the source files it was parsed from.
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, file_hash TEXT, size INTEGER, last_access REAL)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS entry_sources (key TEXT, path TEXT, PRIMARY KEY (key, path))"
+            )
+
+    @staticmethod
+    def _make_cache_key(file_hash, embedding_model):
+        return f"{file_hash}_{embedding_model.replace(':', '_')}.chunks"
 
     def _get_cache_key(self, file_path, embedding_model):
         """Generate a unique cache key based on file content and embedding model."""
-        file_hash = self._hash_file_content(file_path)
-        return f"{file_hash}_{embedding_model.replace(':', '_')}.pkl"
+        return self._make_cache_key(self.get_file_hash(file_path), embedding_model)
 
     def _hash_file_content(self, file_path):
         """Compute the SHA256 hash of the file's content."""
         hasher = hashlib.sha256()
-        with open(file_path, 'rb') as f:
-            while chunk := f.read(8192):
-                hasher.update(chunk)
+        buffer = bytearray(HASH_BUFFER_SIZE)
+        view = memoryview(buffer)
+        with open(file_path, 'rb', buffering=0) as f:
+            while size := f.readinto(buffer):
+                hasher.update(view[:size])
         return hasher.hexdigest()
 
+    def get_file_hash(self, file_path):
+        """
+        Return the content hash used to identify a file in caches and index manifests.
+
+        Hashes are remembered by (path, size, mtime_ns, inode), in memory for this run and in
+        SQLite across runs, so an unchanged file is recognized from a stat() without reading it.
+        """
+        path = os.path.abspath(file_path)
+        stat = os.stat(path)
+        signature = (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+
+        with self._lock:
+            entry = self._hashes.get(path)
+            if entry is None:
+                row = self._conn.execute(
+                    "SELECT size, mtime_ns, inode, hash, recorded_ns FROM file_hashes WHERE path = ?", (path,)
+                ).fetchone()
+                if row is not None:
+                    entry = (tuple(row[:3]), row[3], row[4])
+        if entry is not None:
+            entry_signature, file_hash, recorded_ns = entry
+            if entry_signature == signature and stat.st_mtime_ns < recorded_ns - RACY_WINDOW_NS:
+                return file_hash
+
+        file_hash = self._hash_file_content(path)
+        recorded_ns = time.time_ns()
+        with self._lock:
+            self._hashes[path] = (signature, file_hash, recorded_ns)
+            try:
+                with self._conn:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO file_hashes VALUES (?, ?, ?, ?, ?, ?)",
+                        (path, *signature, file_hash, recorded_ns),
+                    )
+            except sqlite3.Error as e:
+                print(f"Warning: Could not record file hash for {path}. Error: {e}")
+        return file_hash
+
+    def _record_access(self, key, file_hash, file_path, size):
+        with self._lock:
+            try:
+                with self._conn:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)", (key, file_hash, size, time.time())
+                    )
+                    self._conn.execute(
+                        "INSERT OR IGNORE INTO entry_sources VALUES (?, ?)", (key, os.path.abspath(file_path))
+                    )
+            except sqlite3.Error as e:
+                print(f"Warning: Could not update cache index for {key}. Error: {e}")
+
+    def _remove_entry(self, key):
+        """Delete an entry's file and its rows. Must be called with the lock held."""
+        cache_file = os.path.join(self.cache_path, key)
+        if os.path.exists(cache_file):
+            os.remove(cache_file)
+        with self._conn:
+            self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            self._conn.execute("DELETE FROM entry_sources WHERE key = ?", (key,))
+
+    def _answer_files(self):
+        """Return (modification time, size, path) of each saved answer cache, oldest first."""
+        answers_dir = os.path.join(self.cache_path, ANSWERS_DIR)
+        if not os.path.isdir(answers_dir):
+            return []
+        files = []
+        for name in os.listdir(answers_dir):
+            path = os.path.join(answers_dir, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            if name.endswith('.json'):
+                files.append((stat.st_mtime, stat.st_size, path))
+        return sorted(files)
+
+    def _embeddings_size(self):
+        return embeddings_size(os.path.join(self.cache_path, EMBEDDINGS_FILE))
+
+    def _entries_size(self):
+        with self._lock:
+            return self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    def _size(self):
+        """Return the bytes taken by the chunk entries, the embedding cache and the answer caches."""
+        return self._entries_size() + self._embeddings_size() + sum(size for _, size, _ in self._answer_files())
+
+    def _evict(self, keep_key):
+        """
+        Free space until the caches fit in max_bytes, taking from each cache in proportion to its size.
+
+        Each keeps its share of the limit: chunk entries lose the least recently used first (never the one
+        just written), answer caches the oldest first and the embedding cache its least recently written
+        rows. Embeddings are trimmed in bulk to EMBEDDINGS_LOW_WATER of their share.
+        """
+        if not self.max_bytes:
+            return
+        entries_size = self._entries_size()
+        answer_files = self._answer_files()
+        answers_size = sum(size for _, size, _ in answer_files)
+        stored_embeddings = self._embeddings_size()
+        total = entries_size + answers_size + stored_embeddings
+        if total <= self.max_bytes:
+            return
+        share = self.max_bytes / total
+        entries_target, answers_target = entries_size * share, answers_size * share
+        with self._lock:
+            candidates = self._conn.execute(
+                "SELECT key, size FROM entries WHERE key != ? ORDER BY last_access", (keep_key,)
+            ).fetchall()
+            for key, size in candidates:
+                if entries_size <= entries_target:
+                    break
+                self._remove_entry(key)
+                entries_size -= size
+                self.evictions += 1
+            for _, size, path in answer_files:
+                if answers_size <= answers_target:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                answers_size -= size
+                self.evictions += 1
+        if stored_embeddings:
+            trimmed = trim_embeddings(os.path.join(self.cache_path, EMBEDDINGS_FILE), stored_embeddings * share * EMBEDDINGS_LOW_WATER)
+            with self._lock:
+                self.evictions += trimmed
+
     def get(self, file_path, embedding_model):
-        """Load processed documents from the cache."""
-        cache_key = self._get_cache_key(file_path, embedding_model)
+        """Load processed documents from the cache, or return None if there is no usable entry."""
+        file_hash = self.get_file_hash(file_path)
+        cache_key = self._make_cache_key(file_hash, embedding_model)
         cache_file = os.path.join(self.cache_path, cache_key)
 
+        # Entries from before the chunk file format are pickles, which are never loaded.
+        legacy_file = f"{os.path.splitext(cache_file)[0]}.pkl"
+        if os.path.exists(legacy_file):
+            os.remove(legacy_file)
+
         if os.path.exists(cache_file):
             try:
-                with open(cache_file, 'rb') as f:
-                    return pickle.load(f)
-            except (pickle.UnpicklingError, EOFError) as e:
-                print(f"Warning: Could not read cache file {cache_file}. It may be corrupted. Error: {e}")
-                return None
+                docs = ChunkFile(cache_file)
+            except (ValueError, OSError) as e:
+                print(f"Warning: Discarding unreadable cache file {cache_file}. It will be rebuilt. Error: {e}")
+                with self._lock:
+                    self._remove_entry(cache_key)
+            else:
+                with self._lock:
+                    self.hits += 1
+                self._record_access(cache_key, file_hash, file_path, os.path.getsize(cache_file))
+                return docs
+        with self._lock:
+            self.misses += 1
         return None
 
-    def set(self, file_path, embedding_model, data):
-        """Save processed documents to the cache."""
-        cache_key = self._get_cache_key(file_path, embedding_model)
+    def set(self, file_path, embedding_model, docs):
+        """Save processed documents to the cache, evicting old entries if it grows past max_bytes."""
+        file_hash = self.get_file_hash(file_path)
+        cache_key = self._make_cache_key(file_hash, embedding_model)
         cache_file = os.path.join(self.cache_path, cache_key)
 
         try:
-            with open(cache_file, 'wb') as f:
-                pickle.dump(data, f)
-        except (pickle.PicklingError, OSError) as e:
+            write_chunks(cache_file, docs)
+        except (TypeError, ValueError, OSError) as e:
             print(f"Warning: Could not write to cache file {cache_file}. Error: {e}")
+            return
+        self._record_access(cache_key, file_hash, file_path, os.path.getsize(cache_file))
+        self._evict(cache_key)
+
+    def write_through(self, file_path, embedding_model, docs):
+        """
+        Yield docs while saving them to the cache, like set() for chunks produced one at a time.
+
+        The entry is only written once every chunk has been; if the caller stops early or the
+        cache cannot be written, nothing is cached.
+        """
+        file_hash = self.get_file_hash(file_path)
+        cache_key = self._make_cache_key(file_hash, embedding_model)
+        cache_file = os.path.join(self.cache_path, cache_key)
+
+        writer = None
+        try:
+            writer = ChunkWriter(cache_file)
+        except OSError as e:
+            print(f"Warning: Could not write to cache file {cache_file}. Error: {e}")
+        try:
+            for doc in docs:
+                if writer is not None:
+                    try:
+                        writer.add(doc)
+                    except (TypeError, ValueError, OSError) as e:
+                        print(f"Warning: Could not write to cache file {cache_file}. Error: {e}")
+                        writer.abort()
+                        writer = None
+                yield doc
+            if writer is not None:
+                writer, finished = None, writer
+                try:
+                    finished.close()
+                except (TypeError, ValueError, OSError) as e:
+                    print(f"Warning: Could not write to cache file {cache_file}. Error: {e}")
+                    finished.abort()
+                    return
+                self._record_access(cache_key, file_hash, file_path, os.path.getsize(cache_file))
+                self._evict(cache_key)
+        finally:
+            if writer is not None:
+                writer.abort()
+
+    def live_hashes(self):
+        """Return the current content hashes of the files this cache has seen that still exist."""
+        with self._lock:
+            paths = [row[0] for row in self._conn.execute("SELECT path FROM file_hashes")]
+        hashes = set()
+        for path in paths:
+            try:
+                hashes.add(self.get_file_hash(path))
+            except OSError:
+                continue
+        return hashes
+
+    @staticmethod
+    def _is_intact(cache_file):
+        try:
+            ChunkFile(cache_file).verify()
+        except (ValueError, OSError):
+            return False
+        return True
+
+    def collect_garbage(self, verify=False):
+        """
+        Remove entries none of whose source files still exist with the content they were parsed from,
+        with verify also entries whose chunk file fails its checksum, files in the cache directory that
+        no entry refers to, and answer caches whose entries have all expired. Temporary files are only
+        removed once they are older than TMP_GRACE_SECONDS, since younger ones may be writes in
+        progress. Returns the number of files removed.
+        """
+        with self._lock:
+            entries = self._conn.execute("SELECT key, file_hash FROM entries").fetchall()
+            sources = {}
+            for key, path in self._conn.execute("SELECT key, path FROM entry_sources"):
+                sources.setdefault(key, []).append(path)
+
+        orphans = []
+        for key, file_hash in entries:
+            live = False
+            for path in sources.get(key, []):
+                try:
+                    live = os.path.isfile(path) and self.get_file_hash(path) == file_hash
+                except OSError:
+                    live = False
+                if live:
+                    break
+            # Chunk files are only checksummed here, since reading them does not check the whole file.
+            if not live or (verify and not self._is_intact(os.path.join(self.cache_path, key))):
+                orphans.append(key)
+
+        with self._lock:
+            for key in orphans:
+                self._remove_entry(key)
+            known = {key for key, _ in entries} - set(orphans)
+            now = time.time()
+            strays = []
+            for name in os.listdir(self.cache_path):
+                path = os.path.join(self.cache_path, name)
+                if not name.endswith(CACHE_FILE_SUFFIXES) or name in known:
+                    continue
+                try:
+                    if name.endswith('.tmp') and now - os.path.getmtime(path) < TMP_GRACE_SECONDS:
+                        continue
+                    os.remove(path)
+                except FileNotFoundError:
+                    continue
+                strays.append(name)
+
+        # Every entry of an answer cache is at least as old as the file's last write.
+        ttl = config.get('answer_cache_ttl', 0)
+        expired = [path for mtime, _, path in self._answer_files() if ttl and now - mtime > ttl]
+        for path in expired:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        removed = len(orphans) + len(strays) + len(expired)
+        self.orphans_removed += removed
+        return removed
+
+    def compact(self):
+        """Give the pages freed in the embedding cache back to the file system, which writes never do in full."""
+        compact_embeddings(os.path.join(self.cache_path, EMBEDDINGS_FILE))
+
+    def stats(self):
+        """Return the number of cached entries, the size of all caches and this session's hit, miss and eviction counts."""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        return {
+            "entries": entries,
+            "size_bytes": self._size(),
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "orphans_removed": self.orphans_removed,
+        }
@@ -0,0 +1,106 @@
+import threading
+import concurrent.futures
+from config import config
+
+HISTORY_MODES = ('replay', 'summary')
+
+# Shared by all histories, so a server with many sessions does not start a thread for each.
+_SUMMARIZER = concurrent.futures.ThreadPoolExecutor(max_workers=2, thread_name_prefix="rag-summary")
+
+def _truncate(text, max_tokens):
+    """Cut text to about max_tokens tokens, at a word boundary where possible."""
+    # Imported here so the chat prompt can start without LangChain, which context_assembly needs.
+    from context_assembly import CHARS_PER_TOKEN
+    limit = max_tokens * CHARS_PER_TOKEN
+    if len(text) <= limit:
+        return text
+    cut = text[:limit]
+    return cut[:cut.rfind(" ")] if " " in cut else cut
+
+class ChatHistory:
+    """
+    The (question, answer) turns replayed to the model with each new question.
+
+    In 'replay' mode the last max_replay_history turns are kept verbatim. In 'summary' mode only
+    the last history_recent_turns are kept verbatim; older turns are folded into a running summary
+    of at most history_summary_tokens by summarize(summary, turns, max_tokens), on a background
+    thread. Until a turn has been folded in, it is still replayed verbatim.
+    """
+
+    def __init__(self, summarize=None, mode=None, recent_turns=None, summary_tokens=None):
+        self.summarize = summarize
+        self.mode = mode or config['history_mode']
+        if self.mode not in HISTORY_MODES:
+            raise ValueError(f"Unsupported history mode '{self.mode}'. Please use one of {HISTORY_MODES}.")
+        if self.mode == 'summary' and summarize is None:
+            raise ValueError("The 'summary' history mode needs a summarize function.")
+        self.recent_turns = recent_turns if recent_turns is not None else config['history_recent_turns']
+        self.summary_tokens = summary_tokens or config['history_summary_tokens']
+        self.summary = ""
+        self._turns = []
+        self._pending = []
+        self._lock = threading.Lock()
+        self._future = None
+        self._generation = 0
+
+    def add(self, question, answer):
+        if not config.get('replay_history', True):
+            return
+        with self._lock:
+            self._turns.append((question, answer))
+            if self.mode == 'replay':
+                del self._turns[:-config.get('max_replay_history', 5)]
+                return
+            overflow = len(self._turns) - self.recent_turns
+            if overflow > 0:
+                self._pending.extend(self._turns[:overflow])
+                del self._turns[:overflow]
+            self._schedule()
+
+    def _schedule(self):
+        # One summarization per history at a time, so turns are folded in in order.
+        if self._pending and self._future is None:
+            self._future = _SUMMARIZER.submit(self._fold, list(self._pending), self._generation)
+
+    def _fold(self, turns, generation):
+        try:
+            summary = _truncate(self.summarize(self.summary, turns, self.summary_tokens).strip(), self.summary_tokens)
+        except Exception as e:
+            # Without a summary these turns would be replayed forever; drop them as replay mode would.
+            print(f"\nWarning: Could not summarize the chat history, older turns are dropped. Error: {e}")
+            summary = self.summary
+        with self._lock:
+            self._future = None
+            if generation == self._generation:
+                self.summary = summary
+                del self._pending[:len(turns)]
+            self._schedule()
+
+    def wait(self):
+        """Block until every turn that left the verbatim window is part of the summary."""
+        while True:
+            with self._lock:
+                future = self._future
+            if future is None:
+                return
+            future.result()
+
+    def snapshot(self):
+        """Return the summary and the turns to replay verbatim, consistent with each other."""
+        with self._lock:
+            return self.summary, self._pending + self._turns
+
+    def clear(self):
+        with self._lock:
+            # A summarization still running belongs to the old conversation and is discarded.
+            self._generation += 1
+            self.summary = ""
+            self._turns = []
+            self._pending = []
+
+    def __iter__(self):
+        return iter(self.snapshot()[1])
+
+    def __len__(self):
+        with self._lock:
+            return len(self._pending) + len(self._turns)
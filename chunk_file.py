@@ -0,0 +1,173 @@
+"""
+Compact, versioned file format for the parsed chunks of one document.
+
+A chunk file holds a fixed header, an array of byte offsets into a single UTF-8 blob with all
+chunk texts, and the chunk metadata as JSON columns (one list of values per metadata key).
+Files are memory-mapped on load and Documents are only built for the chunks that are accessed.
+"""
+
+import os
+import json
+import mmap
+import struct
+import zlib
+from collections.abc import Sequence
+import numpy as np
+from langchain_core.documents import Document
+
+MAGIC = b"RAGCHNK\x00"
+FORMAT_VERSION = 1
+
+# magic, format version, chunk count, text blob size, metadata size, CRC32 of everything after the header
+HEADER = struct.Struct("<8sIIQQI")
+OFFSET_DTYPE = np.dtype("<u8")
+COPY_BUFFER_SIZE = 1 << 20
+
+def _encode_metadata(metadatas):
+    """Store metadata as one list per key, recording the rows that do not have the key separately."""
+    keys = list(dict.fromkeys(key for metadata in metadatas for key in metadata))
+    columns, absent = {}, {}
+    for key in keys:
+        columns[key] = [metadata.get(key) for metadata in metadatas]
+        missing = [row for row, metadata in enumerate(metadatas) if key not in metadata]
+        if missing:
+            absent[key] = missing
+    return json.dumps({"columns": columns, "absent": absent}, separators=(",", ":")).encode("utf-8")
+
+def write_chunks(path, docs):
+    """Write docs to path, replacing any existing file only once the new one is complete."""
+    texts = [doc.page_content.encode("utf-8") for doc in docs]
+    offsets = np.zeros(len(texts) + 1, dtype=OFFSET_DTYPE)
+    np.cumsum([len(text) for text in texts], out=offsets[1:])
+    text_blob = b"".join(texts)
+    metadata_blob = _encode_metadata([doc.metadata for doc in docs])
+
+    body = [offsets.tobytes(), text_blob, metadata_blob]
+    crc = 0
+    for part in body:
+        crc = zlib.crc32(part, crc)
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(texts), len(text_blob), len(metadata_blob), crc))
+        for part in body:
+            f.write(part)
+    os.replace(tmp_path, path)
+
+class ChunkWriter:
+    """
+    Write a chunk file one Document at a time, for chunks that are produced as a large file is read.
+
+    Texts go to a temporary file as they are added, so only their offsets and metadata stay in
+    memory. close() assembles the chunk file and replaces any existing one; abort() discards it.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._text_path = f"{path}.text.tmp"
+        self._texts = open(self._text_path, "wb")
+        self._offsets = [0]
+        self._metadatas = []
+
+    def add(self, doc):
+        text = doc.page_content.encode("utf-8")
+        self._texts.write(text)
+        self._offsets.append(self._offsets[-1] + len(text))
+        self._metadatas.append(doc.metadata)
+
+    def close(self):
+        self._texts.close()
+        offsets = np.array(self._offsets, dtype=OFFSET_DTYPE).tobytes()
+        text_size = self._offsets[-1]
+        metadata_blob = _encode_metadata(self._metadatas)
+
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "wb") as f, open(self._text_path, "rb") as texts:
+            # The checksum covers the texts, so the header is written once they have been copied.
+            f.seek(HEADER.size)
+            f.write(offsets)
+            crc = zlib.crc32(offsets)
+            while block := texts.read(COPY_BUFFER_SIZE):
+                f.write(block)
+                crc = zlib.crc32(block, crc)
+            f.write(metadata_blob)
+            crc = zlib.crc32(metadata_blob, crc)
+            f.seek(0)
+            f.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(self._metadatas), text_size, len(metadata_blob), crc))
+        os.replace(tmp_path, self.path)
+        os.remove(self._text_path)
+
+    def abort(self):
+        self._texts.close()
+        if os.path.exists(self._text_path):
+            os.remove(self._text_path)
+
+class ChunkFile(Sequence):
+    """
+    Read-only sequence of the Documents stored in a chunk file.
+
+    Raises ValueError on open if the file is truncated or written by another format version. Only
+    the header and section sizes are checked then, so opening does not read the whole file; the
+    checksum is compared by verify().
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < HEADER.size:
+                raise ValueError(f"Chunk file {path} is truncated.")
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, count, text_size, metadata_size, crc = HEADER.unpack_from(self._mm)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a chunk file.")
+        if version != FORMAT_VERSION:
+            raise ValueError(f"Chunk file {path} has format version {version}, expected {FORMAT_VERSION}.")
+        offsets_size = (count + 1) * OFFSET_DTYPE.itemsize
+        if size != HEADER.size + offsets_size + text_size + metadata_size:
+            raise ValueError(f"Chunk file {path} is truncated.")
+
+        self._crc = crc
+        self._count = count
+        self._offsets = np.frombuffer(self._mm, dtype=OFFSET_DTYPE, count=count + 1, offset=HEADER.size)
+        if self._offsets[0] != 0 or self._offsets[-1] != text_size:
+            raise ValueError(f"Chunk file {path} has inconsistent offsets.")
+        self._text_start = HEADER.size + offsets_size
+        self._metadata_start = self._text_start + text_size
+        self._metadata = None
+        self._absent = None
+
+    def verify(self):
+        """Raise ValueError if the contents do not match the checksum written with the file."""
+        if zlib.crc32(memoryview(self._mm)[HEADER.size:]) != self._crc:
+            raise ValueError(f"Chunk file {self.path} failed its checksum.")
+
+    def __len__(self):
+        return self._count
+
+    def text(self, index):
+        start = self._text_start + int(self._offsets[index])
+        end = self._text_start + int(self._offsets[index + 1])
+        return self._mm[start:end].decode("utf-8")
+
+    def metadata(self, index):
+        if self._metadata is None:
+            # Decoded on first use, since callers that only need texts never look at it.
+            data = json.loads(self._mm[self._metadata_start:].decode("utf-8"))
+            self._metadata = data["columns"]
+            self._absent = {key: set(rows) for key, rows in data["absent"].items()}
+        metadata = {}
+        for key, values in self._metadata.items():
+            if index not in self._absent.get(key, ()):
+                metadata[key] = values[index]
+        return metadata
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._count))]
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError("chunk index out of range")
+        return Document(page_content=self.text(index), metadata=self.metadata(index))
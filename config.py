@@ -10,16 +10,67 @@ import yaml
 # Default configuration
 DEFAULT_CONFIG = {
     'llm_model_path': 'gemma3:270m',
+    'ollama_base_url': 'http://localhost:11434',
     'embedding_model_path': 'embeddinggemma',
     'index_path': './indexes',
     'docs_path': './docs',
     'cache_path': './cache',
+    'cache_max_bytes': 1073741824,
     'chunk_size': 1024,
     'chunk_overlap': 100,
     'k_retriever': 4,
+    'context_assembly': True,
+    'context_token_budget': 0,
+    'context_dedup_threshold': 0.9,
+    'retrieval_mode': 'vector',
+    'lexical_fast_path': True,
+    'hybrid_fetch_k': 20,
+    'rrf_k': 60,
+    'lexical_max_df': 0.2,
+    'rewrite_gate': True,
+    'index_type': 'flat',
+    'index_load_mode': 'memory',
+    'hnsw_m': 32,
+    'hnsw_ef_search': 64,
+    'ivf_nlist': 0,
+    'ivf_nprobe': 8,
+    'pq_m': 16,
+    'pq_nbits': 8,
+    'vector_quantization': 'none',
+    'rescore_factor': 4,
+    'search_partitions': 0,
+    'search_workers': 0,
+    'index_train_sample': 100000,
+    'auto_hnsw_min_vectors': 50000,
+    'auto_ivfpq_min_vectors': 1000000,
+    'embed_batch_size': 64,
+    'embed_concurrency': 2,
+    'parse_mode': 'thread',
+    'pdf_pages_per_task': 50,
+    'stream_threshold_bytes': 16777216,
         'supported_extensions': ['.txt', '.pdf', '.md', '.docx'],
     'replay_history': True,
     'max_replay_history': 5,
+    'history_mode': 'replay',
+    'history_recent_turns': 2,
+    'history_summary_tokens': 256,
+    'batch_concurrency': 4,
+    'server_host': '127.0.0.1',
+    'server_port': 8000,
+    'server_concurrency': 4,
+    'server_max_sessions': 1000,
+    'query_batch_window_ms': 5,
+    'query_batch_size': 32,
+    'metrics': True,
+    'metrics_file': '',
+    'watch': False,
+    'watch_interval': 2.0,
+    'watch_debounce': 1.0,
+    'watch_new_files': False,
+    'answer_cache': False,
+    'answer_cache_threshold': 0.95,
+    'answer_cache_size': 256,
+    'answer_cache_ttl': 86400,
     'temperature': 0.7,
     'max_new_tokens': 512,
     'n_ctx': 4096,
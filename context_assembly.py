@@ -0,0 +1,109 @@
+"""
+Fit retrieved chunks into the prompt.
+
+Chunks of the same source (and page) that overlap or follow each other are merged into one, so
+text shared through chunk_overlap is sent once. Near-duplicates are dropped, and what remains is
+packed in rank order into a token budget. Token counts are estimated from the text length, since
+the chat model's tokenizer is not available locally.
+"""
+
+import re
+from langchain_core.documents import Document
+
+CHARS_PER_TOKEN = 4
+# Shorter common stretches are more likely coincidence than chunk overlap.
+MIN_OVERLAP = 20
+# Consecutive chunks are separated by at most the whitespace the splitter stripped.
+MAX_GAP = 4
+
+_WORDS = re.compile(r"\w+")
+
+def estimate_tokens(text):
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+def _same_region(first, second):
+    keys = ("source", "page")
+    return all(first.metadata.get(key) == second.metadata.get(key) for key in keys)
+
+def _overlap(first, second, max_overlap):
+    """Return the length of the longest suffix of first that starts second, if it is at least MIN_OVERLAP."""
+    for size in range(min(len(first), len(second), max_overlap), MIN_OVERLAP - 1, -1):
+        if first.endswith(second[:size]):
+            return size
+    return 0
+
+def _merged(first, second, text):
+    metadata = dict(first.metadata)
+    if "start_index" in second.metadata and "start_index" in first.metadata:
+        metadata["start_index"] = min(first.metadata["start_index"], second.metadata["start_index"])
+    return Document(id=first.id, page_content=text, metadata=metadata)
+
+def _join(first, second, max_overlap):
+    """Return first and second merged into one chunk when they overlap or are adjacent, else None."""
+    a, b = first.page_content, second.page_content
+    if b in a:
+        return first
+    if a in b:
+        return _merged(first, second, b)
+
+    if "start_index" in first.metadata and "start_index" in second.metadata:
+        # Offsets from the splitter locate the chunks exactly, so touching chunks merge as well.
+        if first.metadata["start_index"] > second.metadata["start_index"]:
+            first, second = second, first
+            a, b = b, a
+        gap = second.metadata["start_index"] - (first.metadata["start_index"] + len(a))
+        if gap > MAX_GAP:
+            return None
+        if gap >= 0:
+            return _merged(first, second, a + "\n" + b)
+        return _merged(first, second, a + b[-gap:])
+
+    for head, tail in ((first, second), (second, first)):
+        size = _overlap(head.page_content, tail.page_content, max_overlap)
+        if size:
+            return _merged(head, tail, head.page_content + tail.page_content[size:])
+    return None
+
+def merge_chunks(docs, max_overlap):
+    """Merge overlapping and adjacent chunks of the same source; each result takes the rank of its best chunk."""
+    merged = []
+    for doc in docs:
+        position = len(merged)
+        joined_any = True
+        while joined_any:
+            joined_any = False
+            for i, kept in enumerate(merged):
+                joined = _join(kept, doc, max_overlap) if _same_region(kept, doc) else None
+                if joined is not None:
+                    # The merged chunk may now reach another kept chunk, so it is compared again.
+                    del merged[i]
+                    position = min(position, i)
+                    doc = joined
+                    joined_any = True
+                    break
+        merged.insert(position, doc)
+    return merged
+
+def drop_near_duplicates(docs, threshold):
+    """Drop chunks whose words overlap a higher-ranked chunk's by at least threshold (Jaccard similarity)."""
+    kept, kept_words = [], []
+    for doc in docs:
+        words = set(_WORDS.findall(doc.page_content.lower()))
+        if any(words and len(words & other) / len(words | other) >= threshold for other in kept_words):
+            continue
+        kept.append(doc)
+        kept_words.append(words)
+    return kept
+
+def pack(docs, budget):
+    """Keep chunks in rank order while they fit in budget tokens; the best chunk is truncated if it alone does not fit."""
+    packed, used = [], 0
+    for doc in docs:
+        tokens = estimate_tokens(doc.page_content)
+        if used + tokens <= budget:
+            packed.append(doc)
+            used += tokens
+        elif not packed and budget > 0:
+            packed.append(Document(id=doc.id, page_content=doc.page_content[:budget * CHARS_PER_TOKEN], metadata=doc.metadata))
+            used = budget
+    return packed
@@ -0,0 +1,188 @@
+import os
+import math
+import hashlib
+import sqlite3
+import threading
+import concurrent.futures
+from array import array
+from langchain_core.embeddings import Embeddings
+from config import config
+from metrics import metrics
+
+EMBEDDINGS_FILE = 'embeddings.sqlite'
+
+def _used_bytes(conn):
+    page_size, page_count, free_pages = (conn.execute(f"PRAGMA {name}").fetchone()[0] for name in ("page_size", "page_count", "freelist_count"))
+    return (page_count - free_pages) * page_size
+
+def embeddings_size(db_path):
+    """Return the bytes the embeddings take in the database, not counting pages freed by deletions."""
+    if not os.path.exists(db_path):
+        return 0
+    conn = sqlite3.connect(db_path)
+    try:
+        return _used_bytes(conn)
+    except sqlite3.Error:
+        return os.path.getsize(db_path)
+    finally:
+        conn.close()
+
+def trim_embeddings(db_path, max_bytes):
+    """
+    Delete the least recently written embeddings until they take about max_bytes.
+
+    Freed pages are given back with an incremental vacuum, which only moves the pages it frees;
+    databases created before incremental auto-vacuum are converted by compact_embeddings.
+    Returns the number of embeddings deleted.
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        size = _used_bytes(conn)
+        count = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        if size <= max_bytes or not count:
+            return 0
+        # Rows are about the same size, so the share of rows to delete is the share of bytes to free.
+        excess = min(count, math.ceil(count * (size - max_bytes) / size))
+        with conn:
+            conn.execute("DELETE FROM embeddings WHERE rowid IN (SELECT rowid FROM embeddings ORDER BY rowid LIMIT ?)", (excess,))
+        # Through execute() the pragma frees a single page; as a script it runs to completion.
+        conn.executescript("PRAGMA incremental_vacuum;")
+        return excess
+    except sqlite3.Error as e:
+        print(f"Warning: Could not trim embedding cache {db_path}. Error: {e}")
+        return 0
+    finally:
+        conn.close()
+
+def compact_embeddings(db_path):
+    """Rewrite the database without its free pages, switching it to incremental auto-vacuum."""
+    if not os.path.exists(db_path):
+        return
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+    except sqlite3.Error as e:
+        print(f"Warning: Could not compact embedding cache {db_path}. Error: {e}")
+    finally:
+        conn.close()
+
+class EmbeddingCache:
+    def __init__(self, cache_path=None):
+        self.cache_path = cache_path or config.get('cache_path', './cache')
+        os.makedirs(self.cache_path, exist_ok=True)
+        self.db_path = os.path.join(self.cache_path, EMBEDDINGS_FILE)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        # Only takes effect for a new database, so trimming can give pages back without a full VACUUM.
+        self._conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "text_hash TEXT NOT NULL, model TEXT NOT NULL, vector BLOB NOT NULL, "
+                "PRIMARY KEY (text_hash, model))"
+            )
+
+    @staticmethod
+    def _hash_text(text):
+        """Compute the SHA256 hash of a chunk's text."""
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def get_many(self, texts, embedding_model):
+        """Return the cached vector for each text, or None where there is no entry."""
+        hashes = [self._hash_text(text) for text in texts]
+        found = {}
+        with self._lock:
+            # Stay well below SQLite's bound-parameter limit.
+            for start in range(0, len(hashes), 500):
+                batch = hashes[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({placeholders})",
+                    [embedding_model, *batch],
+                ).fetchall()
+                for text_hash, blob in rows:
+                    vector = array('f')
+                    vector.frombytes(blob)
+                    found[text_hash] = vector.tolist()
+        return [found.get(text_hash) for text_hash in hashes]
+
+    def set_many(self, texts, embedding_model, vectors):
+        """Store one vector per text."""
+        rows = [
+            (self._hash_text(text), embedding_model, array('f', vector).tobytes())
+            for text, vector in zip(texts, vectors)
+        ]
+        try:
+            with self._lock, self._conn:
+                self._conn.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?)", rows)
+        except sqlite3.Error as e:
+            print(f"Warning: Could not write to embedding cache {self.db_path}. Error: {e}")
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that only sends chunks missing from the cache to the underlying model."""
+
+    def __init__(self, embeddings, embedding_model, cache):
+        self.embeddings = embeddings
+        self.embedding_model = embedding_model
+        self.cache = cache
+
+    def embed_documents(self, texts):
+        vectors = self.cache.get_many(texts, self.embedding_model)
+
+        # Embed each distinct missing text once, even if it repeats in the batch.
+        missing = list(dict.fromkeys(text for text, vector in zip(texts, vectors) if vector is None))
+        metrics.count("embedding_cache.hits", len(texts) - sum(vector is None for vector in vectors))
+        metrics.count("embedding_cache.misses", len(missing))
+        if missing:
+            new_vectors = self.embeddings.embed_documents(missing)
+            self.cache.set_many(missing, self.embedding_model, new_vectors)
+            by_text = dict(zip(missing, new_vectors))
+            vectors = [vector if vector is not None else by_text[text] for text, vector in zip(texts, vectors)]
+        return vectors
+
+    def embed_query(self, text):
+        return self.embeddings.embed_query(text)
+
+class BatchedQueryEmbeddings(Embeddings):
+    """
+    Embeddings wrapper that sends queries arriving together from several threads as one request.
+
+    The first query of a batch waits up to window seconds, or until max_batch queries are pending,
+    then embeds all pending queries at once and hands each caller its vector.
+    """
+
+    def __init__(self, embeddings, window, max_batch):
+        self.embeddings = embeddings
+        self.window = window
+        self.max_batch = max_batch
+        self._lock = threading.Lock()
+        self._pending = []
+        self._full = None
+
+    def embed_documents(self, texts):
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text):
+        future = concurrent.futures.Future()
+        with self._lock:
+            self._pending.append((text, future))
+            leader = len(self._pending) == 1
+            if leader:
+                self._full = full = threading.Event()
+            elif len(self._pending) >= self.max_batch:
+                self._full.set()
+
+        if leader:
+            full.wait(self.window)
+            with self._lock:
+                batch, self._pending = self._pending, []
+            try:
+                vectors = self.embeddings.embed_documents([pending_text for pending_text, _ in batch])
+            except Exception as e:
+                for _, pending_future in batch:
+                    pending_future.set_exception(e)
+            else:
+                for (_, pending_future), vector in zip(batch, vectors):
+                    pending_future.set_result(vector)
+        return future.result()
@@ -1,14 +1,40 @@
 import os
-import shutil
-from config import config
+import concurrent.futures
+from metrics import metrics
+from chat_history import ChatHistory
 
 class InteractiveManager:
-    def __init__(self, rag_manager):
-        self.rag_manager = rag_manager
-        self.chat_history = []
+    def __init__(self, rag_manager, file_paths=None):
+        """rag_manager may also be a Future of a RAGManager that is still being set up in the background."""
+        self._rag_manager = rag_manager
+        self.file_paths = file_paths if file_paths is not None else rag_manager.file_paths
+        self.chat_history = ChatHistory(summarize=self._summarize_history)
+
+    def _summarize_history(self, summary, turns, max_tokens):
+        return self.rag_manager.summarize_history(summary, turns, max_tokens)
+
+    @property
+    def rag_manager(self):
+        """
+        The RAGManager, waiting for its setup to finish first if it is still running.
+
+        If the setup failed, its error is reported and the chat ends, as nothing can be answered.
+        """
+        if isinstance(self._rag_manager, concurrent.futures.Future):
+            if not self._rag_manager.done():
+                print("Loading the index...", flush=True)
+            try:
+                self._rag_manager = self._rag_manager.result()
+            except (FileNotFoundError, ValueError) as e:
+                print(f"Error during RAG Manager initialization: {e}")
+                raise SystemExit(1)
+            except Exception as e:
+                print(f"An unexpected error occurred while setting up the index: {e}")
+                raise SystemExit(1)
+        return self._rag_manager
 
     def run(self):
-        file_names = [os.path.basename(p) for p in self.rag_manager.file_paths]
+        file_names = [os.path.basename(p) for p in self.file_paths]
         display_name = ", ".join(file_names)
         print(f"\nChat with {display_name}! Type '/help' for a list of commands.")
         while True:
@@ -20,12 +46,9 @@ class InteractiveManager:
                 if query.startswith('/'):
                     self.handle_command(query)
                 else:
-                    answer = self.rag_manager.ask(query, self.chat_history)
-                    print(f"\nAI: {answer}")
-                    if "The index is not set up" not in answer and config.get('replay_history', True):
-                        self.chat_history.append((query, answer))
-                        if len(self.chat_history) > config.get('max_replay_history', 5):
-                            self.chat_history.pop(0)
+                    answer = self.stream_answer(query)
+                    if "The index is not set up" not in answer:
+                        self.chat_history.add(query, answer)
 
             except (KeyboardInterrupt, EOFError):
                 print("\nExiting chat.")
@@ -33,6 +56,16 @@ class InteractiveManager:
             except Exception as e:
                 print(f"An error occurred: {e}")
 
+    def stream_answer(self, query):
+        """Print the answer as it is generated and return the full text."""
+        print("\nAI: ", end="", flush=True)
+        tokens = []
+        for token in self.rag_manager.ask_stream(query, self.chat_history):
+            print(token, end="", flush=True)
+            tokens.append(token)
+        print()
+        return "".join(tokens)
+
     def handle_command(self, query):
         command, *args = query.lower().split()
         if command == '/exit':
@@ -41,31 +74,71 @@ class InteractiveManager:
             self.clear_index()
         elif command == '/reindex':
             self.reindex()
+        elif command == '/cache':
+            self.show_cache(args)
+        elif command == '/stats':
+            self.show_stats(args)
         elif command == '/help':
             self.show_help()
         else:
             self.show_suggestions(command)
 
     def clear_index(self):
-        index_path = self.rag_manager.index_path
-        if os.path.exists(index_path):
-            try:
-                shutil.rmtree(index_path)
-                os.makedirs(index_path, exist_ok=True)
-                self.rag_manager.vector_store = None
-                self.rag_manager.chain = None
-                print(f"Index at {index_path} has been cleared. Please run `/reindex` to create a new index.")
-            except OSError as e:
-                print(f"Error clearing index: {e}")
-        else:
+        if self.rag_manager.vector_store is None:
             print("No index found to clear.")
+            return
+        try:
+            self.rag_manager.clear_index()
+            print("Index for the selected files has been cleared. Please run `/reindex` to create a new index.")
+        except OSError as e:
+            print(f"Error clearing index: {e}")
 
     def reindex(self):
         print("Re-indexing...")
-        self.rag_manager._create_index()
-        self.rag_manager.setup()
+        self.rag_manager.update_index()
+        self.rag_manager.build_chain()
         print("Re-indexing complete.")
 
+    def show_cache(self, args):
+        cache_manager = self.rag_manager.cache_manager
+        if args == ['gc']:
+            removed = cache_manager.collect_garbage(verify=True)
+            cache_manager.compact()
+            print(f"Removed {removed} stale cache file(s).")
+            removed = self.rag_manager.collect_index_garbage()
+            print(f"Removed {removed} stale index folder(s).")
+        elif args:
+            print("Usage: /cache [gc]")
+            return
+
+        stats = cache_manager.stats()
+        limit = f"{stats['max_bytes'] / 2**20:.1f} MiB" if stats['max_bytes'] else "unlimited"
+        print(f"Document cache: {stats['entries']} entries, {stats['size_bytes'] / 2**20:.1f} MiB (limit: {limit})")
+        print(f"This session: {stats['hits']} hits, {stats['misses']} misses, {stats['evictions']} evictions, {stats['orphans_removed']} stale files removed")
+
+    def show_stats(self, args):
+        if not metrics.enabled:
+            print("Metrics are disabled. Set `metrics: true` in the configuration to collect them.")
+            return
+        if args == ['json']:
+            print(metrics.to_json())
+        elif args == ['prometheus']:
+            print(metrics.to_prometheus(), end="")
+        elif args == ['reset']:
+            metrics.reset()
+            print("Metrics reset.")
+        elif args:
+            print("Usage: /stats [json|prometheus|reset]")
+        else:
+            snapshot = metrics.snapshot()
+            if not snapshot["summaries"] and not snapshot["counters"]:
+                print("No metrics recorded yet.")
+                return
+            for name, summary in snapshot["summaries"].items():
+                print(f"  {name:32} n={summary['count']:<6} mean={summary['mean']:.4f} min={summary['min']:.4f} max={summary['max']:.4f}")
+            for name, value in snapshot["counters"].items():
+                print(f"  {name:32} {value}")
+
     def switch_model(self, args):
         if len(args) != 2:
             print("Usage: /model <embedding_model|chat_model> <model_name>")
@@ -88,7 +161,9 @@ class InteractiveManager:
         print("""
 Available commands:
   /clear          - Clear the current index.
-  /reindex        - Re-create the index from the source document.
+  /reindex        - Update the index with changes to the source documents.
+  /cache [gc]     - Show document cache statistics, or remove stale entries.
+  /stats [json|prometheus|reset] - Show per-stage timings and counters.
   /model <type> <name> - Switch the embedding or chat model.
                     <type>: embedding_model | chat_model
                     <name>: name of the model
@@ -100,6 +175,8 @@ Available commands:
         suggestions = {
             "/clear": "Did you mean /clear?",
             "/reindex": "Did you mean /reindex?",
+            "/cache": "Did you mean /cache?",
+            "/stats": "Did you mean /stats?",
             "/help": "Did you mean /help?",
             "/exit": "Did you mean /exit?",
         }
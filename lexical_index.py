@@ -0,0 +1,158 @@
+"""
+BM25 keyword index kept next to each shard's vectors.
+
+Every shard gets a small SQLite database of term postings and chunk lengths built from its
+docstore. A selection is searched by combining the postings of its shards, so term statistics
+are computed over exactly the chunks that are selected. The databases are read through the
+connection pool shared with the docstores, so a large selection keeps few files open.
+"""
+
+import os
+import re
+import math
+import sqlite3
+from collections import Counter
+from vector_storage import DOCSTORE_FILE, close_connections, shared_connection
+
+LEXICAL_FILE = "lexical.sqlite"
+# Bumped whenever tokenization changes, so older postings are rebuilt instead of silently mismatching.
+LEXICAL_VERSION = 1
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Terms found in fewer chunks than this are always scored, since reading their postings is cheap.
+COMMON_TERM_MIN_DF = 1000
+
+STOP_WORDS = frozenset(
+    "a an and are as at be but by for from has have how i if in into is it its of on or that the "
+    "their there these this to was were what when where which who why will with you your".split()
+)
+
+_TOKEN = re.compile(r"\w+(?:[-./:]\w+)*")
+
+def tokenize(text):
+    """
+    Split text into lowercase terms.
+
+    Compound tokens such as error codes ("ERR-1042"), versions or paths are kept whole and also
+    split into their parts, so a query matches both the full code and its pieces.
+    """
+    terms = []
+    for token in _TOKEN.findall(text.lower()):
+        terms.append(token)
+        parts = re.split(r"[-./:]", token)
+        if len(parts) > 1:
+            terms.extend(part for part in parts if part)
+    return terms
+
+def _has_current_version(db_path):
+    if not os.path.exists(db_path):
+        return False
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute("PRAGMA user_version").fetchone()[0] == LEXICAL_VERSION
+    finally:
+        conn.close()
+
+def build_lexical_index(shard_path):
+    """Write the postings of a shard's chunks to its lexical database, reading them from the docstore."""
+    db_path = os.path.join(shard_path, LEXICAL_FILE)
+    tmp_path = f"{db_path}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    source = sqlite3.connect(os.path.join(shard_path, DOCSTORE_FILE))
+    conn = sqlite3.connect(tmp_path)
+    try:
+        with conn:
+            conn.execute("CREATE TABLE lengths (doc_id TEXT PRIMARY KEY, length INTEGER NOT NULL)")
+            conn.execute("CREATE TABLE postings (term TEXT NOT NULL, doc_id TEXT NOT NULL, tf INTEGER NOT NULL)")
+            for doc_id, page_content in source.execute("SELECT id, page_content FROM docs"):
+                terms = tokenize(page_content)
+                conn.execute("INSERT INTO lengths VALUES (?, ?)", (doc_id, len(terms)))
+                conn.executemany("INSERT INTO postings VALUES (?, ?, ?)", ((term, doc_id, tf) for term, tf in Counter(terms).items()))
+            conn.execute("CREATE INDEX postings_term ON postings (term)")
+            conn.execute(f"PRAGMA user_version = {LEXICAL_VERSION}")
+    finally:
+        conn.close()
+        source.close()
+    os.replace(tmp_path, db_path)
+    close_connections(db_path)
+
+def ensure_lexical_index(shard_path):
+    """Build the shard's lexical database unless an up-to-date one already exists."""
+    if not _has_current_version(os.path.join(shard_path, LEXICAL_FILE)):
+        build_lexical_index(shard_path)
+
+class _LexicalShard:
+    def __init__(self, shard_path):
+        self.db_path = os.path.join(shard_path, LEXICAL_FILE)
+        with shared_connection(self.db_path) as conn:
+            self.num_docs, self.total_length = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(length), 0) FROM lengths"
+            ).fetchone()
+
+    def document_frequencies(self, terms):
+        placeholders = ",".join("?" * len(terms))
+        with shared_connection(self.db_path) as conn:
+            return dict(conn.execute(f"SELECT term, COUNT(*) FROM postings WHERE term IN ({placeholders}) GROUP BY term", terms))
+
+    def postings(self, terms):
+        placeholders = ",".join("?" * len(terms))
+        with shared_connection(self.db_path) as conn:
+            return conn.execute(
+                "SELECT p.term, p.doc_id, p.tf, l.length FROM postings p JOIN lengths l ON l.doc_id = p.doc_id "
+                f"WHERE p.term IN ({placeholders})",
+                terms,
+            ).fetchall()
+
+class BM25Index:
+    """
+    BM25 search over the lexical databases of several shards, scored as one collection.
+
+    Stop words are ignored, and so are terms found in more than max_df of the chunks (0 keeps
+    them all): they barely change the ranking, but reading their postings grows with the corpus.
+    """
+
+    def __init__(self, shard_paths, max_df=0):
+        self.shard_paths = list(shard_paths)
+        self.shards = [_LexicalShard(path) for path in self.shard_paths]
+        self.max_df = max_df
+        self.num_docs = sum(shard.num_docs for shard in self.shards)
+        total_length = sum(shard.total_length for shard in self.shards)
+        self.avg_length = total_length / self.num_docs if self.num_docs else 0.0
+
+    def _query_terms(self, query):
+        terms = [term for term in dict.fromkeys(tokenize(query)) if term not in STOP_WORDS]
+        if not terms:
+            return {}
+        dfs = Counter()
+        for shard in self.shards:
+            dfs.update(shard.document_frequencies(terms))
+        max_df = max(self.max_df * self.num_docs, COMMON_TERM_MIN_DF) if self.max_df else self.num_docs
+        return {term: dfs[term] for term in terms if 0 < dfs[term] <= max_df}
+
+    def hits(self, query, k):
+        """Return up to k (shard path, chunk ID, score) triples, best first."""
+        dfs = self._query_terms(query)
+        if not dfs:
+            return []
+        idfs = {term: math.log(1 + (self.num_docs - df + 0.5) / (df + 0.5)) for term, df in dfs.items()}
+        scores = Counter()
+        for shard_path, shard in zip(self.shard_paths, self.shards):
+            for term, doc_id, tf, length in shard.postings(list(idfs)):
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * length / self.avg_length)
+                scores[shard_path, doc_id] += idfs[term] * tf * (BM25_K1 + 1) / (tf + norm)
+        return [(shard_path, doc_id, score) for (shard_path, doc_id), score in scores.most_common(k)]
+
+    def search(self, query, k):
+        """Return up to k (chunk ID, score) pairs, best first."""
+        return [(doc_id, score) for _, doc_id, score in self.hits(query, k)]
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """Fuse ranked lists of IDs into one list, ordered by the sum of 1 / (k + rank) over the lists."""
+    scores = Counter()
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] += 1 / (k + rank)
+    return [doc_id for doc_id, _ in scores.most_common()]
@@ -1,17 +1,74 @@
 import os
 import argparse
-from rag_manager import RAGManager
-from interactive_manager import InteractiveManager
+import threading
+import importlib
+import concurrent.futures
 from config import config
 from file_manager import FileManager
 
+def _preload():
+    """Start importing the LangChain and FAISS stack on a background thread while the user picks files."""
+    def load():
+        try:
+            importlib.import_module("rag_manager")
+        except Exception:
+            # Only a warm-up: the import is repeated, and its error reported, when the RAGManager is created.
+            pass
+
+    threading.Thread(target=load, daemon=True).start()
+
+def _setup_in_background(file_paths):
+    """
+    Create the RAGManager and run its setup on a background thread.
+
+    Returns a Future of the RAGManager, which fails with the error if initialization fails.
+    """
+    future = concurrent.futures.Future()
+
+    def setup():
+        try:
+            from rag_manager import RAGManager
+            rag_manager = RAGManager(file_paths=file_paths, index_path=config['index_path'])
+            rag_manager.setup()
+            if config['watch']:
+                _start_watching(rag_manager)
+        except BaseException as e:
+            future.set_exception(e)
+        else:
+            future.set_result(rag_manager)
+
+    threading.Thread(target=setup, name="rag-setup", daemon=True).start()
+    return future
+
+def _start_watching(rag_manager):
+    from watch_manager import WatchManager
+    print(f"Watching the selected files{' and ' + config['docs_path'] if config['watch_new_files'] else ''} for changes.")
+    return WatchManager(rag_manager).start()
+
+def _create_rag_manager(file_paths):
+    from rag_manager import RAGManager
+    try:
+        return RAGManager(file_paths=file_paths, index_path=config['index_path'])
+    except (FileNotFoundError, ValueError) as e:
+        print(f"Error during RAG Manager initialization: {e}")
+    except Exception as e:
+        print(f"An unexpected error occurred: {e}")
+    return None
+
 def main():
     os.makedirs(config['index_path'], exist_ok=True)
 
     parser = argparse.ArgumentParser(description="Chat with one or more documents using RAG.")
     parser.add_argument("file_names", type=str, nargs='*', default=None, help="A list of file names to process.")
+    parser.add_argument("--questions", type=str, help="Answer the questions in this JSONL file instead of starting a chat.")
+    parser.add_argument("--out", type=str, default="answers.jsonl", help="Where batch mode writes its answers (default: answers.jsonl).")
+    parser.add_argument("--concurrency", type=int, default=None, help="Number of questions answered at once in batch or server mode.")
+    parser.add_argument("--serve", action="store_true", help="Serve the index over HTTP instead of starting a chat.")
+    parser.add_argument("--host", type=str, default=None, help="Host the server binds to (default: server_host).")
+    parser.add_argument("--port", type=int, default=None, help="Port the server listens on (default: server_port).")
     args = parser.parse_args()
 
+    _preload()
     file_manager = FileManager()
     file_paths = file_manager.get_file_paths(args.file_names)
 
@@ -19,25 +76,43 @@ def main():
         # FileManager already prints a message if no files are found/selected.
         return
 
-    # Create a unique index name based on the sorted list of file names
-    # to ensure that the same set of files gets the same index.
-    sorted_files = sorted([os.path.basename(p) for p in file_paths])
-    index_name = "_".join(sorted_files) + "_faiss_index"
-    index_path = os.path.join(config['index_path'], index_name)
-
+    from metrics import metrics
     try:
-        rag_manager = RAGManager(file_paths=file_paths, index_path=index_path)
-    except (FileNotFoundError, ValueError) as e:
-        print(f"Error during RAG Manager initialization: {e}")
-        return
-    except Exception as e:
-        print(f"An unexpected error occurred: {e}")
-        return
+        # Each file is indexed once into its own shard under index_path, so any
+        # selection of files is assembled from the shards it needs.
+        if args.serve or args.questions:
+            rag_manager = _create_rag_manager(file_paths)
+            if rag_manager is None:
+                return
+
+            if args.serve:
+                from server_manager import ServerManager
+                server_manager = ServerManager(rag_manager, concurrency=args.concurrency)
+                rag_manager.setup()
+                if config['watch']:
+                    _start_watching(rag_manager)
+                server_manager.run(args.host, args.port)
+                return
+
+            from batch_manager import BatchManager
+            rag_manager.setup()
+            BatchManager(rag_manager, concurrency=args.concurrency).run(args.questions, args.out)
+            return
 
-    rag_manager.setup()
-    
-    interactive_manager = InteractiveManager(rag_manager)
-    interactive_manager.run()
+        # The prompt accepts input right away; the first question or command waits for the index.
+        from interactive_manager import InteractiveManager
+        rag_manager = _setup_in_background(file_paths)
+        interactive_manager = InteractiveManager(rag_manager, file_paths=file_paths)
+        try:
+            interactive_manager.run()
+        finally:
+            # Let the index files finish writing before exiting.
+            if not rag_manager.done():
+                print("Waiting for the index to finish building...")
+                concurrent.futures.wait([rag_manager])
+    finally:
+        if config['metrics'] and config['metrics_file']:
+            metrics.write(config['metrics_file'])
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,106 @@
+"""
+In-process timings and counters for the indexing and answering stages.
+
+Stages record durations with `metrics.timer(name)`, distributions such as token counts with
+`metrics.observe(name, value)` and events with `metrics.count(name)`. When metrics are disabled
+these calls return immediately. Snapshots can be exported as JSON or Prometheus text.
+"""
+
+import re
+import json
+import time
+import threading
+import contextlib
+from config import config
+
+_NULL_TIMER = contextlib.nullcontext()
+
+class _Timer:
+    __slots__ = ("metrics", "name", "start")
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.observe(self.name, time.perf_counter() - self.start)
+
+class Metrics:
+    """Summaries (count, sum, min, max) of observed values and monotonic counters, kept in memory."""
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._summaries = {}
+        self._counters = {}
+
+    def reset(self):
+        with self._lock:
+            self._summaries = {}
+            self._counters = {}
+
+    def timer(self, name):
+        """Return a context manager that observes its duration in seconds under name."""
+        return _Timer(self, name) if self.enabled else _NULL_TIMER
+
+    def observe(self, name, value):
+        if not self.enabled:
+            return
+        with self._lock:
+            summary = self._summaries.get(name)
+            if summary is None:
+                self._summaries[name] = [1, value, value, value]
+            else:
+                summary[0] += 1
+                summary[1] += value
+                summary[2] = min(summary[2], value)
+                summary[3] = max(summary[3], value)
+
+    def count(self, name, value=1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def snapshot(self):
+        with self._lock:
+            summaries = {
+                name: {"count": count, "sum": total, "min": low, "max": high, "mean": total / count}
+                for name, (count, total, low, high) in sorted(self._summaries.items())
+            }
+            counters = dict(sorted(self._counters.items()))
+        return {"summaries": summaries, "counters": counters}
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), indent=2)
+
+    def to_prometheus(self, prefix="rag_"):
+        """Render the snapshot in the Prometheus text exposition format."""
+        snapshot = self.snapshot()
+        lines = []
+        for name, summary in snapshot["summaries"].items():
+            metric = prefix + _metric_name(name)
+            lines.append(f"# TYPE {metric} summary")
+            lines.append(f"{metric}_count {summary['count']}")
+            lines.append(f"{metric}_sum {summary['sum']}")
+            lines.append(f"# TYPE {metric}_max gauge")
+            lines.append(f"{metric}_max {summary['max']}")
+        for name, value in snapshot["counters"].items():
+            metric = f"{prefix}{_metric_name(name)}_total"
+            lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric} {value}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """Write the snapshot to path, as Prometheus text for a .prom file and as JSON otherwise."""
+        with open(path, 'w') as f:
+            f.write(self.to_prometheus() if path.endswith(".prom") else self.to_json())
+
+def _metric_name(name):
+    return re.sub(r"[^a-zA-Z0-9_]", "_", name)
+
+metrics = Metrics(enabled=config.get('metrics', True))
@@ -1,20 +1,215 @@
 import os
+import re
+import sys
+import copy
+import json
+import time
+import uuid
+import hashlib
+import shutil
+import queue
+import itertools
+import threading
+import weakref
 import concurrent.futures
+from collections import Counter, OrderedDict
+import multiprocessing
+import faiss
+import numpy as np
 from langchain_community.vectorstores import FAISS
 from langchain_ollama import OllamaEmbeddings, ChatOllama
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain.chains import create_history_aware_retriever, create_retrieval_chain
+from langchain.chains import create_retrieval_chain
 from langchain.chains.combine_documents import create_stuff_documents_chain
-from langchain_community.document_loaders import (
-    TextLoader,
-    PyPDFLoader,
-    UnstructuredMarkdownLoader,
-    Docx2txtLoader,
-)
+from langchain_core.documents import Document
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.runnables import RunnableLambda, RunnableParallel, RunnablePassthrough
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_core.messages import HumanMessage, AIMessage
+from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
+from langchain_core.callbacks import BaseCallbackHandler
 from config import config
-from cache_manager import CacheManager
+from cache_manager import TMP_GRACE_SECONDS, CacheManager
+from embedding_cache import EmbeddingCache, CachedEmbeddings, BatchedQueryEmbeddings
+from answer_cache import ANSWERS_DIR, AnswerCache
+from vector_storage import (
+    INDEX_FILE,
+    DOCSTORE_FILE,
+    SQLiteDocstore,
+    ChainedDocstore,
+    ChainedIdMap,
+    ShardVectors,
+    ShardWriter,
+    is_saved,
+    read_index,
+    write_index,
+    copy_vector_store,
+    close_connections,
+    save_positions,
+    load_positions,
+    save_vector_store,
+    load_vector_store,
+)
+from ann_index import resolve_index_type, index_params, build_index, configure_search
+from sharded_index import ShardedIndex, partition_of
+from lexical_index import BM25Index, ensure_lexical_index, reciprocal_rank_fusion
+from streaming_splitter import stream_encoding, split_text_file
+from context_assembly import estimate_tokens, merge_chunks, drop_near_duplicates, pack
+from chat_history import ChatHistory
+from metrics import metrics
+
+_REWRITE_CACHE_SIZE = 256
+_QUERY_VECTOR_CACHE_SIZE = 256
+
+_SUMMARY_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", "You maintain a running summary of a conversation between a user and an assistant about the user's documents. Fold the new turns into the current summary. Keep facts, names, numbers, decisions and open questions; drop greetings and filler. Use at most {max_words} words and reply with the summary only."),
+    ("human", "Current summary:\n{summary}\n\nNew turns:\n{turns}"),
+])
+
+_QA_SYSTEM_PROMPT = "You are an assistant for question-answering tasks. Use the following pieces of retrieved context to answer the question. If you don't know the answer, just say that you don't know. Use three sentences maximum and keep the answer concise.\n\nContext: {context}"
+
+RETRIEVAL_MODES = ('vector', 'hybrid', 'lexical')
+
+# Words that usually point back at earlier turns, making a follow-up unanswerable on its own.
+_CONTEXT_REFERENCES = re.compile(
+    r"\b(it|its|they|them|their|theirs|this|that|these|those|he|him|his|she|her|hers|"
+    r"there|then|former|latter|above|previous|earlier|same|other|another|else|also|again|more)\b",
+    re.IGNORECASE,
+)
+
+def _needs_rewrite(question):
+    """Return True if a follow-up question likely depends on the chat history to be understood."""
+    # Very short follow-ups such as "why?" or "and the second one?" lean on the previous turn.
+    return len(question.split()) <= 3 or bool(_CONTEXT_REFERENCES.search(question))
+
+# A token with a digit or underscore in it, such as an error code, part number, version or identifier.
+_CODE_TOKEN = re.compile(r"[\w./:-]*[\d_][\w./:-]*")
+
+def _is_keyword_query(question):
+    """Return True for short lookups of exact tokens, such as error codes or identifiers, and for quoted phrases."""
+    question = question.strip()
+    if len(question) > 2 and question[0] == question[-1] == '"':
+        return True
+    words = question.split()
+    return 0 < len(words) <= 4 and any(_CODE_TOKEN.fullmatch(word.strip("?!,;.'\"")) for word in words)
+
+# Each document loader is imported the first time a file of its type is parsed.
+_LOADERS = {
+    ".txt": "TextLoader",
+    ".pdf": "PyPDFLoader",
+    ".md": "UnstructuredMarkdownLoader",
+    ".docx": "Docx2txtLoader",
+}
+
+def __getattr__(name):
+    if name in _LOADERS.values():
+        from langchain_community import document_loaders
+        loader_class = globals()[name] = getattr(document_loaders, name)
+        return loader_class
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def _get_loader_class(file_extension):
+    name = _LOADERS.get(file_extension)
+    return getattr(sys.modules[__name__], name) if name else None
+
+def _parse_file(file_path, chunk_size, chunk_overlap, page_range=None):
+    """
+    Load and split one file, or only the pages in [start, stop) of a PDF when page_range is given.
+
+    Kept at module level and dependent only on its arguments so it can run in a worker process.
+    """
+    if page_range is not None:
+        from pypdf import PdfReader
+        reader = PdfReader(file_path)
+        documents = [
+            Document(
+                page_content=reader.pages[i].extract_text(),
+                metadata={"source": file_path, "total_pages": len(reader.pages), "page": i, "page_label": reader.page_labels[i]},
+            )
+            for i in range(*page_range)
+        ]
+    else:
+        loader = _get_loader_class(os.path.splitext(file_path)[1])(file_path)
+        documents = loader.load()
+
+    # Chunk offsets let context assembly merge neighbouring chunks that are retrieved together.
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap, add_start_index=True)
+    return text_splitter.split_documents(documents)
+
+class LLMMetricsHandler(BaseCallbackHandler):
+    """Callback handler recording the duration and output tokens of each call of the chat model it is attached to."""
+
+    def __init__(self, metrics, stage):
+        self.metrics = metrics
+        self.stage = stage
+        self._runs = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._runs[run_id] = [time.perf_counter(), 0]
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._runs[run_id] = [time.perf_counter(), 0]
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs):
+        if run_id in self._runs:
+            self._runs[run_id][1] += 1
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        start, streamed_tokens = self._runs.pop(run_id, (None, 0))
+        if start is None:
+            return
+        self.metrics.observe(f"{self.stage}_seconds", time.perf_counter() - start)
+        usage = None
+        generations = response.generations[0] if response.generations else []
+        if generations and getattr(generations[0], "message", None) is not None:
+            usage = getattr(generations[0].message, "usage_metadata", None)
+        self.metrics.observe(f"{self.stage}_output_tokens", usage["output_tokens"] if usage else streamed_tokens)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._runs.pop(run_id, None)
+
+class _IndexDirs:
+    """
+    The saved index directories that live vector stores read, so replaced ones are deleted only once unused.
+
+    Questions still in flight after refresh_index keep searching the previous store, so a directory
+    it no longer needs is deleted when the last store reading it is garbage collected.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._users = Counter()
+        self._retired = set()
+
+    def use(self, vector_store, paths):
+        """Record that vector_store reads paths until it is garbage collected."""
+        paths = list(paths)
+        with self._lock:
+            self._users.update(paths)
+            self._retired.difference_update(paths)
+        weakref.finalize(vector_store, self._release, paths)
+
+    def in_use(self, path):
+        with self._lock:
+            return self._users[path] > 0
+
+    def retire(self, paths):
+        """Delete paths once no vector store reads them, which may be right away."""
+        with self._lock:
+            self._retired.update(paths)
+            self._remove_unused(paths)
+
+    def _release(self, paths):
+        with self._lock:
+            self._users.subtract(paths)
+            self._remove_unused(paths)
+
+    def _remove_unused(self, paths):
+        for path in paths:
+            if path in self._retired and self._users[path] <= 0:
+                self._retired.discard(path)
+                del self._users[path]
+                close_connections(path)
+                shutil.rmtree(path, ignore_errors=True)
 
 class RAGManager:
     def __init__(self, file_paths, index_path):
@@ -24,7 +219,31 @@ class RAGManager:
         self.chat_model = config['llm_model_path']
         self.vector_store = None
         self.chain = None
-        self.cache_manager = CacheManager()
+        self.answer_cache = None
+        self.lexical_index = None
+        self.manifest = {}
+        self.index_embedding_model = self.embedding_model
+        self.index_type = 'flat'
+        self.in_place_updates = True
+        # Full-precision vectors that candidates from a quantized index are rescored with.
+        self.full_vectors = None
+        # Saved assembled or partition indexes the current vector store was opened from.
+        self.index_dirs = []
+        # Shared with the copies refresh_index and build_chain make, like the locks below.
+        self._index_dirs = _IndexDirs()
+        # Searches the partitions of a partitioned index in parallel; started on first use.
+        self._search_pool = None
+        # Set by the server, where many sessions ask at once, to embed concurrent queries in one request.
+        self.batch_queries = False
+        self._rewrite_cache = OrderedDict()
+        self._rewrite_lock = threading.Lock()
+        # Question embeddings, shared by the answer cache lookup and the vector search of the same question.
+        self._query_vectors = OrderedDict()
+        self._query_vector_lock = threading.Lock()
+        # Serializes index updates, which /reindex and the folder watcher may start at the same time.
+        self._index_lock = threading.RLock()
+        self.cache_manager = CacheManager(cache_path=config['cache_path'])
+        self.embedding_cache = EmbeddingCache(cache_path=config['cache_path'])
 
         try:
             if not self.file_paths:
@@ -55,78 +274,693 @@ class RAGManager:
             f.write(f"\n--- {type(error).__name__} ---\n")
             f.write(str(error))
 
-    def _create_index(self):
-        print(f"Creating index from {len(self.file_paths)} file(s) using {self.embedding_model}...")
+    def _get_embeddings(self):
+        # Only chunks whose text has not been embedded with this model before reach Ollama.
+        embeddings = OllamaEmbeddings(model=self.embedding_model, base_url=config['ollama_base_url'])
+        if self.batch_queries:
+            embeddings = BatchedQueryEmbeddings(embeddings, config['query_batch_window_ms'] / 1000, config['query_batch_size'])
+        return CachedEmbeddings(embeddings, self.embedding_model, self.embedding_cache)
 
-        loader_map = {
-            ".txt": TextLoader,
-            ".pdf": PyPDFLoader,
-            ".md": UnstructuredMarkdownLoader,
-            ".docx": Docx2txtLoader,
-        }
+    def _process_file(self, file_path, executor=None):
+        # Check cache first
+        cached_docs = self.cache_manager.get(file_path, self.embedding_model)
+        if cached_docs:
+            metrics.count("chunk_cache.hits")
+            print(f"Loading cached documents for {os.path.basename(file_path)}.")
+            return cached_docs
+        metrics.count("chunk_cache.misses")
 
-        def _process_file(file_path):
-            # Check cache first
-            cached_docs = self.cache_manager.get(file_path, self.embedding_model)
-            if cached_docs:
-                print(f"Loading cached documents for {os.path.basename(file_path)}.")
-                return cached_docs
+        # If not in cache, process the file
+        print(f"Processing {os.path.basename(file_path)}...")
+        file_extension = os.path.splitext(file_path)[1]
+        if _get_loader_class(file_extension) is None:
+            print(f"Warning: No loader found for file extension {file_extension}. Skipping {os.path.basename(file_path)}.")
+            return []
+        if self._streams(file_path):
+            return self._stream_file(file_path)
 
-            # If not in cache, process the file
-            print(f"Processing {os.path.basename(file_path)}...")
-            file_extension = os.path.splitext(file_path)[1]
-            loader_class = loader_map.get(file_extension)
+        try:
+            with metrics.timer("index.parse_seconds"):
+                if executor is None:
+                    docs = _parse_file(file_path, config['chunk_size'], config['chunk_overlap'])
+                else:
+                    docs = self._parse_in_processes(file_path, executor)
+            metrics.observe("index.chunks_per_file", len(docs))
 
-            if not loader_class:
-                print(f"Warning: No loader found for file extension {file_extension}. Skipping {os.path.basename(file_path)}.")
-                return []
+            self.cache_manager.set(file_path, self.embedding_model, docs)
+            print(f"Loaded and cached {os.path.basename(file_path)}.")
+            return docs
+        except Exception as e:
+            print(f"Error loading {os.path.basename(file_path)}: {e}")
+            return []
 
-            try:
-                loader = loader_class(file_path)
-                documents = loader.load()
+    def _streams(self, file_path):
+        """Return True for text files large enough to be split while they are read, rather than loaded whole."""
+        threshold = config['stream_threshold_bytes']
+        return (
+            bool(threshold) and file_path.endswith(".txt")
+            and os.path.getsize(file_path) >= threshold and stream_encoding() is not None
+        )
+
+    def _stream_file(self, file_path):
+        """Yield the chunks of a large text file as it is read, writing them to the chunk cache on the way."""
+        docs = split_text_file(file_path, config['chunk_size'], config['chunk_overlap'])
+        count = 0
+        for doc in self.cache_manager.write_through(file_path, self.embedding_model, docs):
+            count += 1
+            yield doc
+        metrics.count("index.files_streamed")
+        metrics.observe("index.chunks_per_file", count)
+        print(f"Loaded and cached {os.path.basename(file_path)}.")
+
+    def _parse_in_processes(self, file_path, executor):
+        """Parse a file in the process pool, splitting large PDFs into page ranges parsed in parallel."""
+        chunk_size, chunk_overlap = config['chunk_size'], config['chunk_overlap']
+        if not file_path.endswith(".pdf"):
+            return executor.submit(_parse_file, file_path, chunk_size, chunk_overlap).result()
+
+        from pypdf import PdfReader
+        page_count = len(PdfReader(file_path).pages)
+        pages_per_task = max(1, config['pdf_pages_per_task'])
+        futures = [
+            executor.submit(_parse_file, file_path, chunk_size, chunk_overlap, (start, min(start + pages_per_task, page_count)))
+            for start in range(0, page_count, pages_per_task)
+        ]
+        # Collect in submission order so chunks keep the page order of the document.
+        return [doc for future in futures for doc in future.result()]
+
+    def _shard_path(self, file_hash):
+        """Return the directory of the shard holding one file's vectors for the current embedding model."""
+        return os.path.join(self.index_path, "shards", f"{file_hash}_{self.embedding_model.replace(':', '_')}")
 
-                text_splitter = RecursiveCharacterTextSplitter(chunk_size=config['chunk_size'], chunk_overlap=config['chunk_overlap'])
-                docs = text_splitter.split_documents(documents)
+    @staticmethod
+    def _assign_ids(docs):
+        return [str(uuid.uuid4()) for _ in docs]
 
-                self.cache_manager.set(file_path, self.embedding_model, docs)
-                print(f"Loaded and cached {os.path.basename(file_path)}.")
-                return docs
+    def _hash_files(self, file_paths):
+        return {fp: self.cache_manager.get_file_hash(fp) for fp in file_paths}
+
+    def _mmap_enabled(self):
+        return config['index_load_mode'] == 'mmap'
+
+    def _lexical_enabled(self):
+        if config['retrieval_mode'] not in RETRIEVAL_MODES:
+            raise ValueError(f"Unsupported retrieval mode '{config['retrieval_mode']}'. Please use one of {RETRIEVAL_MODES}.")
+        return config['retrieval_mode'] != 'vector'
+
+    def _load_shards(self, hashes):
+        """
+        Return a mapping of file path to (content hash, shard) for a mapping of file path to content hash.
+
+        Existing shards are loaded from disk; files without one are processed, embedded and
+        saved as a new shard. The shard is None for files that produced no chunks.
+        """
+        embeddings = self._get_embeddings()
+
+        shards = {}
+        missing_paths = []
+        for file_path, file_hash in hashes.items():
+            shard_path = self._shard_path(file_hash)
+            if is_saved(shard_path):
+                shards[file_path] = (file_hash, load_vector_store(shard_path, embeddings, self._mmap_enabled()))
+            else:
+                missing_paths.append(file_path)
+
+        built = self._build_shards({hashes[fp]: fp for fp in missing_paths}, embeddings)
+        for file_path in missing_paths:
+            shards[file_path] = (hashes[file_path], built.get(hashes[file_path]))
+
+        return shards
+
+    def _build_shards(self, paths_by_hash, embeddings):
+        """
+        Build and save one shard per file, returning a mapping of content hash to shard.
+
+        Loader threads push chunk batches into a bounded queue that a pool of embedding workers
+        drains, so parsing overlaps with embedding and vectors are added to a shard as they arrive.
+        Large text files are split while they are read, so their batches are queued as they fill,
+        and their shards are written to disk batch by batch instead of being kept in memory.
+        Files that produced no chunks get no shard.
+        """
+        batch_size = config['embed_batch_size']
+        concurrency = config['embed_concurrency']
+        # The queue holds whole batches, so this keeps two batches per worker in flight.
+        chunk_queue = queue.Queue(maxsize=concurrency * 2)
+        lock = threading.Lock()
+        shards, writers, remaining, failed = {}, {}, {}, set()
+
+        def produce(file_hash, file_path, parse_pool):
+            with lock:
+                # Held by the loader until all the file's chunks are queued, so the shard is not saved early.
+                remaining[file_hash] = 1
+            try:
+                if self._streams(file_path):
+                    writers[file_hash] = ShardWriter(self._shard_path(file_hash))
+            except OSError as e:
+                print(f"Warning: Could not write {os.path.basename(file_path)}'s shard incrementally, so it is kept in memory. Error: {e}")
+            try:
+                docs = iter(self._process_file(file_path, parse_pool))
+                while batch := list(itertools.islice(docs, batch_size)):
+                    with lock:
+                        remaining[file_hash] += len(batch)
+                    chunk_queue.put((file_hash, batch))
             except Exception as e:
                 print(f"Error loading {os.path.basename(file_path)}: {e}")
-                return []
+                with lock:
+                    failed.add(file_hash)
+            release(file_hash, 1)
+
+        def release(file_hash, count):
+            """Mark count of a file's chunks (or, as 1, its loader) done and save its shard once none are left."""
+            with lock:
+                remaining[file_hash] -= count
+                if remaining[file_hash]:
+                    return
+                writer = writers.pop(file_hash, None)
+                empty = not writer.ntotal if writer is not None else file_hash not in shards
+                if empty or file_hash in failed:
+                    if writer is not None:
+                        writer.abort()
+                    return
+            try:
+                # Reopen the shard from disk so its chunks no longer have to stay in memory.
+                with metrics.timer("index.save_shard_seconds"):
+                    if writer is not None:
+                        writer.close()
+                    else:
+                        save_vector_store(shards[file_hash], self._shard_path(file_hash))
+                    if self._lexical_enabled():
+                        ensure_lexical_index(self._shard_path(file_hash))
+                shards[file_hash] = load_vector_store(self._shard_path(file_hash), embeddings, self._mmap_enabled())
+            except Exception as e:
+                print(f"Error embedding {os.path.basename(paths_by_hash[file_hash])}: {e}")
+                if writer is not None:
+                    writer.abort()
+                with lock:
+                    failed.add(file_hash)
+
+        def consume():
+            while (item := chunk_queue.get()) is not None:
+                file_hash, docs = item
+                try:
+                    # Keep draining batches of a failed file so loaders never block on a full queue.
+                    if file_hash not in failed:
+                        self._embed_batch(file_hash, docs, embeddings, shards, writers.get(file_hash), lock)
+                except Exception as e:
+                    print(f"Error embedding {os.path.basename(paths_by_hash[file_hash])}: {e}")
+                    with lock:
+                        failed.add(file_hash)
+                # Failed files are released too, so a shard being written to disk is cleaned up.
+                release(file_hash, len(docs))
+
+        workers = [threading.Thread(target=consume, daemon=True) for _ in range(concurrency)]
+        for worker in workers:
+            worker.start()
+        # Parsing is CPU-bound, so the process mode sidesteps the GIL; the spawn context keeps
+        # worker processes from inheriting the embedding threads started above.
+        parse_pool = None
+        if config['parse_mode'] == 'process' and paths_by_hash:
+            parse_pool = concurrent.futures.ProcessPoolExecutor(mp_context=multiprocessing.get_context('spawn'))
+        try:
+            with concurrent.futures.ThreadPoolExecutor() as executor:
+                futures = [executor.submit(produce, fh, fp, parse_pool) for fh, fp in paths_by_hash.items()]
+                concurrent.futures.wait(futures)
+        finally:
+            if parse_pool is not None:
+                parse_pool.shutdown()
+        for _ in workers:
+            chunk_queue.put(None)
+        for worker in workers:
+            worker.join()
+
+        return {file_hash: shard for file_hash, shard in shards.items() if file_hash not in failed}
+
+    def _embed_batch(self, file_hash, docs, embeddings, shards, writer, lock):
+        """Embed a batch of a file's chunks and add them to its shard, on disk when it has a writer."""
+        texts = [doc.page_content for doc in docs]
+        with metrics.timer("index.embed_batch_seconds"):
+            vectors = embeddings.embed_documents(texts)
+        metrics.count("index.chunks_embedded", len(texts))
+        if writer is not None:
+            writer.add(self._assign_ids(docs), docs, vectors)
+            return
+        text_embeddings = list(zip(texts, vectors))
+        metadatas = [doc.metadata for doc in docs]
+        with lock:
+            if file_hash not in shards:
+                shards[file_hash] = FAISS.from_embeddings(text_embeddings, embeddings, metadatas=metadatas, ids=self._assign_ids(docs))
+            else:
+                shards[file_hash].add_embeddings(text_embeddings, metadatas=metadatas, ids=self._assign_ids(docs))
+
+    def _merge_shards(self, shards):
+        """Append shards to the current vector store and record which vector IDs came from which file."""
+        for file_path, (file_hash, shard) in shards.items():
+            # The same content selected under two paths shares a shard; merge it only once.
+            if shard is None or any(entry["hash"] == file_hash for entry in self.manifest.values()):
+                self.manifest[file_path] = {"hash": file_hash, "ids": []}
+                continue
 
-        all_docs = []
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            future_to_docs = {executor.submit(_process_file, fp): fp for fp in self.file_paths}
-            for future in concurrent.futures.as_completed(future_to_docs):
-                docs = future.result()
-                if docs:
-                    all_docs.extend(docs)
+            num_vectors = shard.index.ntotal
+            ids = [shard.index_to_docstore_id[i] for i in range(num_vectors)]
+            self.manifest[file_path] = {"hash": file_hash, "ids": ids}
+            if self.vector_store is None:
+                # Chunks stay in the shards' own docstores; the merged store only chains them.
+                self.vector_store = FAISS(
+                    embedding_function=self._get_embeddings(),
+                    index=faiss.IndexFlatL2(shard.index.d),
+                    docstore=ChainedDocstore(),
+                    index_to_docstore_id={},
+                )
+            start = self.vector_store.index.ntotal
+            self.vector_store.index.add(shard.index.reconstruct_n(0, num_vectors))
+            self.vector_store.docstore.append(shard.docstore, num_vectors)
+            self.vector_store.index_to_docstore_id.update({start + i: doc_id for i, doc_id in enumerate(ids)})
 
-        if not all_docs:
+    def _create_index(self):
+        with metrics.timer("index.create_seconds"):
+            self._assemble_index()
+
+    def _assemble_index(self):
+        """
+        Assemble the index, then delete the saved indexes it replaces, which hold content no longer selected.
+
+        They are deleted once the previous vector store is released, since questions may still be searching it.
+        """
+        previous = self.index_dirs
+        self.index_dirs = []
+        self._assemble()
+        if self.vector_store is not None:
+            self._index_dirs.use(self.vector_store, self.index_dirs)
+        self._index_dirs.retire(set(previous) - set(self.index_dirs))
+
+    def _assemble(self):
+        print(f"Assembling index from {len(self.file_paths)} file(s) using {self.embedding_model}...")
+        self.vector_store = None
+        self.full_vectors = None
+        self.manifest = {}
+        self.index_embedding_model = self.embedding_model
+
+        with metrics.timer("index.hash_files_seconds"):
+            hashes = self._hash_files(self.file_paths)
+        if config['search_partitions'] > 0:
+            self._assemble_partitions(hashes)
+            if self.vector_store is None:
+                print("No documents were loaded. Index not created.")
+                return
+            num_partitions = len(self.vector_store.index.indexes)
+            print(f"Index for {len(self.file_paths)} file(s) split into {num_partitions} partition(s) under {os.path.join(self.index_path, 'partitions')}")
+            return
+
+        with metrics.timer("index.restore_seconds"):
+            restored = self._restore_assembled(hashes)
+        if restored:
+            print(f"Combined index for {len(self.file_paths)} file(s) restored from {self._assembled_path(hashes)}")
+            return
+
+        with metrics.timer("index.load_shards_seconds"):
+            shards = self._load_shards(hashes)
+        with metrics.timer("index.merge_seconds"):
+            self._merge_shards(shards)
+
+        if self.vector_store is None:
             print("No documents were loaded. Index not created.")
             return
+        with metrics.timer("index.finalize_seconds"):
+            self._finalize_index()
+        print(f"Combined index for {len(self.file_paths)} file(s) assembled from shards in {self.index_path}")
 
-        embeddings = OllamaEmbeddings(model=self.embedding_model)
-        self.vector_store = FAISS.from_documents(all_docs, embeddings)
-        self.vector_store.save_local(self.index_path)
-        print(f"Combined index for {len(self.file_paths)} file(s) saved to {self.index_path}")
+    def _assembled_path(self, hashes):
+        """
+        Return the directory of the assembled index over the selected files with these content hashes.
 
+        A changed file gets a new directory, so a rebuild never replaces the files that questions
+        still searching the previous index read.
+        """
+        key = "\n".join([self._selection_key(), self.embedding_model] + sorted(set(hashes.values())))
+        return os.path.join(self.index_path, "assembled", hashlib.sha256(key.encode('utf-8')).hexdigest())
 
-    def _load_index(self):
-        print(f"Loading index from {self.index_path} using {self.embedding_model}...")
-        embeddings = OllamaEmbeddings(model=self.embedding_model)
-        self.vector_store = FAISS.load_local(self.index_path, embeddings, allow_dangerous_deserialization=True)
-        print("Index loaded.")
+    def _read_index_meta(self, path):
+        meta_path = os.path.join(path, "index_meta.json")
+        try:
+            with open(meta_path, 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (json.JSONDecodeError, OSError) as e:
+            print(f"Warning: Could not read index metadata {meta_path}. The index will be rebuilt. Error: {e}")
+            return None
 
-    def setup(self):
-        if not os.path.exists(self.index_path) or not os.listdir(self.index_path):
-            self._create_index()
+    def _restore_assembled(self, hashes):
+        """
+        Reopen the saved assembled index when it was built from exactly these files and settings.
+
+        Only the index file and the shards' docstores are opened, so nothing is embedded or merged.
+        """
+        meta = self._read_index_meta(self._assembled_path(hashes))
+        if meta is None:
+            return False
+
+        index_type = resolve_index_type(config['index_type'], meta["num_vectors"])
+        params = index_params(index_type, meta["num_vectors"], meta["dimension"])
+        if index_type == 'flat' and "quantization" not in params and not self._mmap_enabled():
+            return False
+        self.manifest = {fp: {"hash": file_hash, "ids": []} for fp, file_hash in hashes.items()}
+        # The shards holding the index's vectors, in order; an index saved without them is rebuilt.
+        shard_hashes = meta.get("shard_hashes")
+        if (meta["index_type"], meta["params"], meta["content_version"]) != (index_type, params, self.content_version()) \
+                or shard_hashes is None or not all(is_saved(self._shard_path(file_hash)) for file_hash in shard_hashes):
+            self.manifest = {}
+            return False
+
+        assembled_path = self._assembled_path(hashes)
+        mmap = self._mmap_enabled()
+        self.vector_store = FAISS(
+            embedding_function=self._get_embeddings(),
+            index=configure_search(read_index(os.path.join(assembled_path, INDEX_FILE), mmap), params),
+            docstore=self._chain_docstores(shard_hashes, meta.get("shard_sizes")),
+            index_to_docstore_id=load_positions(assembled_path, mmap),
+        )
+        self.index_type = index_type
+        self.in_place_updates = False
+        self.full_vectors = self._open_full_vectors("quantization" in params, shard_hashes)
+        self.index_dirs = [assembled_path]
+        return True
+
+    def _finalize_index(self):
+        """
+        Swap the merged flat index for the configured index type and save it when it has to persist.
+
+        Approximate, quantized and memory-mapped indexes are saved under the assembled path with
+        their type, parameters and content version, and restored from there while the files are
+        unchanged. Only an exact in-memory flat index can be updated in place.
+        """
+        num_vectors = self.vector_store.index.ntotal
+        dimension = self.vector_store.index.d
+        self.index_type = resolve_index_type(config['index_type'], num_vectors)
+        params = index_params(self.index_type, num_vectors, dimension)
+        mmap = self._mmap_enabled()
+        self.in_place_updates = self.index_type == 'flat' and "quantization" not in params and not mmap
+        if self.in_place_updates:
+            return
+
+        ids = [self.vector_store.index_to_docstore_id[i] for i in range(num_vectors)]
+        # The shards in the order their vectors were merged, to find each vector's full-precision copy.
+        shard_hashes = [entry["hash"] for entry in self.manifest.values() if entry["ids"]]
+        shard_sizes = [len(entry["ids"]) for entry in self.manifest.values() if entry["ids"]]
+        if self.index_type == 'flat' and "quantization" not in params:
+            index = self.vector_store.index
         else:
-            self._load_index()
+            quantization = f" ({params['quantization']})" if "quantization" in params else ""
+            print(f"Building {self.index_type}{quantization} index over {num_vectors} vectors...")
+            index = build_index(self.vector_store.index.reconstruct_n(0, num_vectors), self.index_type, params)
+
+        assembled_path = self._assembled_path({fp: entry["hash"] for fp, entry in self.manifest.items()})
+        os.makedirs(assembled_path, exist_ok=True)
+        write_index(index, os.path.join(assembled_path, INDEX_FILE))
+        save_positions(assembled_path, ids)
+        # The metadata is written last, so an interrupted save is never mistaken for a usable index.
+        meta = {
+            "index_type": self.index_type,
+            "params": params,
+            "content_version": self.content_version(),
+            "num_vectors": num_vectors,
+            "dimension": dimension,
+            "shard_hashes": shard_hashes,
+            "shard_sizes": shard_sizes,
+        }
+        with open(os.path.join(assembled_path, "index_meta.json"), 'w') as f:
+            json.dump(meta, f)
+        self.index_dirs = [assembled_path]
+
+        if mmap:
+            index = read_index(os.path.join(assembled_path, INDEX_FILE), mmap=True)
+        self.vector_store.index = configure_search(index, params)
+        self.vector_store.index_to_docstore_id = load_positions(assembled_path, mmap) if mmap else dict(enumerate(ids))
+        self.full_vectors = self._open_full_vectors("quantization" in params, shard_hashes)
+
+    def _partition_path(self, file_hashes):
+        """Return the directory of the index over a partition's shards, shared by every selection with the same partition."""
+        key = hashlib.sha256("\n".join(sorted(file_hashes) + [self.embedding_model]).encode('utf-8')).hexdigest()
+        return os.path.join(self.index_path, "partitions", key)
+
+    def _search_executor(self):
+        if self._search_pool is None:
+            workers = config['search_workers'] or min(config['search_partitions'], os.cpu_count() or 1)
+            self._search_pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="rag-search")
+        return self._search_pool
+
+    def _assemble_partitions(self, hashes):
+        """
+        Split the files into search_partitions partitions by content hash and search their indexes together.
+
+        Saved partitions are reopened, so only the partitions of new or changed files are built, in
+        parallel, from those files' shards. Queries fan out to all partitions on the search pool.
+        """
+        num_partitions = config['search_partitions']
+        groups = [[] for _ in range(num_partitions)]
+        for file_hash in dict.fromkeys(hashes.values()):
+            groups[partition_of(file_hash, num_partitions)].append(file_hash)
+        groups = [group for group in groups if group]
+        self.index_dirs = [self._partition_path(group) for group in groups]
+        self.manifest = {fp: {"hash": file_hash, "ids": []} for fp, file_hash in hashes.items()}
+
+        with metrics.timer("index.restore_seconds"):
+            partitions = [self._restore_partition(group) for group in groups]
+        missing = [group for group, partition in zip(groups, partitions) if partition is None]
+        if missing:
+            needed = {file_hash for group in missing for file_hash in group}
+            with metrics.timer("index.load_shards_seconds"):
+                shards = self._load_shards({fp: file_hash for fp, file_hash in hashes.items() if file_hash in needed})
+            shards_by_hash = {file_hash: shard for file_hash, shard in shards.values()}
+            with metrics.timer("index.build_partitions_seconds"):
+                built = iter(list(self._search_executor().map(lambda group: self._build_partition(group, shards_by_hash), missing)))
+            partitions = [partition if partition is not None else next(built) for partition in partitions]
+
+        # Partitions whose files produced no chunks have no index.
+        partitions = [partition for partition in partitions if partition is not None]
+        if not partitions:
+            return
+        shard_hashes = [file_hash for _, _, meta in partitions for file_hash in meta["shard_hashes"]]
+        sizes = [meta.get("shard_sizes") for _, _, meta in partitions]
+        shard_sizes = [size for group in sizes for size in group] if None not in sizes else None
+        self.vector_store = FAISS(
+            embedding_function=self._get_embeddings(),
+            index=ShardedIndex([index for index, _, _ in partitions], self._search_executor()),
+            docstore=self._chain_docstores(shard_hashes, shard_sizes),
+            index_to_docstore_id=ChainedIdMap(id_map for _, id_map, _ in partitions),
+        )
+        self.index_type = "/".join(dict.fromkeys(meta["index_type"] for _, _, meta in partitions))
+        self.in_place_updates = False
+        quantized = any("quantization" in meta["params"] for _, _, meta in partitions)
+        self.full_vectors = self._open_full_vectors(quantized, shard_hashes)
+
+    def _restore_partition(self, file_hashes):
+        """Return (index, id map, metadata) of a saved partition over these files, or None if it has to be built."""
+        path = self._partition_path(file_hashes)
+        meta = self._read_index_meta(path)
+        if meta is None:
+            return None
+        index_type = resolve_index_type(config['index_type'], meta["num_vectors"])
+        params = index_params(index_type, meta["num_vectors"], meta["dimension"])
+        if (meta["index_type"], meta["params"]) != (index_type, params) \
+                or not all(is_saved(self._shard_path(file_hash)) for file_hash in meta["shard_hashes"]):
+            return None
+        mmap = self._mmap_enabled()
+        index = configure_search(read_index(os.path.join(path, INDEX_FILE), mmap), params)
+        return index, load_positions(path, mmap), meta
+
+    def _build_partition(self, file_hashes, shards_by_hash):
+        """Build and save the index over the shards of a partition's files, returning it as _restore_partition does."""
+        shards = [(file_hash, shards_by_hash[file_hash]) for file_hash in file_hashes if shards_by_hash.get(file_hash) is not None]
+        if not shards:
+            return None
+        vectors = np.concatenate([shard.index.reconstruct_n(0, shard.index.ntotal) for _, shard in shards])
+        ids = [shard.index_to_docstore_id[i] for _, shard in shards for i in range(shard.index.ntotal)]
+        num_vectors, dimension = vectors.shape
+        index_type = resolve_index_type(config['index_type'], num_vectors)
+        params = index_params(index_type, num_vectors, dimension)
+
+        path = self._partition_path(file_hashes)
+        os.makedirs(path, exist_ok=True)
+        write_index(build_index(vectors, index_type, params), os.path.join(path, INDEX_FILE))
+        save_positions(path, ids)
+        # As for the assembled index, the metadata is written last.
+        meta = {
+            "index_type": index_type,
+            "params": params,
+            "num_vectors": num_vectors,
+            "dimension": dimension,
+            "shard_hashes": [file_hash for file_hash, _ in shards],
+            "shard_sizes": [shard.index.ntotal for _, shard in shards],
+        }
+        with open(os.path.join(path, "index_meta.json"), 'w') as f:
+            json.dump(meta, f)
+        return self._restore_partition(file_hashes)
+
+    def _chain_docstores(self, shard_hashes, shard_sizes=None):
+        """Return the docstores of the shards whose vectors make up an index, in the order of their positions."""
+        docstores = [SQLiteDocstore(os.path.join(self._shard_path(file_hash), DOCSTORE_FILE)) for file_hash in shard_hashes]
+        return ChainedDocstore(docstores, shard_sizes)
+
+    def _open_full_vectors(self, quantized, shard_hashes):
+        """Return the shards' full-precision vectors when a quantized index is rescored with them, else None."""
+        if not quantized or not config['rescore_factor']:
+            return None
+        shard_paths = [self._shard_path(file_hash) for file_hash in shard_hashes]
+        if not all(is_saved(path) for path in shard_paths):
+            print("Warning: Some shards are missing, so search results are not rescored at full precision.")
+            return None
+        full_vectors = ShardVectors(shard_paths)
+        if full_vectors.ntotal != self.vector_store.index.ntotal:
+            print("Warning: The shards do not match the index, so search results are not rescored at full precision.")
+            return None
+        return full_vectors
+
+    def update_index(self):
+        """
+        Bring the assembled index in line with the current files, re-embedding only what changed.
+
+        Vectors of changed and removed files are deleted and the shards of changed and new files
+        are merged in. Reassembles from scratch when there is no index or the embedding model changed.
+        """
+        with self._index_lock:
+            self._update_index()
+
+    def _update_index(self):
+        if self.vector_store is None or self.index_embedding_model != self.embedding_model:
+            self._create_index()
+            return
+
+        current_hashes, stale_paths, changed_paths = self._pending_changes()
+        if not stale_paths and not changed_paths:
+            print("Index is up to date.")
+            return
+
+        if not self.in_place_updates:
+            # Approximate and memory-mapped indexes are rebuilt from the shards, which still embeds only the changed files.
+            self._create_index()
+            return
+
+        with metrics.timer("index.update_seconds"):
+            stale_ids = self._update_in_place(current_hashes, stale_paths, changed_paths)
+        print(f"Index updated: {len(changed_paths)} file(s) re-indexed, {len(stale_ids)} stale chunk(s) removed.")
+
+    def _pending_changes(self):
+        """Return the current content hashes, the indexed paths that are outdated or gone, and the paths to (re)index."""
+        current_hashes = self._hash_files(self.file_paths)
+        stale_paths = [fp for fp in self.manifest if current_hashes.get(fp) != self.manifest[fp]["hash"]]
+        changed_paths = [fp for fp in self.file_paths if self.manifest.get(fp, {}).get("hash") != current_hashes[fp]]
+        return current_hashes, stale_paths, changed_paths
+
+    def refresh_index(self, file_paths=None):
+        """
+        Update the index for file_paths (by default the current files) on a copy, then swap the copy in.
+
+        Questions keep using the current index and chain while the copy is updated, including those
+        still in flight after the swap. Returns False when nothing changed.
+        """
+        with self._index_lock:
+            shadow = copy.copy(self)
+            shadow.file_paths = list(file_paths or self.file_paths)
+            up_to_date = self.chain is not None and self.index_embedding_model == self.embedding_model
+            if up_to_date and not any(shadow._pending_changes()[1:]):
+                return False
+
+            shadow.manifest = copy.deepcopy(self.manifest)
+            if self.vector_store is not None and self.in_place_updates:
+                shadow.vector_store = copy_vector_store(self.vector_store)
+            shadow._update_index()
+            shadow.build_chain()
+            self.__dict__.update(shadow.__dict__)
+            return True
+
+    def _update_in_place(self, current_hashes, stale_paths, changed_paths):
+        """Delete the vectors of stale files, merge in the shards of changed ones and return the deleted ids."""
+        stale_entries = [self.manifest.pop(fp) for fp in stale_paths]
+        stale_ids = []
+        for entry in stale_entries:
+            # A remaining file with identical content takes over the vectors instead of losing them.
+            heir = next((e for e in self.manifest.values() if e["hash"] == entry["hash"] and not e["ids"]), None)
+            if heir is not None:
+                heir["ids"] = entry["ids"]
+            else:
+                stale_ids.extend(entry["ids"])
+        if stale_ids:
+            self.vector_store.delete(stale_ids)
+
+        self._merge_shards(self._load_shards({fp: current_hashes[fp] for fp in changed_paths}))
+        return stale_ids
+
+    def clear_index(self):
+        """Delete the shards of the selected files and the saved indexes built from them."""
+        for entry in self.manifest.values():
+            shard_path = self._shard_path(entry["hash"])
+            if os.path.exists(shard_path):
+                close_connections(shard_path)
+                shutil.rmtree(shard_path)
+        for path in self.index_dirs:
+            close_connections(path)
+            shutil.rmtree(path, ignore_errors=True)
+        self.index_dirs = []
+        self.vector_store = None
+        self.chain = None
+        self.lexical_index = None
+        self.manifest = {}
+
+    def collect_index_garbage(self):
+        """
+        Delete shards of content that no known file has anymore, and saved indexes built from such shards.
+
+        A file's content is known while the cache has seen it at its path, so the shards of other
+        selections survive as long as their files are unchanged. Returns the number of directories removed.
+        """
+        # The current files' shards stay even when the cache has forgotten them.
+        live = self.cache_manager.live_hashes() | {entry["hash"] for entry in self.manifest.values()}
+        stale = []
+        shards_dir = os.path.join(self.index_path, "shards")
+        if os.path.isdir(shards_dir):
+            stale.extend(os.path.join(shards_dir, name) for name in os.listdir(shards_dir) if name.split("_", 1)[0] not in live)
+        for kind in ("assembled", "partitions"):
+            saved_dir = os.path.join(self.index_path, kind)
+            if not os.path.isdir(saved_dir):
+                continue
+            for name in os.listdir(saved_dir):
+                path = os.path.join(saved_dir, name)
+                meta = self._read_index_meta(path)
+                # Without metadata the index is still being written, or its writer was interrupted.
+                if meta is None and time.time() - os.path.getmtime(path) < TMP_GRACE_SECONDS:
+                    continue
+                if self._index_dirs.in_use(path):
+                    continue
+                if meta is None or not set(meta.get("shard_hashes", [None])) <= live:
+                    stale.append(path)
+        for path in stale:
+            close_connections(path)
+            shutil.rmtree(path, ignore_errors=True)
+        return len(stale)
+
+    def setup(self):
+        with metrics.timer("setup.total_seconds"):
+            with metrics.timer("setup.cache_gc_seconds"):
+                self.cache_manager.collect_garbage()
+            self.update_index()
+            # After the update, so the current files' shards are known to be live.
+            with metrics.timer("setup.index_gc_seconds"):
+                self.collect_index_garbage()
+            self.build_chain()
+
+    def build_chain(self):
+        if self.vector_store is None:
+            print("No index is available. Please run the `/reindex` command.")
+            self.chain = None
+            return
 
-        retriever = self.vector_store.as_retriever(k=config['k_retriever'])
-        llm = ChatOllama(model=self.chat_model, temperature=config['temperature'], max_new_tokens=config['max_new_tokens'], n_ctx=config['n_ctx'], n_gpu_layers=config['n_gpu_layers'], verbose=config['verbose'])
+        self.lexical_index = self._open_lexical_index() if self._lexical_enabled() else None
+        # Bound to a snapshot so the chain keeps searching this index after refresh_index swaps in another.
+        snapshot = copy.copy(self)
+        snapshot.chain = None
+        retriever = RunnableLambda(snapshot._retrieve)
+        llm = ChatOllama(model=self.chat_model, base_url=config['ollama_base_url'], temperature=config['temperature'], max_new_tokens=config['max_new_tokens'], n_ctx=config['n_ctx'], n_gpu_layers=config['n_gpu_layers'], verbose=config['verbose'])
 
         contextualize_q_prompt = ChatPromptTemplate.from_messages([
             ("system", "Given a chat history and the latest user question which might reference context in the chat history, formulate a standalone question which can be understood without the chat history. Do NOT answer the question, just reformulate it if needed and otherwise return it as is."),
@@ -134,28 +968,295 @@ class RAGManager:
             MessagesPlaceholder("chat_history"),
             ("human", "{input}"),
         ])
-        history_aware_retriever = create_history_aware_retriever(
-            llm, retriever, contextualize_q_prompt
-        )
+        history_aware_retriever = self._build_history_aware_retriever(llm, retriever, contextualize_q_prompt)
+        if config['context_assembly']:
+            history_aware_retriever = RunnableParallel(docs=history_aware_retriever, inputs=RunnablePassthrough()) \
+                | RunnableLambda(self._assemble_context)
 
         qa_prompt = ChatPromptTemplate.from_messages([
-            ("system", "You are an assistant for question-answering tasks. Use the following pieces of retrieved context to answer the question. If you don't know the answer, just say that you don't know. Use three sentences maximum and keep the answer concise.\n\nContext: {context}"),
+            ("system", _QA_SYSTEM_PROMPT),
             MessagesPlaceholder("chat_history"),
             ("human", "{input}"),
         ])
         
-        question_answer_chain = create_stuff_documents_chain(llm, qa_prompt)
+        answer_llm = llm.with_config(callbacks=[LLMMetricsHandler(metrics, "ask.generate")]) if metrics.enabled else llm
+        question_answer_chain = create_stuff_documents_chain(answer_llm, qa_prompt)
         
         self.chain = create_retrieval_chain(history_aware_retriever, question_answer_chain)
+        self.answer_cache = None
+        if config['answer_cache']:
+            self.answer_cache = AnswerCache(
+                self._answer_cache_file(),
+                self.index_version(),
+                threshold=config['answer_cache_threshold'],
+                max_entries=config['answer_cache_size'],
+                ttl=config['answer_cache_ttl'],
+            )
 
-    def ask(self, question, chat_history):
-        if not self.chain:
-            return "The index is not set up. Please run the `/reindex` command."
+    def _open_lexical_index(self):
+        """Open the BM25 postings of the selected shards, building them for shards that predate them."""
+        shard_paths = [self._shard_path(file_hash) for file_hash in dict.fromkeys(entry["hash"] for entry in self.manifest.values())]
+        shard_paths = [path for path in shard_paths if is_saved(path)]
+        for path in shard_paths:
+            ensure_lexical_index(path)
+        return BM25Index(shard_paths, config['lexical_max_df'])
+
+    def _uses_embedder(self, question):
+        """Return False when a question is answered from the BM25 index alone."""
+        mode = config['retrieval_mode']
+        if mode == 'lexical':
+            return False
+        return mode == 'vector' or not (config['lexical_fast_path'] and _is_keyword_query(question))
+
+    def _fetch_docs(self, positions):
+        """Return the chunks at these index positions, read from the shards owning them."""
+        docstore, id_map = self.vector_store.docstore, self.vector_store.index_to_docstore_id
+        docs = (docstore.search_at(int(position), id_map[int(position)]) for position in positions)
+        return [doc for doc in docs if isinstance(doc, Document)]
+
+    def _fetch_lexical_docs(self, hits):
+        """Return the chunks of BM25 hits, read from the shards they were found in."""
+        docstore = self.vector_store.docstore
+        docs = (docstore.search_in(os.path.join(shard_path, DOCSTORE_FILE), doc_id) for shard_path, doc_id in hits)
+        return [doc for doc in docs if isinstance(doc, Document)]
+
+    def _retrieve(self, question):
+        with metrics.timer("ask.retrieve_seconds"):
+            docs = self._search(question)
+        metrics.observe("ask.retrieved_chunks", len(docs))
+        metrics.observe("ask.context_chars", sum(len(doc.page_content) for doc in docs))
+        return docs
+
+    def _embed_query(self, question):
+        """Return the embedding of a question, memoized so a question is embedded once per model."""
+        key = (self.index_embedding_model, question)
+        with self._query_vector_lock:
+            if key in self._query_vectors:
+                self._query_vectors.move_to_end(key)
+                return self._query_vectors[key]
+
+        with metrics.timer("ask.embed_query_seconds"):
+            vector = self.vector_store.embeddings.embed_query(question)
+        with self._query_vector_lock:
+            self._query_vectors[key] = vector
+            if len(self._query_vectors) > _QUERY_VECTOR_CACHE_SIZE:
+                self._query_vectors.popitem(last=False)
+        return vector
+
+    def _vector_search(self, question, k):
+        vector = self._embed_query(question)
+        with metrics.timer("ask.vector_search_seconds"):
+            return self._search_by_vector(vector, k)
+
+    def _search_by_vector(self, vector, k):
+        """
+        Return the k chunks nearest to an embedding.
+
+        A quantized index only approximates distances, so when full-precision vectors are available it
+        is asked for rescore_factor times k candidates, which are then ranked by their exact distance.
+        """
+        query = np.array([vector], dtype=np.float32)
+        if self.full_vectors is None:
+            _, positions = self.vector_store.index.search(query, k)
+            return self._fetch_docs(positions[0][positions[0] >= 0])
+        _, positions = self.vector_store.index.search(query, k * config['rescore_factor'])
+        positions = positions[0][positions[0] >= 0]
+        if not len(positions):
+            return []
+        distances = ((self.full_vectors.get(positions) - query) ** 2).sum(axis=1)
+        return self._fetch_docs(positions[np.argsort(distances, kind="stable")[:k]])
+
+    def _lexical_search(self, question, k):
+        with metrics.timer("ask.lexical_search_seconds"):
+            return [(shard_path, doc_id) for shard_path, doc_id, _ in self.lexical_index.hits(question, k)]
+
+    def _search(self, question):
+        """
+        Return the top chunks for a question by fusing the vector and BM25 rankings with reciprocal rank fusion.
+
+        Keyword-style questions, and every question in lexical mode, are looked up in the BM25 index
+        only, so no embedding is computed; a keyword lookup without BM25 matches falls back to fusion.
+        In vector mode, only the vector ranking is used.
+        """
+        k = config['k_retriever']
+        if self.lexical_index is None:
+            return self._vector_search(question, k)
+        if not self._uses_embedder(question):
+            lexical_hits = self._lexical_search(question, k)
+            if lexical_hits or config['retrieval_mode'] == 'lexical':
+                return self._fetch_lexical_docs(lexical_hits)
+
+        fetch_k = max(k, config['hybrid_fetch_k'])
+        vector_docs = self._vector_search(question, fetch_k)
+        lexical_hits = self._lexical_search(question, fetch_k)
+        fused_ids = reciprocal_rank_fusion([[doc.id for doc in vector_docs], [doc_id for _, doc_id in lexical_hits]], config['rrf_k'])[:k]
+
+        by_id = {doc.id: doc for doc in vector_docs}
+        fused = set(fused_ids)
+        missing = [(shard_path, doc_id) for shard_path, doc_id in lexical_hits if doc_id in fused and doc_id not in by_id]
+        by_id.update((doc.id, doc) for doc in self._fetch_lexical_docs(missing))
+        return [by_id[doc_id] for doc_id in fused_ids if doc_id in by_id]
+
+    def _context_budget(self, inputs):
+        """Return how many tokens the retrieved context may take, leaving room for the prompt, history and answer."""
+        available = config['n_ctx'] - config['max_new_tokens']
+        available -= estimate_tokens(_QA_SYSTEM_PROMPT) + estimate_tokens(inputs["input"])
+        available -= sum(estimate_tokens(message.content) for message in inputs.get("chat_history") or [])
+        if config['context_token_budget']:
+            available = min(available, config['context_token_budget'])
+        return max(0, available)
+
+    def _assemble_context(self, retrieved):
+        """
+        Merge overlapping and adjacent chunks, drop near-duplicates and pack the rest into the token budget.
+
+        Chunks stay in rank order, so the budget is spent on the best matches first.
+        """
+        docs = retrieved["docs"]
+        merged = merge_chunks(docs, config['chunk_overlap'])
+        unique = drop_near_duplicates(merged, config['context_dedup_threshold'])
+        packed = pack(unique, self._context_budget(retrieved["inputs"]))
+        metrics.count("context.chunks_merged", len(docs) - len(merged))
+        metrics.count("context.duplicates_dropped", len(merged) - len(unique))
+        metrics.count("context.chunks_over_budget", len(unique) - len(packed))
+        metrics.observe("ask.context_tokens", sum(estimate_tokens(doc.page_content) for doc in packed))
+        return packed
+
+    def _build_history_aware_retriever(self, llm, retriever, contextualize_q_prompt):
+        """
+        Retrieve with a standalone version of the question, calling the LLM to rewrite it only when needed.
 
+        The rewrite is skipped without chat history and, when rewrite_gate is on, for questions that do
+        not refer back to the conversation. Rewrites are memoized per (chat history, question).
+        """
+        self._rewrite_chain = contextualize_q_prompt | llm | StrOutputParser()
+        self._summary_chain = _SUMMARY_PROMPT | llm | StrOutputParser()
+        return (RunnableLambda(self._standalone_question) | retriever).with_config(run_name="chat_retriever_chain")
+
+    def new_chat_history(self):
+        """Return an empty ChatHistory whose older turns, in 'summary' mode, are summarized with the chat model."""
+        return ChatHistory(summarize=self.summarize_history)
+
+    def summarize_history(self, summary, turns, max_tokens):
+        """Return the running summary of a conversation with turns folded in, in about max_tokens tokens."""
+        if self.chain is None:
+            raise RuntimeError("The index is not set up.")
+        transcript = "\n".join(f"User: {question}\nAssistant: {answer}" for question, answer in turns)
+        with metrics.timer("ask.summarize_history_seconds"):
+            return self._summary_chain.invoke({
+                "summary": summary or "(none yet)",
+                "turns": transcript,
+                "max_words": max(1, max_tokens * 3 // 4),
+            })
+
+    def _standalone_question(self, inputs):
+        question = inputs["input"]
+        chat_history = inputs.get("chat_history") or []
+        if not chat_history or (config['rewrite_gate'] and not _needs_rewrite(question)):
+            metrics.count("ask.rewrites_skipped")
+            return question
+
+        key = (tuple((message.type, message.content) for message in chat_history), question)
+        with self._rewrite_lock:
+            if key in self._rewrite_cache:
+                self._rewrite_cache.move_to_end(key)
+                metrics.count("ask.rewrite_cache_hits")
+                return self._rewrite_cache[key]
+
+        with metrics.timer("ask.rewrite_seconds"):
+            standalone_question = self._rewrite_chain.invoke(inputs)
+        with self._rewrite_lock:
+            self._rewrite_cache[key] = standalone_question
+            if len(self._rewrite_cache) > _REWRITE_CACHE_SIZE:
+                self._rewrite_cache.popitem(last=False)
+        return standalone_question
+
+    def _selection_key(self):
+        return hashlib.sha256("\n".join(sorted(self.file_paths)).encode('utf-8')).hexdigest()
+
+    def content_version(self):
+        """Return a fingerprint of the indexed content and embedding model."""
+        state = {
+            "embedding_model": self.index_embedding_model,
+            "files": sorted(entry["hash"] for entry in self.manifest.values()),
+        }
+        return hashlib.sha256(json.dumps(state).encode('utf-8')).hexdigest()
+
+    def index_version(self):
+        """Return a fingerprint of the indexed content and models, which changes whenever answers may differ."""
+        state = {"content_version": self.content_version(), "chat_model": self.chat_model}
+        return hashlib.sha256(json.dumps(state).encode('utf-8')).hexdigest()
+
+    def _answer_cache_file(self):
+        return os.path.join(self.cache_manager.cache_path, ANSWERS_DIR, f"{self._selection_key()}.sqlite")
+
+    def _lookup_answer(self, inputs):
+        """Return (cached answer, standalone question, question embedding); all None when the answer cache is off or skipped."""
+        if self.answer_cache is None:
+            return None, None, None
+        standalone_question = self._standalone_question(inputs)
+        if not self._uses_embedder(standalone_question):
+            # Keyword lookups skip the answer cache rather than embed the question just to consult it.
+            return None, None, None
+        vector = self._embed_query(standalone_question)
+        cached_answer = self.answer_cache.get(vector)
+        metrics.count("answer_cache.hits" if cached_answer is not None else "answer_cache.misses")
+        return cached_answer, standalone_question, vector
+
+    def _format_chat_history(self, chat_history):
+        summary, turns = chat_history.snapshot() if isinstance(chat_history, ChatHistory) else ("", chat_history)
         formatted_chat_history = []
-        for human, ai in chat_history:
+        if summary:
+            formatted_chat_history.append(SystemMessage(content=f"Summary of the earlier conversation: {summary}"))
+        for human, ai in turns:
             formatted_chat_history.append(HumanMessage(content=human))
             formatted_chat_history.append(AIMessage(content=ai))
+        return formatted_chat_history
+
+    def ask(self, question, chat_history):
+        chain = self.chain
+        if not chain:
+            return "The index is not set up. Please run the `/reindex` command."
+        with metrics.timer("ask.total_seconds"):
+            return self._ask(chain, question, chat_history)
+
+    def _ask(self, chain, question, chat_history):
+        inputs = {"input": question, "chat_history": self._format_chat_history(chat_history)}
+        cached_answer, standalone_question, vector = self._lookup_answer(inputs)
+        if cached_answer is not None:
+            return cached_answer
+
+        result = chain.invoke(inputs)
+        if 'answer' not in result:
+            return "I couldn't find an answer."
+        if vector is not None:
+            self.answer_cache.set(standalone_question, vector, result['answer'])
+        return result['answer']
+
+    def ask_stream(self, question, chat_history):
+        """Yield the answer to a question piece by piece as the chat model generates it."""
+        chain = self.chain
+        if not chain:
+            yield "The index is not set up. Please run the `/reindex` command."
+            return
+
+        inputs = {"input": question, "chat_history": self._format_chat_history(chat_history)}
+        cached_answer, standalone_question, vector = self._lookup_answer(inputs)
+        if cached_answer is not None:
+            yield cached_answer
+            return
 
-        result = self.chain.invoke({"input": question, "chat_history": formatted_chat_history})
-        return result.get('answer', "I couldn't find an answer.")
+        tokens = []
+        start = time.perf_counter()
+        for chunk in chain.stream(inputs):
+            # The retrieval chain also streams its input and retrieved context; only answer tokens are yielded.
+            if chunk.get('answer'):
+                if not tokens:
+                    metrics.observe("ask.first_token_seconds", time.perf_counter() - start)
+                tokens.append(chunk['answer'])
+                yield chunk['answer']
+        metrics.observe("ask.stream_seconds", time.perf_counter() - start)
+        if not tokens:
+            yield "I couldn't find an answer."
+        elif vector is not None:
+            self.answer_cache.set(standalone_question, vector, "".join(tokens))
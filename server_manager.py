@@ -0,0 +1,191 @@
+import json
+import uuid
+import asyncio
+import threading
+import contextlib
+import concurrent.futures
+from collections import OrderedDict
+from aiohttp import web
+from config import config
+from metrics import metrics
+
+_DONE = object()
+
+class _ReadWriteLock:
+    """Lets any number of questions run together while a reindex waits for them and runs alone."""
+
+    def __init__(self):
+        self._condition = asyncio.Condition()
+        self._readers = 0
+        self._writing = False
+
+    @contextlib.asynccontextmanager
+    async def reading(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: not self._writing)
+            self._readers += 1
+        try:
+            yield
+        finally:
+            async with self._condition:
+                self._readers -= 1
+                self._condition.notify_all()
+
+    @contextlib.asynccontextmanager
+    async def writing(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: not self._writing)
+            # Claimed before waiting for readers, so new questions queue up behind the reindex.
+            self._writing = True
+            await self._condition.wait_for(lambda: self._readers == 0)
+        try:
+            yield
+        finally:
+            async with self._condition:
+                self._writing = False
+                self._condition.notify_all()
+
+class ServerManager:
+    """
+    HTTP server answering many chat sessions from one loaded RAGManager.
+
+    Each session keeps its own chat history. At most `concurrency` questions reach the model
+    backend at once; the rest wait their turn. Concurrent query embeddings are micro-batched.
+    """
+
+    def __init__(self, rag_manager, concurrency=None):
+        self.rag_manager = rag_manager
+        self.concurrency = concurrency or config['server_concurrency']
+        self.rag_manager.batch_queries = True
+        self.sessions = OrderedDict()
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.concurrency)
+        self._backend = None
+        self._index_lock = None
+
+    def create_app(self):
+        # Created here so they belong to the event loop that serves the app.
+        self._backend = asyncio.Semaphore(self.concurrency)
+        self._index_lock = _ReadWriteLock()
+
+        app = web.Application()
+        app.add_routes([
+            web.get('/health', self.health),
+            web.get('/metrics', self.export_metrics),
+            web.post('/ask', self.ask),
+            web.post('/ask/stream', self.ask_stream),
+            web.post('/reindex', self.reindex),
+            web.delete('/sessions/{session_id}', self.delete_session),
+        ])
+        return app
+
+    def run(self, host=None, port=None):
+        host = host or config['server_host']
+        port = port or config['server_port']
+        print(f"Serving {len(self.rag_manager.file_paths)} file(s) on http://{host}:{port}")
+        web.run_app(self.create_app(), host=host, port=port, print=None)
+
+    def _history(self, session_id):
+        if session_id not in self.sessions:
+            self.sessions[session_id] = self.rag_manager.new_chat_history()
+        history = self.sessions[session_id]
+        self.sessions.move_to_end(session_id)
+        if len(self.sessions) > config['server_max_sessions']:
+            self.sessions.popitem(last=False)
+        return history
+
+    def _record(self, history, question, answer):
+        if "The index is not set up" not in answer:
+            history.add(question, answer)
+
+    @staticmethod
+    async def _read_question(request):
+        try:
+            body = await request.json()
+        except json.JSONDecodeError:
+            raise web.HTTPBadRequest(text=json.dumps({"error": "Request body must be JSON."}), content_type='application/json')
+        if not isinstance(body, dict) or not body.get("question"):
+            raise web.HTTPBadRequest(text=json.dumps({"error": "Missing 'question'."}), content_type='application/json')
+        question, session_id = body["question"], body.get("session_id")
+        if not isinstance(question, str) or not question.strip():
+            raise web.HTTPBadRequest(text=json.dumps({"error": "'question' must be a non-empty string."}), content_type='application/json')
+        if session_id is not None and not isinstance(session_id, str):
+            raise web.HTTPBadRequest(text=json.dumps({"error": "'session_id' must be a string."}), content_type='application/json')
+        return question.strip(), session_id or str(uuid.uuid4())
+
+    async def health(self, request):
+        return web.json_response({
+            "status": "ok",
+            "files": self.rag_manager.file_paths,
+            "indexed": self.rag_manager.chain is not None,
+            "sessions": len(self.sessions),
+        })
+
+    async def export_metrics(self, request):
+        """Expose the per-stage timings and counters in the Prometheus text format."""
+        return web.Response(text=metrics.to_prometheus(), content_type='text/plain')
+
+    async def ask(self, request):
+        question, session_id = await self._read_question(request)
+        history = self._history(session_id)
+        loop = asyncio.get_running_loop()
+        async with self._index_lock.reading(), self._backend:
+            answer = await loop.run_in_executor(self._executor, self.rag_manager.ask, question, history)
+        self._record(history, question, answer)
+        return web.json_response({"session_id": session_id, "answer": answer})
+
+    async def ask_stream(self, request):
+        """Stream the answer as newline-delimited JSON: {"token": ...} lines, then {"done": true}."""
+        question, session_id = await self._read_question(request)
+        history = self._history(session_id)
+        loop = asyncio.get_running_loop()
+        tokens = asyncio.Queue()
+        cancelled = threading.Event()
+
+        def produce(chat_history):
+            stream = self.rag_manager.ask_stream(question, chat_history)
+            try:
+                for token in stream:
+                    if cancelled.is_set():
+                        break
+                    loop.call_soon_threadsafe(tokens.put_nowait, token)
+            except Exception as e:
+                loop.call_soon_threadsafe(tokens.put_nowait, e)
+            finally:
+                # Closing the generator closes the model's stream too, so it stops generating.
+                stream.close()
+                loop.call_soon_threadsafe(tokens.put_nowait, _DONE)
+
+        response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson", "X-Session-Id": session_id})
+        await response.prepare(request)
+        answer, failed = [], False
+        async with self._index_lock.reading(), self._backend:
+            producer = loop.run_in_executor(self._executor, produce, history)
+            try:
+                while (item := await tokens.get()) is not _DONE:
+                    if isinstance(item, Exception):
+                        failed = True
+                        await response.write(json.dumps({"error": f"{type(item).__name__}: {item}"}).encode() + b"\n")
+                        continue
+                    answer.append(item)
+                    await response.write(json.dumps({"token": item}).encode() + b"\n")
+            finally:
+                # When the client has gone, write() raises; the producer is stopped before the
+                # backend slot and the index are released, so a reindex never runs under it.
+                cancelled.set()
+                await producer
+        await response.write(json.dumps({"done": True, "session_id": session_id}).encode() + b"\n")
+        await response.write_eof()
+        if not failed:
+            self._record(history, question, "".join(answer))
+        return response
+
+    async def reindex(self, request):
+        loop = asyncio.get_running_loop()
+        async with self._index_lock.writing():
+            await loop.run_in_executor(self._executor, self.rag_manager.update_index)
+            await loop.run_in_executor(self._executor, self.rag_manager.build_chain)
+        return web.json_response({"status": "ok", "indexed": self.rag_manager.chain is not None})
+
+    async def delete_session(self, request):
+        self.sessions.pop(request.match_info['session_id'], None)
+        return web.json_response({"status": "ok"})
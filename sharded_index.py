@@ -0,0 +1,39 @@
+"""
+Search a selection's vectors split over several FAISS indexes.
+
+With search_partitions set, the files of a selection are divided into that many partitions by
+content hash, and each partition gets its own index. A partition is rebuilt only when one of its
+files changes. A query is searched in every partition at once on a thread pool, since FAISS
+releases the GIL while it searches, and the per-partition top-k results are merged.
+"""
+
+import numpy as np
+
+def partition_of(file_hash, num_partitions):
+    """Return the partition a file belongs to, from its content hash."""
+    return int(file_hash[:16], 16) % num_partitions
+
+class ShardedIndex:
+    """
+    Several FAISS indexes searched as one, with positions numbered as if the indexes were concatenated.
+
+    Only what searching through LangChain's FAISS store needs is supported; the indexes are read-only.
+    """
+
+    def __init__(self, indexes, executor):
+        self.indexes = list(indexes)
+        self.executor = executor
+        self.starts = np.cumsum([0] + [index.ntotal for index in self.indexes])
+        self.ntotal = int(self.starts[-1])
+        self.d = self.indexes[0].d
+
+    def search(self, x, k):
+        results = list(self.executor.map(lambda index: index.search(x, k), self.indexes))
+        distances = np.hstack([partial for partial, _ in results])
+        positions = np.hstack([
+            np.where(local >= 0, local + start, -1) for (_, local), start in zip(results, self.starts)
+        ])
+        # Positions an index could not fill are -1 with the largest distance, so they sort last.
+        distances = np.where(positions >= 0, distances, np.inf)
+        order = np.argsort(distances, axis=1, kind="stable")[:, :k]
+        return np.take_along_axis(distances, order, axis=1), np.take_along_axis(positions, order, axis=1)
@@ -0,0 +1,208 @@
+"""
+Split large text files into chunks without reading them into memory.
+
+The chunks, and their start_index metadata, are the same as those of TextLoader followed by
+RecursiveCharacterTextSplitter with its default separators and add_start_index=True. The file is
+read in blocks and separators are found in the raw bytes; a stretch too long for one chunk is read
+again from disk to split it further rather than kept, so memory stays bounded by a few chunks
+whatever the size of the file. (Only after a long run of chunks shorter than chunk_overlap could the
+splitter's own start_index search reach back further than the text kept for it.)
+"""
+
+import os
+import re
+import codecs
+import locale
+from collections import deque
+from langchain_core.documents import Document
+
+BLOCK_SIZE = 1 << 20
+# Bytes past a match's start that must be read before the match is final (CR LF CR LF and a lookahead).
+_LOOKAHEAD = 8
+# A character takes at most four bytes in UTF-8; a CRLF newline takes two.
+_MAX_BYTES_PER_CHAR = 4
+# Encodings in which separator bytes never occur inside another character.
+_STREAMABLE_ENCODINGS = ('utf-8', 'ascii', 'iso8859-1', 'cp1252')
+# Chunk sizes of text kept before where the next start_index search begins.
+_SEARCH_MARGIN = 4
+
+# Files are read with universal newlines, so CRLF and a lone CR each count as one newline.
+_NEWLINE = rb"(?:\r\n|\r(?!\n)|\n)"
+_SEPARATORS = [
+    re.compile(_NEWLINE * 2),  # "\n\n"
+    re.compile(_NEWLINE),      # "\n"
+    re.compile(rb" "),         # " "
+    None,                      # "", one split per character
+]
+
+def stream_encoding(encoding=None):
+    """Return the codec name a file is read with, as TextLoader would, or None if it cannot be streamed."""
+    name = codecs.lookup(encoding or locale.getpreferredencoding(False)).name
+    return name if name in _STREAMABLE_ENCODINGS else None
+
+class _FileSplitter:
+    """RecursiveCharacterTextSplitter._split_text and create_documents over byte ranges of an open file."""
+
+    def __init__(self, file, chunk_size, chunk_overlap, encoding, block_size):
+        self.file = file
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.encoding = encoding
+        self.block_size = block_size
+        # A piece longer than this many bytes is certainly too long for a chunk, so its bytes are not kept.
+        self.max_piece_bytes = chunk_size * _MAX_BYTES_PER_CHAR
+        # State of _merge_splits for the current run of short splits.
+        self._current = deque()
+        self._total = 0
+        # The text after the earliest position the next start_index search can begin at.
+        self._window = []
+        self._window_start = 0
+        self._index = 0
+        self._previous_length = 0
+
+    def _read(self, start, end):
+        """Yield (block, is_last) for the bytes in [start, end)."""
+        position = start
+        while True:
+            # Reads of nested ranges interleave, so every read seeks first.
+            self.file.seek(position)
+            block = self.file.read(min(self.block_size, end - position))
+            position += len(block)
+            last = position >= end or not block
+            yield block, last
+            if last:
+                return
+
+    def _decode(self, data):
+        return data.decode(self.encoding).replace("\r\n", "\n").replace("\r", "\n")
+
+    def _chars(self, start, end):
+        decoder = codecs.getincrementaldecoder(self.encoding)()
+        carried_cr = ""
+        for block, last in self._read(start, end):
+            text = carried_cr + decoder.decode(block, final=last)
+            # A CR at the end of a block may start a CRLF.
+            carried_cr = "\r" if text.endswith("\r") and not last else ""
+            if carried_cr:
+                text = text[:-1]
+            yield from text.replace("\r\n", "\n").replace("\r", "\n")
+
+    def _extend(self, data, more):
+        if data is None:
+            return None
+        data += more
+        return data if len(data) <= self.max_piece_bytes else None
+
+    def _pieces(self, start, end, pattern):
+        """
+        Yield (start, end, data) for the pieces of [start, end) split before each match of pattern,
+        so each piece after the first starts with its separator. data is None for pieces too long to keep.
+        """
+        piece_start, data = start, bytearray()
+        buffer, buffer_start = b"", start
+        for block, last in self._read(start, end):
+            buffer += block
+            # Matches starting before safe cannot change once more of the file is read.
+            safe = len(buffer) if last else max(0, len(buffer) - _LOOKAHEAD)
+            taken = resume = 0
+            for match in pattern.finditer(buffer):
+                if match.start() >= safe:
+                    break
+                data = self._extend(data, buffer[taken:match.start()])
+                yield piece_start, buffer_start + match.start(), data
+                piece_start, data, taken = buffer_start + match.start(), bytearray(), match.start()
+                resume = match.end()
+            resume = max(resume, safe)
+            data = self._extend(data, buffer[taken:resume])
+            buffer, buffer_start = buffer[resume:], buffer_start + resume
+        yield piece_start, end, data
+
+    def _contains(self, start, end, pattern):
+        pieces = self._pieces(start, end, pattern)
+        next(pieces)
+        return next(pieces, None) is not None
+
+    def _feed(self, text):
+        self._window.append(text)
+
+    def _locate(self, chunk):
+        """Return the chunk's start_index as create_documents computes it, searching from an estimated offset."""
+        offset = max(0, self._index + self._previous_length - self.chunk_overlap, self._window_start)
+        window = "".join(self._window)
+        found = window.find(chunk, offset - self._window_start)
+        self._index = -1 if found < 0 else self._window_start + found
+        self._previous_length = len(chunk)
+        # Chunks shorter than the overlap move later searches back, so some text before the next one is kept too.
+        keep_from = max(self._window_start, self._index + len(chunk) - self.chunk_overlap - _SEARCH_MARGIN * self.chunk_size)
+        self._window = [window[keep_from - self._window_start:]]
+        self._window_start = keep_from
+        return self._index
+
+    def _add(self, split):
+        """Add a short split to the current run, yielding the chunk it completes, as _merge_splits does."""
+        self._feed(split)
+        if self._total + len(split) > self.chunk_size and self._current:
+            yield from self._join()
+            while self._total > self.chunk_overlap or (self._total + len(split) > self.chunk_size and self._total > 0):
+                self._total -= len(self._current.popleft())
+        self._current.append(split)
+        self._total += len(split)
+
+    def _join(self):
+        text = "".join(self._current).strip()
+        if text:
+            yield text, self._locate(text)
+
+    def _flush(self):
+        yield from self._join()
+        self._current.clear()
+        self._total = 0
+
+    def chunks(self, start, end, level=0):
+        """Yield (text, start_index) for the chunks of [start, end), trying the separators from level on."""
+        for level in range(level, len(_SEPARATORS)):
+            pattern = _SEPARATORS[level]
+            if pattern is None or self._contains(start, end, pattern):
+                break
+
+        if pattern is None:
+            for char in self._chars(start, end):
+                if len(char) < self.chunk_size:
+                    yield from self._add(char)
+                else:
+                    # Only with a chunk_size of 1: such splits become chunks as they are, unstripped.
+                    yield from self._flush()
+                    self._feed(char)
+                    yield char, self._locate(char)
+            yield from self._flush()
+            return
+
+        for piece_start, piece_end, data in self._pieces(start, end, pattern):
+            if piece_start == piece_end:
+                continue
+            text = self._decode(data) if data is not None else None
+            if text is not None and len(text) < self.chunk_size:
+                yield from self._add(text)
+            else:
+                yield from self._flush()
+                yield from self.chunks(piece_start, piece_end, level + 1)
+        yield from self._flush()
+
+def split_text_file(file_path, chunk_size, chunk_overlap, encoding=None, block_size=BLOCK_SIZE):
+    """
+    Yield the chunks of a text file as Documents while reading it in blocks.
+
+    Raises ValueError if the file's encoding cannot be streamed; check with stream_encoding first.
+    """
+    name = stream_encoding(encoding)
+    if name is None:
+        raise ValueError(f"Cannot stream files encoded as {encoding or locale.getpreferredencoding(False)}.")
+    if chunk_overlap > chunk_size:
+        raise ValueError(f"Got a larger chunk overlap ({chunk_overlap}) than chunk size ({chunk_size}), should be smaller.")
+    with open(file_path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if not size:
+            return
+        splitter = _FileSplitter(f, chunk_size, chunk_overlap, name, block_size)
+        for text, start_index in splitter.chunks(0, size):
+            yield Document(page_content=text, metadata={"source": file_path, "start_index": start_index})
@@ -0,0 +1,69 @@
+import faiss
+import numpy as np
+import pytest
+from unittest.mock import patch
+from ann_index import resolve_index_type, index_params, build_index, configure_search
+from config import config
+
+@pytest.fixture
+def vectors():
+    return np.random.default_rng(42).random((2000, 16), dtype=np.float32)
+
+def test_resolve_explicit_index_type():
+    assert resolve_index_type('hnsw', 10) == 'hnsw'
+
+def test_resolve_unknown_index_type():
+    with pytest.raises(ValueError):
+        resolve_index_type('lsh', 10)
+
+def test_resolve_auto_by_corpus_size():
+    with patch.dict(config, {'auto_hnsw_min_vectors': 100, 'auto_ivfpq_min_vectors': 1000}):
+        assert resolve_index_type('auto', 99) == 'flat'
+        assert resolve_index_type('auto', 100) == 'hnsw'
+        assert resolve_index_type('auto', 1000) == 'ivfpq'
+
+def test_ivf_params_respect_training_size():
+    with patch.dict(config, {'ivf_nlist': 0}):
+        params = index_params('ivf', 390, 16)
+    assert params["nlist"] == 10
+
+def test_ivfpq_sub_quantizers_divide_dimension():
+    with patch.dict(config, {'pq_m': 16}):
+        params = index_params('ivfpq', 100000, 24)
+    assert 24 % params["pq_m"] == 0
+    assert params["pq_m"] == 12
+
+@pytest.mark.parametrize("index_type", ['flat', 'hnsw', 'ivf', 'ivfpq'])
+def test_build_index_finds_stored_vectors(index_type, vectors):
+    params = index_params(index_type, len(vectors), vectors.shape[1])
+    index = build_index(vectors, index_type, params)
+
+    assert index.ntotal == len(vectors)
+    _, ids = index.search(vectors[:20], 5)
+    hits = sum(i in row for i, row in enumerate(ids))
+    assert hits >= 15
+
+@pytest.mark.parametrize("index_type", ['flat', 'hnsw', 'ivf'])
+@pytest.mark.parametrize("quantization, bytes_per_dimension", [('fp16', 2), ('int8', 1)])
+def test_quantized_index_stores_compressed_vectors(index_type, quantization, bytes_per_dimension, vectors):
+    with patch.dict(config, {'vector_quantization': quantization}):
+        params = index_params(index_type, len(vectors), vectors.shape[1])
+    index = build_index(vectors, index_type, params)
+
+    assert params["quantization"] == quantization
+    assert faiss.downcast_index(index.storage if index_type == 'hnsw' else index).code_size == bytes_per_dimension * vectors.shape[1]
+    _, ids = index.search(vectors[:20], 5)
+    assert sum(i in row for i, row in enumerate(ids)) >= 15
+
+def test_quantization_leaves_ivfpq_alone():
+    with patch.dict(config, {'vector_quantization': 'int8'}):
+        assert "quantization" not in index_params('ivfpq', 100000, 24)
+
+def test_unknown_quantization():
+    with patch.dict(config, {'vector_quantization': 'int4'}), pytest.raises(ValueError):
+        index_params('flat', 10, 16)
+
+def test_configure_search_sets_query_parameters(vectors):
+    index = build_index(vectors, 'ivf', {"nlist": 8, "nprobe": 1})
+    configure_search(index, {"nprobe": 4})
+    assert index.nprobe == 4
@@ -0,0 +1,92 @@
+import sqlite3
+import pytest
+from unittest.mock import patch
+from answer_cache import AnswerCache
+
+@pytest.fixture
+def cache_file(tmp_path):
+    return str(tmp_path / "answers" / "selection.sqlite")
+
+def make_cache(cache_file, index_version="v1", **kwargs):
+    options = {"threshold": 0.9, "max_entries": 2, "ttl": 60}
+    options.update(kwargs)
+    return AnswerCache(cache_file, index_version, **options)
+
+def saved_questions(cache_file):
+    conn = sqlite3.connect(cache_file)
+    try:
+        return [row[0] for row in conn.execute("SELECT question FROM answers ORDER BY used")]
+    finally:
+        conn.close()
+
+def test_hit_above_threshold(cache_file):
+    cache = make_cache(cache_file)
+    cache.set("What is RAG?", [1.0, 0.0], "Retrieval-augmented generation.")
+    assert cache.get([0.99, 0.05]) == "Retrieval-augmented generation."
+
+def test_miss_below_threshold(cache_file):
+    cache = make_cache(cache_file)
+    cache.set("What is RAG?", [1.0, 0.0], "Retrieval-augmented generation.")
+    assert cache.get([0.0, 1.0]) is None
+
+def test_least_recently_used_entry_is_evicted(cache_file):
+    cache = make_cache(cache_file)
+    cache.set("a", [1.0, 0.0, 0.0], "A")
+    cache.set("b", [0.0, 1.0, 0.0], "B")
+    cache.get([1.0, 0.0, 0.0])  # "a" is now the most recently used
+    cache.set("c", [0.0, 0.0, 1.0], "C")
+
+    assert cache.get([1.0, 0.0, 0.0]) == "A"
+    assert cache.get([0.0, 1.0, 0.0]) is None
+    assert cache.get([0.0, 0.0, 1.0]) == "C"
+
+def test_entries_expire_after_ttl(cache_file):
+    cache = make_cache(cache_file)
+    with patch('answer_cache.time.time', return_value=1000.0):
+        cache.set("a", [1.0, 0.0], "A")
+    with patch('answer_cache.time.time', return_value=1061.0):
+        assert cache.get([1.0, 0.0]) is None
+
+def test_cache_persists_for_same_index_version(cache_file):
+    cache = make_cache(cache_file)
+    cache.set("a", [1.0, 0.0], "A")
+    cache.flush()
+    assert make_cache(cache_file).get([1.0, 0.0]) == "A"
+
+def test_each_change_is_written_as_rows(cache_file):
+    cache = make_cache(cache_file)
+    cache.set("a", [1.0, 0.0, 0.0], "A")
+    cache.set("b", [0.0, 1.0, 0.0], "B")
+    cache.get([1.0, 0.0, 0.0])
+    cache.set("c", [0.0, 0.0, 1.0], "C")
+    cache.flush()
+
+    # "b" was evicted, and the recency of "a" survives a restart.
+    assert saved_questions(cache_file) == ["a", "c"]
+    reopened = make_cache(cache_file)
+    reopened.get([1.0, 0.0, 0.0])
+    reopened.set("d", [0.0, 0.7, 0.7], "D")
+    assert reopened.get([0.0, 0.0, 1.0]) is None
+    assert reopened.get([1.0, 0.0, 0.0]) == "A"
+
+def test_index_version_change_invalidates_entries(cache_file):
+    cache = make_cache(cache_file)
+    cache.set("a", [1.0, 0.0], "A")
+    cache.flush()
+    assert make_cache(cache_file, index_version="v2").get([1.0, 0.0]) is None
+    # The stale entries are gone for good, not just hidden.
+    assert make_cache(cache_file).get([1.0, 0.0]) is None
+
+def test_corrupt_cache_file_is_ignored(cache_file, capsys):
+    cache = make_cache(cache_file)
+    cache.set("a", [1.0, 0.0], "A")
+    cache.flush()
+    with open(cache_file, 'w') as f:
+        f.write("not a database" * 100)
+    cache = make_cache(cache_file)
+    assert cache.get([1.0, 0.0]) is None
+    assert "Could not read answer cache" in capsys.readouterr().out
+    # The corrupt file is replaced by the next write.
+    cache.set("b", [0.0, 1.0], "B")
+    cache.flush()
+    assert saved_questions(cache_file) == ["b"]
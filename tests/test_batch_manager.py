@@ -0,0 +1,86 @@
+import json
+import time
+import threading
+import pytest
+from unittest.mock import MagicMock
+from batch_manager import BatchManager
+
+@pytest.fixture
+def questions_file(tmp_path):
+    path = tmp_path / "questions.jsonl"
+    lines = [
+        json.dumps({"id": "q1", "question": "What is the port?"}),
+        "",
+        json.dumps("What is the timeout?"),
+        json.dumps({"question": "And the retries?", "chat_history": [["What is the timeout?", "30s"]]}),
+    ]
+    path.write_text("\n".join(lines) + "\n")
+    return str(path)
+
+def _read_results(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+def test_read_questions(questions_file):
+    questions = BatchManager.read_questions(questions_file)
+    assert [(q["id"], q["question"]) for q in questions] == [
+        ("q1", "What is the port?"), (2, "What is the timeout?"), (3, "And the retries?"),
+    ]
+
+def test_read_questions_rejects_lines_without_question(tmp_path):
+    path = tmp_path / "questions.jsonl"
+    path.write_text(json.dumps({"id": 1}) + "\n")
+    with pytest.raises(ValueError):
+        BatchManager.read_questions(str(path))
+
+def test_run_writes_every_answer(questions_file, tmp_path):
+    rag_manager = MagicMock()
+    rag_manager.ask.side_effect = lambda question, chat_history: f"answer to {question}"
+    out_path = str(tmp_path / "answers.jsonl")
+
+    summary = BatchManager(rag_manager, concurrency=2).run(questions_file, out_path)
+
+    results = sorted(_read_results(out_path), key=lambda r: str(r["id"]))
+    assert [r["answer"] for r in results] == ["answer to What is the timeout?", "answer to And the retries?", "answer to What is the port?"]
+    assert all(r["latency"] >= 0 for r in results)
+    assert summary["questions"] == 3
+    assert summary["errors"] == 0
+    rag_manager.ask.assert_any_call("And the retries?", [("What is the timeout?", "30s")])
+
+def test_run_records_errors_and_continues(questions_file, tmp_path):
+    rag_manager = MagicMock()
+    rag_manager.ask.side_effect = lambda question, chat_history: 1 / 0 if "port" in question else "ok"
+    out_path = str(tmp_path / "answers.jsonl")
+
+    summary = BatchManager(rag_manager, concurrency=2).run(questions_file, out_path)
+
+    results = {r["id"]: r for r in _read_results(out_path)}
+    assert results["q1"]["error"].startswith("ZeroDivisionError")
+    assert results[2]["answer"] == "ok"
+    assert summary["errors"] == 1
+
+def test_questions_are_answered_concurrently(questions_file, tmp_path):
+    running, peak = 0, 0
+    lock = threading.Lock()
+
+    def ask(question, chat_history):
+        nonlocal running, peak
+        with lock:
+            running += 1
+            peak = max(peak, running)
+        time.sleep(0.05)
+        with lock:
+            running -= 1
+        return "ok"
+
+    rag_manager = MagicMock()
+    rag_manager.ask.side_effect = ask
+    BatchManager(rag_manager, concurrency=3).run(questions_file, str(tmp_path / "answers.jsonl"))
+    assert peak == 3
+
+def test_summarize():
+    summary = BatchManager.summarize([0.4, 0.1, 0.2, 0.3], errors=1, elapsed=2.0)
+    assert summary["questions_per_second"] == 2.0
+    assert summary["latency_max"] == 0.4
+    assert summary["latency_p50"] == 0.3
+    assert summary["latency_mean"] == pytest.approx(0.25)
@@ -0,0 +1,65 @@
+import json
+import pytest
+from langchain_core.messages import HumanMessage
+from rag_manager import _parse_file
+from benchmarks.corpus import generate_corpus, generate_questions
+from benchmarks.fakes import FakeEmbeddings, FakeChatModel
+from benchmarks.run import compare, main
+
+@pytest.mark.parametrize("file_format", ["txt", "pdf", "docx"])
+def test_generated_documents_can_be_parsed(tmp_path, file_format):
+    [path] = generate_corpus(str(tmp_path), 1, 4, formats=(file_format,))
+    docs = _parse_file(path, 1024, 100)
+    assert len(docs) >= 3
+    assert all(doc.page_content.strip() for doc in docs)
+
+def test_corpus_is_deterministic(tmp_path):
+    first = generate_corpus(str(tmp_path / "a"), 4, 2, seed=7)
+    second = generate_corpus(str(tmp_path / "b"), 4, 2, seed=7)
+    for path_a, path_b in zip(first, second):
+        with open(path_a, 'rb') as a, open(path_b, 'rb') as b:
+            assert a.read() == b.read()
+    assert [path.rsplit(".", 1)[1] for path in first] == ["txt", "md", "pdf", "docx"]
+
+def test_fake_embeddings_are_deterministic_and_word_based():
+    embeddings = FakeEmbeddings(dimension=64)
+    upload, upload_again, network = embeddings.embed_documents(["upload limit", "limit upload", "network latency"])
+    assert upload == upload_again
+    assert upload != network
+    assert embeddings.calls == 1 and embeddings.texts == 3
+
+def test_fake_chat_model_streams_tokens():
+    chat_model = FakeChatModel(answer_tokens=5)
+    chunks = list(chat_model.stream([HumanMessage(content="what about uploads")]))
+    assert len(chunks) == 5
+    assert chat_model.invoke([HumanMessage(content="what about uploads")]).content == "".join(chunk.content for chunk in chunks)
+
+def test_compare_reports_only_regressions_beyond_tolerance():
+    baseline = {
+        "a_ms": {"value": 100.0, "unit": "ms", "better": "lower"},
+        "b_per_second": {"value": 100.0, "unit": "1/s", "better": "higher"},
+        "c_ms": {"value": 100.0, "unit": "ms", "better": "lower"},
+    }
+    results = {
+        "a_ms": {"value": 120.0, "unit": "ms", "better": "lower"},
+        "b_per_second": {"value": 80.0, "unit": "1/s", "better": "higher"},
+        "c_ms": {"value": 105.0, "unit": "ms", "better": "lower"},
+        "new_ms": {"value": 1.0, "unit": "ms", "better": "lower"},
+    }
+    assert [name for name, *_ in compare(results, baseline, 0.1)] == ["a_ms", "b_per_second"]
+
+def test_generated_questions():
+    assert generate_questions(3) == generate_questions(3)
+    assert len(set(generate_questions(20))) > 1
+
+def test_benchmark_run_writes_results_and_compares(tmp_path):
+    out = tmp_path / "results.json"
+    args = ["--files", "3", "--file-kb", "4", "--formats", "txt,pdf,docx", "--questions", "5",
+            "--workdir", str(tmp_path / "work"), "--out", str(out)]
+    assert main(args) == 0
+
+    results = json.loads(out.read_text())["results"]
+    assert results["index.chunks"]["value"] > 0
+    assert {"ask.p50_ms", "ask.p99_ms", "cache.get_hit_ms", "index.mmap_restore_seconds"} <= set(results)
+
+    assert main(args + ["--out", str(tmp_path / "again.json"), "--baseline", str(out), "--tolerance", "1000"]) == 0
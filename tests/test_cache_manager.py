@@ -1,7 +1,11 @@
 import os
 import shutil
 import pytest
-from cache_manager import CacheManager
+from unittest.mock import patch
+from langchain_core.documents import Document
+import cache_manager as cache_manager_module
+from cache_manager import CacheManager, TMP_GRACE_SECONDS
+from embedding_cache import EmbeddingCache, trim_embeddings
 
 @pytest.fixture
 def cache_manager():
@@ -37,7 +41,10 @@ def test_cache_manager_init(cache_manager):
 
 def test_set_and_get_cache(cache_manager, temp_file):
     """Test setting and getting a cache entry."""
-    data_to_cache = {'docs': ['doc1', 'doc2'], 'metadata': 'test'}
+    data_to_cache = [
+        Document(page_content='doc1', metadata={'source': temp_file, 'page': 1}),
+        Document(page_content='doc2 \u00e9\u4e2d', metadata={'source': temp_file}),
+    ]
     embedding_model = 'test_model'
 
     # Set data in cache
@@ -47,7 +54,7 @@ def test_set_and_get_cache(cache_manager, temp_file):
     retrieved_data = cache_manager.get(temp_file, embedding_model)
 
     assert retrieved_data is not None
-    assert retrieved_data == data_to_cache
+    assert list(retrieved_data) == data_to_cache
 
 def test_get_non_existent_cache(cache_manager, temp_file):
     """Test getting a non-existent cache entry returns None."""
@@ -56,7 +63,7 @@ def test_get_non_existent_cache(cache_manager, temp_file):
 
 def test_cache_invalidation_on_content_change(cache_manager, temp_file):
     """Test that the cache is invalidated if the file content changes."""
-    data_to_cache = {'docs': ['doc1']}
+    data_to_cache = [Document(page_content='doc1')]
     embedding_model = 'test_model'
 
     # Set initial cache
@@ -73,7 +80,7 @@ def test_cache_invalidation_on_content_change(cache_manager, temp_file):
 
 def test_cache_invalidation_on_model_change(cache_manager, temp_file):
     """Test that the cache is invalidated if the embedding model changes."""
-    data_to_cache = {'docs': ['doc1']}
+    data_to_cache = [Document(page_content='doc1')]
     embedding_model_1 = 'model_v1'
     embedding_model_2 = 'model_v2'
 
@@ -84,3 +91,261 @@ def test_cache_invalidation_on_model_change(cache_manager, temp_file):
     retrieved_data = cache_manager.get(temp_file, embedding_model_2)
 
     assert retrieved_data is None
+
+def _age_file(file_path, seconds=60):
+    """Move a file's modification time into the past, as for a document that has not been edited recently."""
+    past = os.stat(file_path).st_mtime - seconds
+    os.utime(file_path, (past, past))
+
+def test_get_file_hash_matches_content_hash(cache_manager, temp_file):
+    assert cache_manager.get_file_hash(temp_file) == cache_manager._hash_file_content(temp_file)
+
+def test_unchanged_file_is_not_read_again(cache_manager, temp_file):
+    _age_file(temp_file)
+    file_hash = cache_manager.get_file_hash(temp_file)
+
+    with patch.object(cache_manager, '_hash_file_content') as mock_hash:
+        assert cache_manager.get_file_hash(temp_file) == file_hash
+        cache_manager.set(temp_file, 'test_model', [Document(page_content='doc1')])
+        cache_manager.get(temp_file, 'test_model')
+    mock_hash.assert_not_called()
+
+def test_file_hashes_persist_across_instances(cache_manager, temp_file):
+    _age_file(temp_file)
+    file_hash = cache_manager.get_file_hash(temp_file)
+
+    other = CacheManager(cache_path=cache_manager.cache_path)
+    with patch.object(other, '_hash_file_content') as mock_hash:
+        assert other.get_file_hash(temp_file) == file_hash
+    mock_hash.assert_not_called()
+
+def test_modified_file_is_hashed_again(cache_manager, temp_file):
+    _age_file(temp_file)
+    old_hash = cache_manager.get_file_hash(temp_file)
+
+    with open(temp_file, 'w') as f:
+        f.write('This is a new file.')  # Same size as the original content
+    _age_file(temp_file, seconds=30)
+
+    assert cache_manager.get_file_hash(temp_file) != old_hash
+
+def test_recently_modified_file_is_not_trusted_from_stat(cache_manager, temp_file):
+    cache_manager.get_file_hash(temp_file)
+    with patch.object(cache_manager, '_hash_file_content', return_value='rehashed') as mock_hash:
+        assert cache_manager.get_file_hash(temp_file) == 'rehashed'
+    mock_hash.assert_called_once()
+
+def _cache_file(cache_manager, file_path, embedding_model):
+    return os.path.join(cache_manager.cache_path, cache_manager._get_cache_key(file_path, embedding_model))
+
+def test_truncated_cache_file_is_discarded(cache_manager, temp_file):
+    cache_manager.set(temp_file, 'test_model', [Document(page_content='doc1')])
+    cache_file = _cache_file(cache_manager, temp_file, 'test_model')
+    with open(cache_file, 'r+b') as f:
+        f.truncate(os.path.getsize(cache_file) - 1)
+
+    assert cache_manager.get(temp_file, 'test_model') is None
+    assert not os.path.exists(cache_file)
+
+def test_collect_garbage_removes_corrupted_cache_files(cache_manager, temp_file):
+    cache_manager.set(temp_file, 'test_model', [Document(page_content='doc1')])
+    cache_file = _cache_file(cache_manager, temp_file, 'test_model')
+    with open(cache_file, 'r+b') as f:
+        f.seek(-1, os.SEEK_END)
+        f.write(b'X')
+
+    assert cache_manager.collect_garbage() == 0
+    assert cache_manager.collect_garbage(verify=True) == 1
+    assert not os.path.exists(cache_file)
+    assert cache_manager.get(temp_file, 'test_model') is None
+
+def test_cache_file_from_other_format_version_is_discarded(cache_manager, temp_file):
+    cache_manager.set(temp_file, 'test_model', [Document(page_content='doc1')])
+    cache_file = _cache_file(cache_manager, temp_file, 'test_model')
+    with patch('chunk_file.FORMAT_VERSION', 2):
+        assert cache_manager.get(temp_file, 'test_model') is None
+    assert not os.path.exists(cache_file)
+
+def test_legacy_pickle_entry_is_removed_without_loading(cache_manager, temp_file):
+    cache_file = _cache_file(cache_manager, temp_file, 'test_model')
+    legacy_file = f"{os.path.splitext(cache_file)[0]}.pkl"
+    with open(legacy_file, 'wb') as f:
+        f.write(b'not a pickle')
+
+    assert cache_manager.get(temp_file, 'test_model') is None
+    assert not os.path.exists(legacy_file)
+
+def _write_source(tmp_path, name, text):
+    path = tmp_path / name
+    path.write_text(text)
+    _age_file(path)
+    return str(path)
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    manager = CacheManager(cache_path=str(tmp_path / "cache"))
+    docs = [Document(page_content='x' * 1000)]
+    files = [_write_source(tmp_path, f"{name}.txt", name) for name in ('a', 'b', 'c')]
+    manager.set(files[0], 'model', docs)
+    manager.max_bytes = 2 * manager.stats()['size_bytes']
+
+    manager.set(files[1], 'model', docs)
+    assert manager.get(files[0], 'model') is not None  # Now more recently used than b
+    manager.set(files[2], 'model', docs)
+
+    assert manager.get(files[1], 'model') is None
+    assert manager.get(files[0], 'model') is not None
+    assert manager.get(files[2], 'model') is not None
+    stats = manager.stats()
+    assert stats['entries'] == 2
+    assert stats['evictions'] == 1
+    assert stats['size_bytes'] <= manager.max_bytes
+
+def test_entry_larger_than_limit_is_kept_until_next_write(tmp_path):
+    manager = CacheManager(cache_path=str(tmp_path / "cache"), max_bytes=10)
+    source = _write_source(tmp_path, "a.txt", "a")
+    manager.set(source, 'model', [Document(page_content='x' * 1000)])
+    assert manager.get(source, 'model') is not None
+
+def test_write_through_caches_documents_once_all_are_written(cache_manager, temp_file):
+    docs = [Document(page_content='doc1'), Document(page_content='doc2')]
+    written = cache_manager.write_through(temp_file, 'model', iter(docs))
+
+    assert next(written) == docs[0]
+    assert cache_manager.get(temp_file, 'model') is None
+    assert list(written) == docs[1:]
+    assert list(cache_manager.get(temp_file, 'model')) == docs
+
+def test_write_through_stopped_early_caches_nothing(cache_manager, temp_file):
+    written = cache_manager.write_through(temp_file, 'model', iter([Document(page_content='doc1'), Document(page_content='doc2')]))
+    next(written)
+    written.close()
+
+    assert cache_manager.get(temp_file, 'model') is None
+    assert os.listdir(cache_manager.cache_path) == ['cache_index.sqlite']
+
+def test_hit_and_miss_counts(cache_manager, temp_file):
+    cache_manager.get(temp_file, 'model')
+    cache_manager.set(temp_file, 'model', [Document(page_content='doc1')])
+    cache_manager.get(temp_file, 'model')
+    stats = cache_manager.stats()
+    assert (stats['hits'], stats['misses']) == (1, 1)
+
+def test_collect_garbage_removes_entries_of_deleted_and_changed_files(tmp_path):
+    manager = CacheManager(cache_path=str(tmp_path / "cache"))
+    docs = [Document(page_content='doc')]
+    kept = _write_source(tmp_path, "kept.txt", "kept")
+    deleted = _write_source(tmp_path, "deleted.txt", "deleted")
+    changed = _write_source(tmp_path, "changed.txt", "changed")
+    for source in (kept, deleted, changed):
+        manager.set(source, 'model', docs)
+    os.remove(deleted)
+    with open(changed, 'w') as f:
+        f.write('edited')
+    _age_file(changed, seconds=30)
+
+    assert manager.collect_garbage() == 2
+    assert manager.get(kept, 'model') is not None
+    assert manager.stats()['entries'] == 1
+    assert sorted(name for name in os.listdir(manager.cache_path) if name.endswith('.chunks')) == \
+        [manager._get_cache_key(kept, 'model')]
+
+def test_collect_garbage_keeps_entry_shared_by_a_remaining_copy(tmp_path):
+    manager = CacheManager(cache_path=str(tmp_path / "cache"))
+    original = _write_source(tmp_path, "original.txt", "same")
+    copy = _write_source(tmp_path, "copy.txt", "same")
+    manager.set(original, 'model', [Document(page_content='doc')])
+    assert manager.get(copy, 'model') is not None
+    os.remove(original)
+
+    assert manager.collect_garbage() == 0
+    assert manager.get(copy, 'model') is not None
+
+def test_collect_garbage_removes_untracked_files(cache_manager):
+    stray = os.path.join(cache_manager.cache_path, 'deadbeef_model.pkl')
+    with open(stray, 'wb') as f:
+        f.write(b'old')
+    other = os.path.join(cache_manager.cache_path, 'notes.txt')
+    with open(other, 'w') as f:
+        f.write('not a cache file')
+
+    assert cache_manager.collect_garbage() == 1
+    assert not os.path.exists(stray)
+    assert os.path.exists(other)
+
+def test_collect_garbage_keeps_recent_temporary_files(cache_manager):
+    recent = os.path.join(cache_manager.cache_path, 'abc_model.chunks.text.tmp')
+    old = os.path.join(cache_manager.cache_path, 'def_model.chunks.tmp')
+    for path in (recent, old):
+        with open(path, 'wb') as f:
+            f.write(b'partial')
+    _age_file(old, seconds=TMP_GRACE_SECONDS + 60)
+
+    assert cache_manager.collect_garbage() == 1
+    assert os.path.exists(recent)
+    assert not os.path.exists(old)
+
+def test_collect_garbage_removes_expired_answer_caches(cache_manager):
+    answers_dir = os.path.join(cache_manager.cache_path, 'answers')
+    os.makedirs(answers_dir)
+    fresh, expired = os.path.join(answers_dir, 'fresh.json'), os.path.join(answers_dir, 'expired.json')
+    for path in (fresh, expired):
+        with open(path, 'w') as f:
+            f.write('{}')
+    _age_file(expired, seconds=120)
+
+    with patch.dict('cache_manager.config', {'answer_cache_ttl': 60}):
+        assert cache_manager.collect_garbage() == 1
+    assert os.listdir(answers_dir) == ['fresh.json']
+
+def test_size_limit_covers_answer_and_embedding_caches(tmp_path):
+    cache_path = str(tmp_path / "cache")
+    manager = CacheManager(cache_path=cache_path)
+    embedding_cache = EmbeddingCache(cache_path=cache_path)
+    texts = [f"chunk {i}" for i in range(2000)]
+    embedding_cache.set_many(texts, 'model', [[float(i)] * 64 for i in range(len(texts))])
+    os.makedirs(os.path.join(cache_path, 'answers'))
+    with open(os.path.join(cache_path, 'answers', 'selection.json'), 'w') as f:
+        f.write('x' * 10000)
+    source = _write_source(tmp_path, "a.txt", "a")
+    manager.set(source, 'model', [Document(page_content='doc')])
+    embeddings_size = os.path.getsize(embedding_cache.db_path)
+    assert manager.stats()['size_bytes'] > embeddings_size + 10000
+
+    manager.max_bytes = embeddings_size // 2
+    manager.set(source, 'model', [Document(page_content='doc')])
+
+    assert manager.stats()['size_bytes'] <= manager.max_bytes * 1.1
+    assert not os.listdir(os.path.join(cache_path, 'answers'))
+    remaining = embedding_cache.get_many(texts, 'model')
+    # The oldest embeddings go first.
+    assert remaining[0] is None and remaining[-1] is not None
+    assert manager.get(source, 'model') is not None
+
+def test_large_embedding_cache_does_not_evict_every_chunk_entry(tmp_path):
+    cache_path = str(tmp_path / "cache")
+    manager = CacheManager(cache_path=cache_path)
+    embedding_cache = EmbeddingCache(cache_path=cache_path)
+    embedding_cache.set_many([f"chunk {i}" for i in range(2000)], 'model', [[float(i)] * 64 for i in range(2000)])
+    sources = [_write_source(tmp_path, f"{i}.txt", str(i)) for i in range(5)]
+    for source in sources[:4]:
+        manager.set(source, 'model', [Document(page_content='x' * 20000)])
+
+    manager.max_bytes = manager.stats()['size_bytes'] // 2
+    with patch('cache_manager.trim_embeddings', wraps=cache_manager_module.trim_embeddings) as mock_trim:
+        manager.set(sources[4], 'model', [Document(page_content='x' * 20000)])
+        assert mock_trim.call_count == 1
+        assert manager.stats()['entries'] >= 2
+        assert manager.stats()['size_bytes'] <= manager.max_bytes
+
+        # Embeddings were trimmed below their share, so the next write has room without trimming again.
+        embedding_cache.set_many(["one more"], 'model', [[1.0] * 64])
+        manager.set(sources[4], 'model', [Document(page_content='x' * 20000)])
+        assert mock_trim.call_count == 1
+
+def test_trimming_embeddings_gives_pages_back_without_vacuum(tmp_path):
+    embedding_cache = EmbeddingCache(cache_path=str(tmp_path))
+    embedding_cache.set_many([f"chunk {i}" for i in range(2000)], 'model', [[float(i)] * 64 for i in range(2000)])
+    size = os.path.getsize(embedding_cache.db_path)
+
+    assert trim_embeddings(embedding_cache.db_path, size // 2) > 0
+    assert os.path.getsize(embedding_cache.db_path) <= size * 0.6
@@ -0,0 +1,69 @@
+import threading
+import pytest
+from unittest.mock import patch
+from config import config
+from chat_history import ChatHistory
+
+def _summarize_by_joining(summary, turns, max_tokens):
+    return " ".join(filter(None, [summary] + [question for question, _ in turns]))
+
+def test_replay_mode_keeps_last_turns():
+    history = ChatHistory(mode='replay')
+    with patch.dict(config, {'max_replay_history': 2}):
+        for i in range(4):
+            history.add(f"q{i}", f"a{i}")
+    assert list(history) == [("q2", "a2"), ("q3", "a3")]
+    assert history.summary == ""
+
+def test_replay_disabled_records_nothing():
+    history = ChatHistory(mode='replay')
+    with patch.dict(config, {'replay_history': False}):
+        history.add("q", "a")
+    assert len(history) == 0
+
+def test_summary_mode_folds_older_turns():
+    history = ChatHistory(summarize=_summarize_by_joining, mode='summary', recent_turns=2, summary_tokens=100)
+    for i in range(5):
+        history.add(f"q{i}", f"a{i}")
+    history.wait()
+
+    assert history.summary == "q0 q1 q2"
+    assert list(history) == [("q3", "a3"), ("q4", "a4")]
+
+def test_turns_are_replayed_until_summarized():
+    release = threading.Event()
+
+    def slow_summarize(summary, turns, max_tokens):
+        release.wait(5)
+        return "summary"
+
+    history = ChatHistory(summarize=slow_summarize, mode='summary', recent_turns=1, summary_tokens=100)
+    history.add("q0", "a0")
+    history.add("q1", "a1")
+    assert history.snapshot() == ("", [("q0", "a0"), ("q1", "a1")])
+
+    release.set()
+    history.wait()
+    assert history.snapshot() == ("summary", [("q1", "a1")])
+
+def test_summary_is_capped():
+    history = ChatHistory(summarize=lambda summary, turns, max_tokens: "word " * 100, mode='summary', recent_turns=0, summary_tokens=10)
+    history.add("q", "a")
+    history.wait()
+    assert len(history.summary) <= 40
+
+def test_failed_summary_drops_turns(capsys):
+    def failing_summarize(summary, turns, max_tokens):
+        raise ConnectionError("Ollama is down")
+
+    history = ChatHistory(summarize=failing_summarize, mode='summary', recent_turns=1, summary_tokens=100)
+    history.add("q0", "a0")
+    history.add("q1", "a1")
+    history.wait()
+
+    assert history.snapshot() == ("", [("q1", "a1")])
+    assert "Could not summarize the chat history" in capsys.readouterr().out
+
+def test_unknown_mode_is_rejected():
+    with pytest.raises(ValueError):
+        ChatHistory(mode='forget')
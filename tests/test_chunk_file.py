@@ -0,0 +1,90 @@
+import os
+import pytest
+from langchain_core.documents import Document
+from chunk_file import ChunkFile, ChunkWriter, write_chunks
+
+@pytest.fixture
+def docs():
+    return [
+        Document(page_content="first chunk", metadata={"source": "a.pdf", "page": 0}),
+        Document(page_content="", metadata={"source": "a.pdf"}),
+        Document(page_content="écrit 中文", metadata={"source": "a.pdf", "page": None}),
+    ]
+
+def test_round_trip(tmp_path, docs):
+    path = str(tmp_path / "doc.chunks")
+    write_chunks(path, docs)
+    assert list(ChunkFile(path)) == docs
+
+def test_missing_metadata_keys_stay_missing(tmp_path, docs):
+    path = str(tmp_path / "doc.chunks")
+    write_chunks(path, docs)
+    chunks = ChunkFile(path)
+    assert "page" not in chunks[1].metadata
+    assert chunks[2].metadata == {"source": "a.pdf", "page": None}
+
+def test_indexing_and_slicing(tmp_path, docs):
+    path = str(tmp_path / "doc.chunks")
+    write_chunks(path, docs)
+    chunks = ChunkFile(path)
+    assert len(chunks) == 3
+    assert chunks[-1] == docs[-1]
+    assert chunks[1:] == docs[1:]
+    with pytest.raises(IndexError):
+        chunks[3]
+
+def test_texts_do_not_decode_metadata(tmp_path, docs):
+    path = str(tmp_path / "doc.chunks")
+    write_chunks(path, docs)
+    chunks = ChunkFile(path)
+    assert [chunks.text(i) for i in range(len(chunks))] == [doc.page_content for doc in docs]
+    assert chunks._metadata is None
+
+def test_empty_chunk_file(tmp_path):
+    path = str(tmp_path / "doc.chunks")
+    write_chunks(path, [])
+    assert len(ChunkFile(path)) == 0
+
+@pytest.mark.parametrize("damage", [
+    lambda data: data[:-3],
+    lambda data: b"NOTCHUNK" + data[8:],
+])
+def test_damaged_files_are_rejected(tmp_path, docs, damage):
+    path = tmp_path / "doc.chunks"
+    write_chunks(str(path), docs)
+    path.write_bytes(damage(path.read_bytes()))
+    with pytest.raises(ValueError):
+        ChunkFile(str(path))
+
+def test_corrupted_contents_fail_verification(tmp_path, docs):
+    path = tmp_path / "doc.chunks"
+    write_chunks(str(path), docs)
+    ChunkFile(str(path)).verify()
+    data = path.read_bytes()
+    path.write_bytes(data[:-1] + bytes([data[-1] ^ 0xFF]))
+
+    # Opening checks only the header and sizes; the checksum is compared on request.
+    chunks = ChunkFile(str(path))
+    with pytest.raises(ValueError, match="checksum"):
+        chunks.verify()
+
+def test_writer_adds_documents_one_at_a_time(tmp_path, docs):
+    path = str(tmp_path / "doc.chunks")
+    writer = ChunkWriter(path)
+    for doc in docs:
+        writer.add(doc)
+    writer.close()
+
+    assert list(ChunkFile(path)) == docs
+    ChunkFile(path).verify()
+    assert os.listdir(tmp_path) == ["doc.chunks"]
+
+def test_aborted_writer_leaves_existing_file(tmp_path, docs):
+    path = str(tmp_path / "doc.chunks")
+    write_chunks(path, docs[:1])
+    writer = ChunkWriter(path)
+    writer.add(docs[2])
+    writer.abort()
+
+    assert list(ChunkFile(path)) == docs[:1]
+    assert os.listdir(tmp_path) == ["doc.chunks"]
@@ -0,0 +1,60 @@
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from context_assembly import estimate_tokens, merge_chunks, drop_near_duplicates, pack
+
+TEXT = " ".join(f"Sentence number {i} describes step {i} of the installation procedure." for i in range(12))
+
+def _chunks(add_start_index):
+    splitter = RecursiveCharacterTextSplitter(chunk_size=200, chunk_overlap=60, add_start_index=add_start_index)
+    return splitter.split_documents([Document(page_content=TEXT, metadata={"source": "guide.txt"})])
+
+def test_estimate_tokens_rounds_up():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("abcd") == 1
+    assert estimate_tokens("abcde") == 2
+
+def test_overlapping_chunks_are_merged_by_offset():
+    chunks = _chunks(add_start_index=True)
+    merged = merge_chunks([chunks[2], chunks[1]], max_overlap=60)
+
+    assert len(merged) == 1
+    assert merged[0].page_content == TEXT[chunks[1].metadata["start_index"]:chunks[2].metadata["start_index"] + len(chunks[2].page_content)]
+
+def test_overlapping_chunks_are_merged_by_text_without_offsets():
+    chunks = _chunks(add_start_index=False)
+    merged = merge_chunks([chunks[1], chunks[0]], max_overlap=60)
+
+    assert [doc.page_content for doc in merged] == [TEXT[:len(chunks[0].page_content) + len(chunks[1].page_content) - _shared(chunks[0], chunks[1])]]
+
+def _shared(first, second):
+    return next(size for size in range(len(second.page_content), 0, -1) if first.page_content.endswith(second.page_content[:size]))
+
+def test_merging_bridges_chunks_and_keeps_best_rank():
+    chunks = _chunks(add_start_index=True)
+    other = Document(page_content="Unrelated text.", metadata={"source": "other.txt"})
+    merged = merge_chunks([chunks[0], other, chunks[2], chunks[1]], max_overlap=60)
+
+    assert [doc.metadata["source"] for doc in merged] == ["guide.txt", "other.txt"]
+    assert merged[0].page_content.startswith(chunks[0].page_content)
+    assert merged[0].page_content.endswith(chunks[2].page_content)
+
+def test_chunks_of_other_sources_or_pages_are_not_merged():
+    chunks = _chunks(add_start_index=False)
+    elsewhere = Document(page_content=chunks[1].page_content, metadata={"source": "guide.txt", "page": 3})
+    assert len(merge_chunks([chunks[0], elsewhere], max_overlap=60)) == 2
+
+def test_near_duplicates_are_dropped():
+    docs = [
+        Document(page_content="Restart the server after changing the port setting."),
+        Document(page_content="Restart the server after changing the port setting!"),
+        Document(page_content="Uploads are limited to 50 MB."),
+    ]
+    assert drop_near_duplicates(docs, threshold=0.9) == [docs[0], docs[2]]
+
+def test_pack_respects_budget_in_rank_order():
+    docs = [Document(page_content="a" * 40), Document(page_content="b" * 400), Document(page_content="c" * 20)]
+    assert [doc.page_content[0] for doc in pack(docs, budget=20)] == ["a", "c"]
+
+def test_pack_truncates_best_chunk_that_does_not_fit():
+    packed = pack([Document(page_content="x" * 100)], budget=10)
+    assert packed[0].page_content == "x" * 40
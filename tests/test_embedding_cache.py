@@ -0,0 +1,78 @@
+import threading
+import pytest
+from unittest.mock import MagicMock
+from embedding_cache import EmbeddingCache, CachedEmbeddings, BatchedQueryEmbeddings
+
+@pytest.fixture
+def embedding_cache(tmp_path):
+    return EmbeddingCache(cache_path=str(tmp_path / "cache"))
+
+@pytest.fixture
+def fake_embeddings():
+    embeddings = MagicMock()
+    embeddings.embed_documents.side_effect = lambda texts: [[float(len(t)), 1.0] for t in texts]
+    embeddings.embed_query.return_value = [0.5, 0.5]
+    return embeddings
+
+def test_get_many_miss_returns_none(embedding_cache):
+    assert embedding_cache.get_many(["a", "b"], "model") == [None, None]
+
+def test_set_and_get_many(embedding_cache):
+    embedding_cache.set_many(["a", "bb"], "model", [[1.0, 2.0], [3.0, 4.0]])
+    assert embedding_cache.get_many(["bb", "c", "a"], "model") == [[3.0, 4.0], None, [1.0, 2.0]]
+
+def test_entries_are_keyed_by_model(embedding_cache):
+    embedding_cache.set_many(["a"], "model_v1", [[1.0]])
+    assert embedding_cache.get_many(["a"], "model_v2") == [None]
+
+def test_cache_persists_across_instances(tmp_path):
+    cache_path = str(tmp_path / "cache")
+    EmbeddingCache(cache_path=cache_path).set_many(["a"], "model", [[1.0, 2.0]])
+    assert EmbeddingCache(cache_path=cache_path).get_many(["a"], "model") == [[1.0, 2.0]]
+
+def test_cached_embeddings_only_embeds_missing_chunks(embedding_cache, fake_embeddings):
+    embedding_cache.set_many(["cached"], "model", [[9.0, 9.0]])
+    cached_embeddings = CachedEmbeddings(fake_embeddings, "model", embedding_cache)
+
+    vectors = cached_embeddings.embed_documents(["cached", "new", "new"])
+
+    fake_embeddings.embed_documents.assert_called_once_with(["new"])
+    assert vectors == [[9.0, 9.0], [3.0, 1.0], [3.0, 1.0]]
+
+def test_cached_embeddings_skips_embedder_on_full_hit(embedding_cache, fake_embeddings):
+    cached_embeddings = CachedEmbeddings(fake_embeddings, "model", embedding_cache)
+    first = cached_embeddings.embed_documents(["a", "b"])
+
+    fake_embeddings.embed_documents.reset_mock()
+    second = cached_embeddings.embed_documents(["a", "b"])
+
+    fake_embeddings.embed_documents.assert_not_called()
+    assert first == second
+
+def test_cached_embeddings_delegates_queries(embedding_cache, fake_embeddings):
+    cached_embeddings = CachedEmbeddings(fake_embeddings, "model", embedding_cache)
+    assert cached_embeddings.embed_query("question") == [0.5, 0.5]
+
+def _embed_concurrently(embeddings, texts):
+    results = {}
+    threads = [threading.Thread(target=lambda t=text: results.__setitem__(t, embeddings.embed_query(t))) for text in texts]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+def test_batched_queries_share_one_request(fake_embeddings):
+    batched = BatchedQueryEmbeddings(fake_embeddings, window=1.0, max_batch=3)
+
+    results = _embed_concurrently(batched, ["a", "bb", "ccc"])
+
+    fake_embeddings.embed_documents.assert_called_once()
+    assert sorted(fake_embeddings.embed_documents.call_args.args[0]) == ["a", "bb", "ccc"]
+    assert results == {"a": [1.0, 1.0], "bb": [2.0, 1.0], "ccc": [3.0, 1.0]}
+
+def test_batched_query_errors_reach_every_caller(fake_embeddings):
+    fake_embeddings.embed_documents.side_effect = RuntimeError("backend down")
+    batched = BatchedQueryEmbeddings(fake_embeddings, window=0.0, max_batch=8)
+    with pytest.raises(RuntimeError):
+        batched.embed_query("a")
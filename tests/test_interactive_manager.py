@@ -1,7 +1,10 @@
+import threading
+import concurrent.futures
 import pytest
 from unittest.mock import MagicMock, patch
 from interactive_manager import InteractiveManager
 from config import config
+from metrics import metrics
 
 @pytest.fixture
 def interactive_manager():
@@ -59,15 +62,109 @@ def test_run_unknown_command(mock_input, interactive_manager, capsys):
 @patch('builtins.input', side_effect=['hello', '/exit'])
 def test_run_user_query(mock_input, interactive_manager):
     with patch.dict(config, {'replay_history': False}):
-        interactive_manager.rag_manager.ask.return_value = "world"
+        interactive_manager.rag_manager.ask_stream.return_value = iter(["wor", "ld"])
         with pytest.raises(SystemExit) as e:
             interactive_manager.run()
         assert e.type == SystemExit
 
-        interactive_manager.rag_manager.ask.assert_called_once_with('hello', [])
+        interactive_manager.rag_manager.ask_stream.assert_called_once()
+        question, history = interactive_manager.rag_manager.ask_stream.call_args.args
+        assert (question, list(history)) == ('hello', [])
+
+@patch('builtins.input', side_effect=['hello', '/exit'])
+def test_run_streams_answer_and_records_history(mock_input, interactive_manager, capsys):
+    with patch.dict(config, {'replay_history': True}):
+        interactive_manager.rag_manager.ask_stream.return_value = iter(["wor", "ld"])
+        with pytest.raises(SystemExit):
+            interactive_manager.run()
+
+    assert "AI: world" in capsys.readouterr().out
+    assert list(interactive_manager.chat_history) == [('hello', 'world')]
 
 @patch('builtins.input', side_effect=['/exit'])
 def test_run_exit_command(mock_input, interactive_manager):
     with pytest.raises(SystemExit) as e:
         interactive_manager.run()
     assert e.type == SystemExit
+
+@patch('builtins.input', side_effect=['/cache', '/exit'])
+def test_run_cache_command(mock_input, interactive_manager, capsys):
+    interactive_manager.rag_manager.cache_manager.stats.return_value = {
+        'entries': 3, 'size_bytes': 3 * 2**20, 'max_bytes': 0,
+        'hits': 5, 'misses': 2, 'evictions': 1, 'orphans_removed': 0,
+    }
+    with pytest.raises(SystemExit):
+        interactive_manager.run()
+
+    out = capsys.readouterr().out
+    assert "3 entries, 3.0 MiB (limit: unlimited)" in out
+    assert "5 hits, 2 misses, 1 evictions" in out
+    interactive_manager.rag_manager.cache_manager.collect_garbage.assert_not_called()
+
+@patch('builtins.input', side_effect=['/cache gc', '/exit'])
+def test_run_cache_gc_command(mock_input, interactive_manager, capsys):
+    cache_manager = interactive_manager.rag_manager.cache_manager
+    cache_manager.collect_garbage.return_value = 2
+    interactive_manager.rag_manager.collect_index_garbage.return_value = 1
+    cache_manager.stats.return_value = {
+        'entries': 0, 'size_bytes': 0, 'max_bytes': 2**20,
+        'hits': 0, 'misses': 0, 'evictions': 0, 'orphans_removed': 2,
+    }
+    with pytest.raises(SystemExit):
+        interactive_manager.run()
+
+    cache_manager.collect_garbage.assert_called_once_with(verify=True)
+    cache_manager.compact.assert_called_once()
+    out = capsys.readouterr().out
+    assert "Removed 2 stale cache file(s)." in out
+    assert "Removed 1 stale index folder(s)." in out
+
+@patch('builtins.input', side_effect=['/stats', '/stats json', '/exit'])
+def test_run_stats_command(mock_input, interactive_manager, capsys):
+    metrics.reset()
+    metrics.observe("ask.total_seconds", 0.25)
+    metrics.count("answer_cache.hits", 3)
+    with pytest.raises(SystemExit):
+        interactive_manager.run()
+
+    out = capsys.readouterr().out
+    assert "ask.total_seconds" in out and "mean=0.2500" in out
+    assert '"answer_cache.hits": 3' in out
+    metrics.reset()
+
+@patch('builtins.input', side_effect=['/cache', '/exit'])
+def test_run_waits_for_background_setup(mock_input, capsys):
+    rag_manager = MagicMock()
+    rag_manager.cache_manager.stats.return_value = {
+        'entries': 1, 'size_bytes': 0, 'max_bytes': 0,
+        'hits': 0, 'misses': 1, 'evictions': 0, 'orphans_removed': 0,
+    }
+    future = concurrent.futures.Future()
+    interactive_manager = InteractiveManager(future, file_paths=["/docs/test1.txt"])
+    threading.Timer(0.05, future.set_result, args=(rag_manager,)).start()
+
+    with pytest.raises(SystemExit):
+        interactive_manager.run()
+
+    out = capsys.readouterr().out
+    assert "Chat with test1.txt!" in out
+    assert "Document cache: 1 entries" in out
+    assert interactive_manager.rag_manager is rag_manager
+
+@pytest.mark.parametrize("error, message", [
+    (FileNotFoundError("The file 'gone.txt' does not exist."), "Error during RAG Manager initialization: The file 'gone.txt' does not exist."),
+    (ConnectionError("Ollama is not running"), "An unexpected error occurred while setting up the index: Ollama is not running"),
+])
+@patch('builtins.input', side_effect=['What is this?', 'And this?'])
+def test_run_exits_once_when_background_setup_fails(mock_input, capsys, error, message):
+    future = concurrent.futures.Future()
+    future.set_exception(error)
+    interactive_manager = InteractiveManager(future, file_paths=["/docs/test1.txt"])
+
+    with pytest.raises(SystemExit):
+        interactive_manager.run()
+
+    out = capsys.readouterr().out
+    assert out.count(message) == 1
+    assert "An error occurred" not in out
+    assert mock_input.call_count == 1
@@ -0,0 +1,87 @@
+import sqlite3
+from unittest.mock import patch
+import pytest
+import vector_storage
+from lexical_index import (
+    LEXICAL_FILE,
+    BM25Index,
+    build_lexical_index,
+    ensure_lexical_index,
+    reciprocal_rank_fusion,
+    tokenize,
+)
+from vector_storage import DOCSTORE_FILE
+
+def _make_shard(path, docs):
+    path.mkdir()
+    conn = sqlite3.connect(path / DOCSTORE_FILE)
+    with conn:
+        conn.execute("CREATE TABLE docs (id TEXT PRIMARY KEY, page_content TEXT NOT NULL, metadata TEXT NOT NULL)")
+        conn.executemany("INSERT INTO docs VALUES (?, ?, '{}')", docs.items())
+    conn.close()
+    build_lexical_index(str(path))
+    return str(path)
+
+@pytest.fixture
+def shards(tmp_path):
+    return [
+        _make_shard(tmp_path / "a", {
+            "a1": "The server listens on port 8080 by default.",
+            "a2": "Set MAX_RETRIES to change how often uploads are retried.",
+        }),
+        _make_shard(tmp_path / "b", {
+            "b1": "Error ERR-1042 means the disk quota was exceeded.",
+            "b2": "The server logs every request to the access log of the server.",
+        }),
+    ]
+
+def test_tokenize_keeps_compound_tokens_and_their_parts():
+    assert tokenize("Error ERR-1042 in v2.1!") == ["error", "err-1042", "err", "1042", "in", "v2.1", "v2", "1"]
+
+def test_search_across_shards(shards):
+    index = BM25Index(shards)
+    assert index.num_docs == 4
+    assert [doc_id for doc_id, _ in index.search("err-1042", 4)] == ["b1"]
+    assert [doc_id for doc_id, _ in index.search("max_retries", 4)] == ["a2"]
+
+def test_higher_term_frequency_ranks_first(shards):
+    results = BM25Index(shards).search("server", 4)
+    assert [doc_id for doc_id, _ in results] == ["b2", "a1"]
+    assert results[0][1] > results[1][1]
+
+def test_search_without_matches(shards):
+    assert BM25Index(shards).search("nonexistent", 4) == []
+    assert BM25Index([]).search("server", 4) == []
+
+def test_stop_words_are_ignored(shards):
+    assert BM25Index(shards).search("the", 4) == []
+    assert [doc_id for doc_id, _ in BM25Index(shards).search("what is the port", 4)] == ["a1"]
+
+def test_terms_in_too_many_chunks_are_ignored(shards):
+    with patch('lexical_index.COMMON_TERM_MIN_DF', 0):
+        # "server" is in two of the four chunks.
+        assert BM25Index(shards, max_df=0.25).search("server", 4) == []
+        assert [doc_id for doc_id, _ in BM25Index(shards, max_df=0.25).search("server port", 4)] == ["a1"]
+        assert len(BM25Index(shards, max_df=0.5).search("server", 4)) == 2
+
+def test_shards_share_the_bounded_connection_pool(tmp_path):
+    paths = [_make_shard(tmp_path / f"s{i}", {f"d{i}": f"chunk number {i} about servers"}) for i in range(5)]
+    with patch.object(vector_storage, "MAX_OPEN_CONNECTIONS", 2):
+        index = BM25Index(paths)
+        assert len(index.search("servers", 5)) == 5
+        assert len([path for path in vector_storage._pool if path.startswith(str(tmp_path))]) <= 2
+
+def test_ensure_rebuilds_outdated_index(shards):
+    conn = sqlite3.connect(f"{shards[0]}/{LEXICAL_FILE}")
+    conn.execute("PRAGMA user_version = 0")
+    conn.execute("DELETE FROM postings")
+    conn.commit()
+    conn.close()
+
+    ensure_lexical_index(shards[0])
+    assert [doc_id for doc_id, _ in BM25Index(shards).search("8080", 4)] == ["a1"]
+
+def test_reciprocal_rank_fusion():
+    fused = reciprocal_rank_fusion([["a", "b", "c"], ["c", "d", "a"]], k=60)
+    assert fused[:2] == ["a", "c"]
+    assert set(fused) == {"a", "b", "c", "d"}
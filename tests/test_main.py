@@ -0,0 +1,11 @@
+import sys
+import subprocess
+
+def test_startup_imports_skip_langchain():
+    # Everything the chat prompt needs loads without LangChain, FAISS or the document loaders.
+    code = (
+        "import sys, main, interactive_manager; "
+        "print(sorted({m.split('.')[0] for m in sys.modules} & {'langchain', 'langchain_core', 'langchain_community', 'faiss', 'pypdf', 'aiohttp'}))"
+    )
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == "[]"
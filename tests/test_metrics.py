@@ -0,0 +1,51 @@
+import json
+from metrics import Metrics
+
+def test_timer_and_observe_summarize_values():
+    metrics = Metrics()
+    metrics.observe("ask.context_chars", 100)
+    metrics.observe("ask.context_chars", 300)
+    with metrics.timer("ask.total_seconds"):
+        pass
+
+    summaries = metrics.snapshot()["summaries"]
+    assert summaries["ask.context_chars"] == {"count": 2, "sum": 400, "min": 100, "max": 300, "mean": 200}
+    assert summaries["ask.total_seconds"]["count"] == 1
+    assert summaries["ask.total_seconds"]["sum"] >= 0
+
+def test_counters_accumulate():
+    metrics = Metrics()
+    metrics.count("chunk_cache.hits")
+    metrics.count("chunk_cache.hits", 2)
+    assert metrics.snapshot()["counters"] == {"chunk_cache.hits": 3}
+
+def test_disabled_metrics_record_nothing():
+    metrics = Metrics(enabled=False)
+    with metrics.timer("ask.total_seconds"):
+        metrics.observe("ask.context_chars", 1)
+        metrics.count("chunk_cache.hits")
+    assert metrics.snapshot() == {"summaries": {}, "counters": {}}
+
+def test_reset():
+    metrics = Metrics()
+    metrics.count("chunk_cache.hits")
+    metrics.reset()
+    assert metrics.snapshot() == {"summaries": {}, "counters": {}}
+
+def test_prometheus_export():
+    metrics = Metrics()
+    metrics.observe("index.embed_batch_seconds", 0.5)
+    metrics.count("embedding_cache.misses", 4)
+    text = metrics.to_prometheus()
+    assert "# TYPE rag_index_embed_batch_seconds summary" in text
+    assert "rag_index_embed_batch_seconds_count 1" in text
+    assert "rag_index_embed_batch_seconds_sum 0.5" in text
+    assert "rag_embedding_cache_misses_total 4" in text
+
+def test_write_picks_format_from_extension(tmp_path):
+    metrics = Metrics()
+    metrics.count("answer_cache.hits")
+    metrics.write(str(tmp_path / "metrics.json"))
+    metrics.write(str(tmp_path / "metrics.prom"))
+    assert json.loads((tmp_path / "metrics.json").read_text())["counters"] == {"answer_cache.hits": 1}
+    assert "rag_answer_cache_hits_total 1" in (tmp_path / "metrics.prom").read_text()
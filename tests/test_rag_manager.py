@@ -1,18 +1,56 @@
 import os
+import gc
+import multiprocessing
+import concurrent.futures
+import faiss
 import pytest
 from unittest.mock import patch, MagicMock, call
 from pathlib import Path
-from rag_manager import RAGManager
+import rag_manager as rag_manager_module
+from rag_manager import RAGManager, _parse_file
+from embedding_cache import EmbeddingCache, CachedEmbeddings
+from vector_storage import SQLiteIdMap
+from metrics import metrics
+from chat_history import ChatHistory
 from langchain_community.document_loaders import TextLoader, UnstructuredMarkdownLoader
+from langchain_core.messages import HumanMessage, AIMessage
+from langchain_core.documents import Document
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+from langchain_core.runnables import RunnableLambda
 
 @pytest.fixture
-def mock_config():
+def mock_config(tmp_path):
     with patch('rag_manager.config', {
+        # Keeps test runs from reading or writing the real ./cache directory.
+        'cache_path': str(tmp_path / "cache"),
         'embedding_model_path': 'dummy_embedding_model',
         'llm_model_path': 'dummy_chat_model',
+        'ollama_base_url': 'http://localhost:11434',
+        'query_batch_window_ms': 5,
+        'query_batch_size': 32,
         'chunk_size': 100,
         'chunk_overlap': 10,
         'k_retriever': 3,
+        'context_assembly': True,
+        'context_token_budget': 0,
+        'context_dedup_threshold': 0.9,
+        'retrieval_mode': 'vector',
+        'lexical_fast_path': True,
+        'hybrid_fetch_k': 10,
+        'rrf_k': 60,
+        'lexical_max_df': 0.2,
+        'index_type': 'flat',
+        'index_load_mode': 'memory',
+        'rewrite_gate': True,
+        'answer_cache': False,
+        'embed_batch_size': 2,
+        'embed_concurrency': 2,
+        'parse_mode': 'thread',
+        'pdf_pages_per_task': 2,
+        'stream_threshold_bytes': 0,
+        'rescore_factor': 4,
+        'search_partitions': 0,
+        'search_workers': 0,
         'temperature': 0.7,
         'max_new_tokens': 512,
         'n_ctx': 4096,
@@ -33,20 +71,28 @@ def rag_manager(tmp_path, mock_config):
     file_paths = [str(dummy_file_1_path), str(dummy_file_2_path)]
     dummy_index_path = tmp_path / "multi_doc_index"
 
-    manager = RAGManager(file_paths=file_paths, index_path=str(dummy_index_path))
-    return manager
+    return RAGManager(file_paths=file_paths, index_path=str(dummy_index_path))
 
-def test_init_no_files_provided(tmp_path):
+@pytest.fixture
+def mock_storage():
+    """Patch shard storage and raw FAISS for tests that mock the vector store itself."""
+    with patch('rag_manager.save_vector_store') as mock_save, \
+            patch('rag_manager.load_vector_store') as mock_load, \
+            patch('rag_manager.is_saved', return_value=False) as mock_is_saved, \
+            patch('rag_manager.faiss'):
+        yield MagicMock(save=mock_save, load=mock_load, is_saved=mock_is_saved)
+
+def test_init_no_files_provided(tmp_path, mock_config):
     with pytest.raises(FileNotFoundError, match="No files provided to process."):
         RAGManager(file_paths=[], index_path=str(tmp_path / "some_index"))
 
-def test_init_file_not_found(tmp_path):
+def test_init_file_not_found(tmp_path, mock_config):
     existing_file = tmp_path / "exists.txt"
     existing_file.write_text("I exist.")
     with pytest.raises(FileNotFoundError):
         RAGManager(file_paths=[str(existing_file), "non_existent_file.txt"], index_path="dummy_index")
 
-def test_init_unsupported_file_type(tmp_path):
+def test_init_unsupported_file_type(tmp_path, mock_config):
     dummy_good_file = tmp_path / "dummy.txt"
     dummy_good_file.write_text("This is a dummy good file.")
     dummy_bad_file = tmp_path / "dummy.bad"
@@ -64,7 +110,7 @@ def test_init_success(rag_manager):
 @patch('rag_manager.ChatOllama')
 @patch('rag_manager.TextLoader')
 @patch('rag_manager.UnstructuredMarkdownLoader')
-def test_setup_creates_combined_index(mock_md_loader, mock_txt_loader, mock_chat_ollama, mock_faiss, mock_ollama_embeddings, rag_manager):
+def test_setup_creates_combined_index(mock_md_loader, mock_txt_loader, mock_chat_ollama, mock_faiss, mock_ollama_embeddings, mock_storage, rag_manager):
     # Mock loaders to return dummy documents
     mock_doc_txt = MagicMock()
     mock_doc_txt.page_content = "text content"
@@ -75,10 +121,10 @@ def test_setup_creates_combined_index(mock_md_loader, mock_txt_loader, mock_chat
     mock_txt_loader.return_value.load.return_value = [mock_doc_txt]
     mock_md_loader.return_value.load.return_value = [mock_doc_md]
 
-    mock_ollama_embeddings.return_value = MagicMock()
+    mock_ollama_embeddings.return_value = FakeEmbeddings()
     mock_chat_ollama.return_value = MagicMock()
     mock_faiss_instance = MagicMock()
-    mock_faiss.from_documents.return_value = mock_faiss_instance
+    mock_faiss.from_embeddings.return_value = mock_faiss_instance
 
     rag_manager.setup()
 
@@ -86,32 +132,36 @@ def test_setup_creates_combined_index(mock_md_loader, mock_txt_loader, mock_chat
     mock_txt_loader.assert_called_with(rag_manager.file_paths[0])
     mock_md_loader.assert_called_with(rag_manager.file_paths[1])
 
-    # Check that FAISS was created with documents from all loaders
-    docs_passed_to_faiss = mock_faiss.from_documents.call_args[0][0]
-    assert len(docs_passed_to_faiss) == 2
-    page_contents = {doc.page_content for doc in docs_passed_to_faiss}
+    # Check that each file was embedded into its own shard
+    pairs_passed_to_faiss = [c[0][0] for c in mock_faiss.from_embeddings.call_args_list]
+    assert len(pairs_passed_to_faiss) == 2
+    page_contents = {text for pairs in pairs_passed_to_faiss for text, _ in pairs}
     assert {"text content", "markdown content"} == page_contents
 
-    # Check that the combined index is saved
-    mock_faiss_instance.save_local.assert_called_with(rag_manager.index_path)
+    # Check that the shards are saved and merged into one index
+    saved_paths = {c[0][1] for c in mock_storage.save.call_args_list}
+    assert saved_paths == {rag_manager._shard_path(rag_manager.cache_manager.get_file_hash(fp)) for fp in rag_manager.file_paths}
+    mock_faiss.assert_called_once()
+    assert mock_faiss.return_value.index.add.call_count == 2
     assert rag_manager.chain is not None
 
 @patch('rag_manager.OllamaEmbeddings')
 @patch('rag_manager.FAISS')
 @patch('rag_manager.ChatOllama')
-def test_setup_loads_existing_index(mock_chat_ollama, mock_faiss, mock_ollama_embeddings, rag_manager):
-    # Simulate an existing index
-    os.makedirs(rag_manager.index_path, exist_ok=True)
-    # Create a dummy file to make the directory non-empty
-    (Path(rag_manager.index_path) / "index.faiss").touch()
-
+def test_setup_loads_existing_shards(mock_chat_ollama, mock_faiss, mock_ollama_embeddings, mock_storage, rag_manager):
+    # Simulate existing shards for both files
+    mock_storage.is_saved.return_value = True
     mock_ollama_embeddings.return_value = MagicMock()
     mock_chat_ollama.return_value = MagicMock()
-    mock_faiss.load_local.return_value = MagicMock()
 
     rag_manager.setup()
 
-    mock_faiss.load_local.assert_called_with(rag_manager.index_path, mock_ollama_embeddings.return_value, allow_dangerous_deserialization=True)
+    loaded_paths = [c[0][0] for c in mock_storage.load.call_args_list]
+    assert loaded_paths == [rag_manager._shard_path(rag_manager.cache_manager.get_file_hash(fp)) for fp in rag_manager.file_paths]
+    mock_faiss.from_embeddings.assert_not_called()
+    load_args = mock_storage.load.call_args
+    assert load_args[0][1].embeddings is mock_ollama_embeddings.return_value
+    assert load_args[0][2] is False
     assert rag_manager.chain is not None
 
 @patch('rag_manager.RAGManager.setup')
@@ -124,14 +174,28 @@ def test_ask_functionality(mock_setup, rag_manager):
     assert answer == "This is a test answer."
     rag_manager.chain.invoke.assert_called_once()
 
+@patch('rag_manager.RAGManager.setup')
+def test_ask_stream_yields_answer_tokens(mock_setup, rag_manager):
+    rag_manager.chain = MagicMock()
+    rag_manager.chain.stream.return_value = iter([{"input": "q"}, {"context": []}, {"answer": "Hel"}, {"answer": "lo."}])
+
+    assert list(rag_manager.ask_stream("q", [("earlier", "reply")])) == ["Hel", "lo."]
+    chat_history = rag_manager.chain.stream.call_args[0][0]["chat_history"]
+    assert [m.content for m in chat_history] == ["earlier", "reply"]
+
+def test_ask_stream_without_chain(rag_manager):
+    assert "".join(rag_manager.ask_stream("q", [])) == "The index is not set up. Please run the `/reindex` command."
+
 @patch('rag_manager.OllamaEmbeddings')
 @patch('rag_manager.FAISS')
 @patch('rag_manager.ChatOllama')
 @patch('rag_manager.CacheManager')
-def test_create_index_uses_cache(mock_cache_manager, mock_chat_ollama, mock_faiss, mock_ollama_embeddings, rag_manager, tmp_path):
+def test_create_index_uses_cache(mock_cache_manager, mock_chat_ollama, mock_faiss, mock_ollama_embeddings, mock_storage, rag_manager, tmp_path):
     """Test that _create_index uses the cache and avoids reprocessing."""
     mock_cache_instance = mock_cache_manager.return_value
     mock_cache_instance.get.return_value = [MagicMock(page_content="cached content", metadata={"source": "dummy1.txt"})]
+    mock_cache_instance.get_file_hash.side_effect = lambda file_path: os.path.basename(file_path)
+    mock_ollama_embeddings.return_value = FakeEmbeddings()
 
     rag_manager.cache_manager = mock_cache_instance
 
@@ -148,10 +212,12 @@ def test_create_index_uses_cache(mock_cache_manager, mock_chat_ollama, mock_fais
 @patch('rag_manager.FAISS')
 @patch('rag_manager.ChatOllama')
 @patch('rag_manager.CacheManager')
-def test_create_index_processes_and_sets_cache(mock_cache_manager, mock_chat_ollama, mock_faiss, mock_ollama_embeddings, rag_manager, tmp_path):
+def test_create_index_processes_and_sets_cache(mock_cache_manager, mock_chat_ollama, mock_faiss, mock_ollama_embeddings, mock_storage, rag_manager, tmp_path):
     """Test that _create_index processes a file and sets the cache if not found."""
     mock_cache_instance = mock_cache_manager.return_value
     mock_cache_instance.get.return_value = None  # Cache miss
+    mock_cache_instance.get_file_hash.side_effect = lambda file_path: os.path.basename(file_path)
+    mock_ollama_embeddings.return_value = FakeEmbeddings()
 
     rag_manager.cache_manager = mock_cache_instance
 
@@ -168,4 +234,625 @@ def test_create_index_processes_and_sets_cache(mock_cache_manager, mock_chat_oll
             mock_cache_instance.get.assert_called()
 
             # Check that new data was set to cache
-            mock_cache_instance.set.assert_called()
\ No newline at end of file
+            mock_cache_instance.set.assert_called()
+@patch('rag_manager.OllamaEmbeddings')
+@patch('rag_manager.FAISS')
+@patch('rag_manager.ChatOllama')
+def test_create_index_uses_embedding_cache(mock_chat_ollama, mock_faiss, mock_ollama_embeddings, mock_storage, rag_manager):
+    """Test that _create_index embeds chunks through the persistent embedding cache."""
+    mock_ollama_embeddings.return_value = FakeEmbeddings()
+    rag_manager._create_index()
+
+    embeddings_passed_to_faiss = mock_faiss.from_embeddings.call_args[0][1]
+    assert isinstance(embeddings_passed_to_faiss, CachedEmbeddings)
+    assert embeddings_passed_to_faiss.embeddings is mock_ollama_embeddings.return_value
+    assert embeddings_passed_to_faiss.cache is rag_manager.embedding_cache
+
+
+class FakeEmbeddings:
+    """Deterministic stand-in for OllamaEmbeddings that records what it embeds."""
+
+    def __init__(self, *args, **kwargs):
+        self.embedded = []
+        self.batch_sizes = []
+        self.queries = []
+
+    def embed_documents(self, texts):
+        self.embedded.extend(texts)
+        self.batch_sizes.append(len(texts))
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text):
+        self.queries.append(text)
+        return self._vector(text)
+
+    @staticmethod
+    def _vector(text):
+        return [float(len(text)), float(sum(map(ord, text)) % 97), 1.0]
+
+@pytest.fixture
+def fake_embeddings():
+    fake = FakeEmbeddings()
+    # Read markdown as plain text so these tests do not depend on unstructured's extras.
+    with patch('rag_manager.OllamaEmbeddings', return_value=fake), patch('rag_manager.UnstructuredMarkdownLoader', TextLoader):
+        yield fake
+
+def _indexed_texts(rag_manager):
+    # Read by position, so the chunks must be found in the shards owning their vectors after every update.
+    docs = rag_manager._fetch_docs(range(rag_manager.vector_store.index.ntotal))
+    assert len(docs) == rag_manager.vector_store.index.ntotal
+    return sorted(doc.page_content for doc in docs)
+
+def test_update_index_skips_unchanged_files(rag_manager, fake_embeddings):
+    rag_manager._create_index()
+    fake_embeddings.embedded.clear()
+
+    rag_manager.update_index()
+
+    assert fake_embeddings.embedded == []
+    assert len(rag_manager.vector_store.index_to_docstore_id) == 2
+
+def test_update_index_replaces_changed_file(rag_manager, fake_embeddings):
+    rag_manager._create_index()
+    old_ids = rag_manager.manifest[rag_manager.file_paths[0]]["ids"]
+
+    Path(rag_manager.file_paths[0]).write_text("The first file has changed.")
+    rag_manager.update_index()
+
+    assert "The first file has changed." in _indexed_texts(rag_manager)
+    assert "This is the first dummy file." not in _indexed_texts(rag_manager)
+    assert not set(old_ids) & set(rag_manager.vector_store.index_to_docstore_id.values())
+    assert len(rag_manager.vector_store.index_to_docstore_id) == 2
+
+def test_update_index_removes_deselected_file(rag_manager, fake_embeddings):
+    rag_manager._create_index()
+    rag_manager.file_paths = rag_manager.file_paths[:1]
+
+    rag_manager.update_index()
+
+    assert _indexed_texts(rag_manager) == ["This is the first dummy file."]
+    assert list(rag_manager.manifest) == rag_manager.file_paths
+
+def test_update_index_rebuilds_on_embedding_model_change(rag_manager, fake_embeddings):
+    rag_manager._create_index()
+    rag_manager.embedding_model = "other_model"
+
+    with patch.object(rag_manager, '_create_index') as mock_create_index:
+        rag_manager.update_index()
+
+    mock_create_index.assert_called_once()
+
+def test_new_selection_reuses_existing_shards(rag_manager, fake_embeddings, tmp_path):
+    rag_manager._create_index()
+    third_file = tmp_path / "dummy3.txt"
+    third_file.write_text("A third file.")
+    fake_embeddings.embedded.clear()
+
+    other = RAGManager(file_paths=rag_manager.file_paths + [str(third_file)], index_path=rag_manager.index_path)
+    other.cache_manager = rag_manager.cache_manager
+    other.embedding_cache = EmbeddingCache(cache_path=str(tmp_path / "empty_cache"))
+    other._create_index()
+
+    assert fake_embeddings.embedded == ["A third file."]
+    assert len(other.vector_store.index_to_docstore_id) == 3
+
+def test_duplicate_content_is_merged_once(rag_manager, fake_embeddings, tmp_path):
+    copy = tmp_path / "copy.txt"
+    copy.write_text("This is the first dummy file.")
+    rag_manager.file_paths.append(str(copy))
+    rag_manager._create_index()
+    assert len(rag_manager.vector_store.index_to_docstore_id) == 2
+
+    # Dropping the original keeps the copy's vectors in the index.
+    rag_manager.file_paths.pop(0)
+    rag_manager.update_index()
+    assert _indexed_texts(rag_manager) == ["# This is a markdown file.", "This is the first dummy file."]
+
+def test_clear_index_removes_selected_shards(rag_manager, fake_embeddings):
+    rag_manager._create_index()
+    shard_paths = [rag_manager._shard_path(entry["hash"]) for entry in rag_manager.manifest.values()]
+
+    rag_manager.clear_index()
+
+    assert not any(os.path.exists(p) for p in shard_paths)
+    assert rag_manager.vector_store is None
+
+def test_build_shards_embeds_in_batches(rag_manager, fake_embeddings, tmp_path):
+    long_file = tmp_path / "long.txt"
+    long_file.write_text("\n\n".join(f"Paragraph number {i} of the long file, padded out to fill most of one chunk." for i in range(5)))
+    rag_manager.file_paths = [str(long_file)]
+
+    rag_manager._create_index()
+
+    assert max(fake_embeddings.batch_sizes) <= 2
+    assert len(rag_manager.vector_store.index_to_docstore_id) == 5
+    assert os.path.exists(rag_manager._shard_path(rag_manager.manifest[str(long_file)]["hash"]))
+
+def test_large_text_files_are_streamed_into_shards_and_cache(rag_manager, fake_embeddings, tmp_path, mock_config):
+    long_file = tmp_path / "long.txt"
+    long_file.write_text("\n\n".join(f"Paragraph number {i} of the long file, padded out to fill most of one chunk." for i in range(5)))
+    rag_manager.file_paths = [str(long_file)]
+    mock_config['stream_threshold_bytes'] = 100
+
+    # The shard is written to disk batch by batch rather than built in memory.
+    with patch('rag_manager._parse_file') as mock_parse_file, \
+            patch.object(rag_manager_module.FAISS, 'from_embeddings') as mock_from_embeddings:
+        rag_manager._create_index()
+
+    mock_parse_file.assert_not_called()
+    mock_from_embeddings.assert_not_called()
+    assert max(fake_embeddings.batch_sizes) <= 2
+    assert _indexed_texts(rag_manager) == sorted(doc.page_content for doc in _parse_file(str(long_file), 100, 10))
+    assert list(rag_manager.cache_manager.get(str(long_file), rag_manager.embedding_model)) == _parse_file(str(long_file), 100, 10)
+
+def test_streamed_file_that_fails_to_load_gets_no_shard(rag_manager, fake_embeddings, mock_config, capsys):
+    mock_config['stream_threshold_bytes'] = 1
+
+    def fail_midway(*args):
+        yield Document(page_content="a first chunk")
+        raise UnicodeDecodeError("utf-8", b"\xff", 0, 1, "invalid start byte")
+
+    with patch('rag_manager.split_text_file', fail_midway):
+        rag_manager._create_index()
+
+    assert _indexed_texts(rag_manager) == ["# This is a markdown file."]
+    assert "Error loading dummy1.txt" in capsys.readouterr().out
+    assert not os.path.exists(rag_manager._shard_path(rag_manager.manifest[rag_manager.file_paths[0]]["hash"]))
+    assert rag_manager.cache_manager.get(rag_manager.file_paths[0], rag_manager.embedding_model) is None
+
+def test_build_shards_skips_files_that_fail_to_embed(rag_manager, fake_embeddings, capsys):
+    def fail_on_markdown(texts):
+        if any(text.startswith("#") for text in texts):
+            raise RuntimeError("embedding server unavailable")
+        return [fake_embeddings.embed_query(text) for text in texts]
+
+    with patch.object(fake_embeddings, 'embed_documents', side_effect=fail_on_markdown):
+        rag_manager._create_index()
+
+    assert _indexed_texts(rag_manager) == ["This is the first dummy file."]
+    assert "Error embedding dummy2.md: embedding server unavailable" in capsys.readouterr().out
+
+def _write_pdf(path, page_texts):
+    """Write a minimal PDF with one line of text per page."""
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    page_ids = []
+    for text in page_texts:
+        stream = f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET"
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents {len(objects)} 0 R /Resources << /Font << /F1 3 0 R >> >> >>")
+        page_ids.append(len(objects))
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(f'{i} 0 R' for i in page_ids)}] /Count {len(page_ids)} >>"
+
+    out = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n{body}\nendobj\n".encode()
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    out += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode()
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    path.write_bytes(out)
+
+def test_process_mode_parses_pdf_page_ranges_in_order(rag_manager, tmp_path, mock_config):
+    pdf_path = tmp_path / "manual.pdf"
+    _write_pdf(pdf_path, [f"Page {i} of the manual" for i in range(5)])
+    mock_config['parse_mode'] = 'process'
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=2, mp_context=multiprocessing.get_context('spawn')) as executor:
+        docs = rag_manager._process_file(str(pdf_path), executor)
+
+    assert [doc.page_content for doc in docs] == [f"Page {i} of the manual" for i in range(5)]
+    assert [doc.metadata["page"] for doc in docs] == list(range(5))
+
+def test_process_mode_builds_index(rag_manager, fake_embeddings, mock_config):
+    mock_config['parse_mode'] = 'process'
+    # Markdown would need unstructured's extras inside the worker processes.
+    rag_manager.file_paths = rag_manager.file_paths[:1]
+
+    rag_manager._create_index()
+
+    assert _indexed_texts(rag_manager) == ["This is the first dummy file."]
+
+@pytest.fixture
+def rewrite_retriever(rag_manager):
+    """A history-aware retriever whose LLM and retriever record their calls."""
+    llm = MagicMock(side_effect=lambda prompt: "standalone question")
+    queries = []
+    retriever = RunnableLambda(lambda query: queries.append(query) or [])
+    prompt = ChatPromptTemplate.from_messages([MessagesPlaceholder("chat_history"), ("human", "{input}")])
+    return rag_manager._build_history_aware_retriever(RunnableLambda(llm), retriever, prompt), llm, queries
+
+def test_rewrite_skipped_without_history(rewrite_retriever):
+    history_aware_retriever, llm, queries = rewrite_retriever
+    history_aware_retriever.invoke({"input": "What does the installer configure?", "chat_history": []})
+    llm.assert_not_called()
+    assert queries == ["What does the installer configure?"]
+
+def test_rewrite_skipped_for_self_contained_follow_up(rewrite_retriever):
+    history_aware_retriever, llm, queries = rewrite_retriever
+    chat_history = [HumanMessage(content="Hi"), AIMessage(content="Hello")]
+    history_aware_retriever.invoke({"input": "What port does the server listen on?", "chat_history": chat_history})
+    llm.assert_not_called()
+    assert queries == ["What port does the server listen on?"]
+
+def test_rewrite_runs_for_referring_follow_up_and_is_memoized(rewrite_retriever):
+    history_aware_retriever, llm, queries = rewrite_retriever
+    chat_history = [HumanMessage(content="What is the server?"), AIMessage(content="A daemon.")]
+    inputs = {"input": "How do I restart it after an upgrade?", "chat_history": chat_history}
+
+    history_aware_retriever.invoke(inputs)
+    history_aware_retriever.invoke(inputs)
+
+    assert llm.call_count == 1
+    assert queries == ["standalone question", "standalone question"]
+
+def test_rewrite_gate_disabled_always_rewrites(rewrite_retriever, mock_config):
+    history_aware_retriever, llm, queries = rewrite_retriever
+    mock_config['rewrite_gate'] = False
+    chat_history = [HumanMessage(content="Hi"), AIMessage(content="Hello")]
+    history_aware_retriever.invoke({"input": "What port does the server listen on?", "chat_history": chat_history})
+    assert queries == ["standalone question"]
+
+def test_ask_reuses_cached_answer_for_similar_question(rag_manager, fake_embeddings, mock_config):
+    mock_config.update({'answer_cache': True, 'answer_cache_threshold': 0.99, 'answer_cache_size': 8, 'answer_cache_ttl': 0})
+    rag_manager._create_index()
+    with patch('rag_manager.ChatOllama'):
+        rag_manager.build_chain()
+    rag_manager.chain = MagicMock()
+    rag_manager.chain.invoke.return_value = {"answer": "Cached answer."}
+
+    assert rag_manager.ask("What is this?", []) == "Cached answer."
+    assert rag_manager.ask("What is this?", []) == "Cached answer."
+    assert "".join(rag_manager.ask_stream("What is this?", [])) == "Cached answer."
+
+    rag_manager.chain.invoke.assert_called_once()
+    rag_manager.chain.stream.assert_not_called()
+
+def test_answer_cache_miss_embeds_question_once(rag_manager, fake_embeddings, mock_config):
+    mock_config.update({'answer_cache': True, 'answer_cache_threshold': 0.99, 'answer_cache_size': 8, 'answer_cache_ttl': 0})
+    rag_manager._create_index()
+    with patch('rag_manager.ChatOllama'):
+        rag_manager.build_chain()
+    rag_manager.chain = MagicMock()
+    rag_manager.chain.invoke.side_effect = lambda inputs: {"answer": "Answer.", "context": rag_manager._retrieve(inputs["input"])}
+
+    assert rag_manager.ask("What is this?", []) == "Answer."
+    assert fake_embeddings.queries == ["What is this?"]
+
+def test_index_version_changes_with_content(rag_manager, fake_embeddings):
+    rag_manager._create_index()
+    version = rag_manager.index_version()
+
+    Path(rag_manager.file_paths[0]).write_text("Changed content.")
+    rag_manager.update_index()
+
+    assert rag_manager.index_version() != version
+
+def test_approximate_index_is_saved_and_reused(rag_manager, fake_embeddings, mock_config):
+    mock_config['index_type'] = 'hnsw'
+    rag_manager._create_index()
+
+    assert rag_manager.index_type == 'hnsw'
+    assert os.path.exists(os.path.join(rag_manager.index_dirs[0], "index.faiss"))
+    query = fake_embeddings.embed_query("This is the first dummy file.")
+    assert rag_manager.vector_store.similarity_search_by_vector(query, k=1)[0].page_content == "This is the first dummy file."
+
+    with patch('rag_manager.build_index') as mock_build_index:
+        rag_manager._create_index()
+    mock_build_index.assert_not_called()
+    assert rag_manager.vector_store.similarity_search_by_vector(query, k=1)[0].page_content == "This is the first dummy file."
+
+@pytest.mark.parametrize("rescore_factor", [0, 4])
+def test_quantized_index_is_saved_and_rescored(rag_manager, fake_embeddings, mock_config, rescore_factor):
+    mock_config['rescore_factor'] = rescore_factor
+    query = fake_embeddings.embed_query("This is the first dummy file.")
+    with patch.dict('ann_index.config', {'vector_quantization': 'int8'}):
+        rag_manager._create_index()
+        assert not rag_manager.in_place_updates
+        assert faiss.downcast_index(rag_manager.vector_store.index).code_size == rag_manager.vector_store.index.d
+        assert (rag_manager.full_vectors is not None) == bool(rescore_factor)
+        assert rag_manager._search_by_vector(query, 1)[0].page_content == "This is the first dummy file."
+
+        with patch('rag_manager.build_index') as mock_build_index:
+            rag_manager._create_index()
+        mock_build_index.assert_not_called()
+        assert (rag_manager.full_vectors is not None) == bool(rescore_factor)
+        assert [doc.page_content for doc in rag_manager._search_by_vector(query, 2)] == ["This is the first dummy file.", "# This is a markdown file."]
+
+def test_partitioned_index_searches_all_partitions(rag_manager, fake_embeddings, mock_config):
+    mock_config['search_partitions'] = 2
+    markdown_hash = rag_manager.cache_manager.get_file_hash(rag_manager.file_paths[1])
+    with patch('rag_manager.partition_of', side_effect=lambda file_hash, n: int(file_hash != markdown_hash)):
+        rag_manager._create_index()
+
+        assert len(rag_manager.vector_store.index.indexes) == 2
+        assert not rag_manager.in_place_updates
+        assert _indexed_texts(rag_manager) == ["# This is a markdown file.", "This is the first dummy file."]
+        query = fake_embeddings.embed_query("This is the first dummy file.")
+        assert [doc.page_content for doc in rag_manager.vector_store.similarity_search_by_vector(query, k=2)] == \
+            ["This is the first dummy file.", "# This is a markdown file."]
+
+        # Only the partition of the changed file is rebuilt; the other is reopened from disk.
+        Path(rag_manager.file_paths[0]).write_text("The first file has changed.")
+        with patch('rag_manager.build_index', wraps=rag_manager_module.build_index) as mock_build_index:
+            rag_manager.update_index()
+        assert mock_build_index.call_count == 1
+        assert _indexed_texts(rag_manager) == ["# This is a markdown file.", "The first file has changed."]
+        # The replaced partition is deleted.
+        partitions_dir = os.path.join(rag_manager.index_path, "partitions")
+        assert sorted(os.path.join(partitions_dir, name) for name in os.listdir(partitions_dir)) == sorted(rag_manager.index_dirs)
+
+        with patch('rag_manager.build_index') as mock_build_index, patch('rag_manager.load_vector_store') as mock_load_vector_store:
+            rag_manager._create_index()
+        mock_build_index.assert_not_called()
+        mock_load_vector_store.assert_not_called()
+        assert rag_manager.vector_store.index.ntotal == 2
+
+        rag_manager.clear_index()
+        assert os.listdir(partitions_dir) == []
+
+def test_partitioned_index_is_rescored_when_quantized(rag_manager, fake_embeddings, mock_config):
+    mock_config['search_partitions'] = 2
+    query = fake_embeddings.embed_query("This is the first dummy file.")
+    with patch.dict('ann_index.config', {'vector_quantization': 'fp16'}):
+        rag_manager._create_index()
+    assert rag_manager.full_vectors is not None
+    assert [doc.page_content for doc in rag_manager._search_by_vector(query, 2)] == ["This is the first dummy file.", "# This is a markdown file."]
+
+def test_approximate_index_is_rebuilt_when_files_change(rag_manager, fake_embeddings, mock_config):
+    mock_config['index_type'] = 'hnsw'
+    rag_manager._create_index()
+
+    Path(rag_manager.file_paths[0]).write_text("The first file has changed.")
+    rag_manager.update_index()
+
+    assert _indexed_texts(rag_manager) == ["# This is a markdown file.", "The first file has changed."]
+    assert rag_manager.vector_store.index.ntotal == 2
+
+def test_assembled_index_of_a_replaced_selection_is_deleted(rag_manager, fake_embeddings, mock_config):
+    mock_config['index_type'] = 'hnsw'
+    rag_manager._create_index()
+    old_path = rag_manager.index_dirs[0]
+
+    rag_manager.file_paths = rag_manager.file_paths[:1]
+    rag_manager._create_index()
+
+    assert not os.path.exists(old_path)
+    assert [os.path.join(rag_manager.index_path, "assembled", name) for name in os.listdir(os.path.join(rag_manager.index_path, "assembled"))] == rag_manager.index_dirs
+    rag_manager.clear_index()
+    assert os.listdir(os.path.join(rag_manager.index_path, "assembled")) == []
+
+def test_collect_index_garbage_removes_shards_of_old_content(rag_manager, fake_embeddings, mock_config):
+    mock_config['index_type'] = 'hnsw'
+    rag_manager._create_index()
+    single = RAGManager(file_paths=rag_manager.file_paths[:1], index_path=rag_manager.index_path)
+    single.cache_manager = rag_manager.cache_manager
+    single._create_index()
+    shards_dir = os.path.join(rag_manager.index_path, "shards")
+    assert len(os.listdir(shards_dir)) == 2
+
+    Path(rag_manager.file_paths[0]).write_text("The first file has changed.")
+    rag_manager.update_index()
+    assert len(os.listdir(shards_dir)) == 3
+
+    # The old shard of the first file, and the other selection's index built from it.
+    assert rag_manager.collect_index_garbage() == 2
+    assert len(os.listdir(shards_dir)) == 2
+    assert [os.path.join(rag_manager.index_path, "assembled", name) for name in os.listdir(os.path.join(rag_manager.index_path, "assembled"))] == rag_manager.index_dirs
+    assert _indexed_texts(rag_manager) == ["# This is a markdown file.", "The first file has changed."]
+    assert rag_manager.collect_index_garbage() == 0
+
+def test_mmap_mode_restores_assembled_index_without_loading_shards(rag_manager, fake_embeddings, mock_config):
+    mock_config['index_load_mode'] = 'mmap'
+    rag_manager._create_index()
+    assert isinstance(rag_manager.vector_store.index_to_docstore_id, SQLiteIdMap)
+
+    with patch('rag_manager.load_vector_store') as mock_load_vector_store:
+        rag_manager._create_index()
+
+    mock_load_vector_store.assert_not_called()
+    assert _indexed_texts(rag_manager) == ["# This is a markdown file.", "This is the first dummy file."]
+    query = fake_embeddings.embed_query("This is the first dummy file.")
+    assert rag_manager.vector_store.similarity_search_by_vector(query, k=1)[0].page_content == "This is the first dummy file."
+
+def test_mmap_mode_reassembles_when_files_change(rag_manager, fake_embeddings, mock_config):
+    mock_config['index_load_mode'] = 'mmap'
+    rag_manager._create_index()
+
+    Path(rag_manager.file_paths[0]).write_text("The first file has changed.")
+    rag_manager.update_index()
+
+    assert _indexed_texts(rag_manager) == ["# This is a markdown file.", "The first file has changed."]
+
+def test_shards_are_stored_without_pickle(rag_manager, fake_embeddings):
+    rag_manager._create_index()
+    for entry in rag_manager.manifest.values():
+        assert sorted(os.listdir(rag_manager._shard_path(entry["hash"]))) == ["docstore.sqlite", "index.faiss"]
+
+@pytest.fixture
+def hybrid_manager(rag_manager, fake_embeddings, mock_config, tmp_path):
+    mock_config['retrieval_mode'] = 'hybrid'
+    notes = tmp_path / "notes.txt"
+    notes.write_text("The upload fails with error ERR-1042 when the disk quota is exceeded.")
+    rag_manager.file_paths = rag_manager.file_paths + [str(notes)]
+    rag_manager._create_index()
+    with patch('rag_manager.ChatOllama'):
+        rag_manager.build_chain()
+    fake_embeddings.queries.clear()
+    return rag_manager
+
+def test_hybrid_mode_builds_lexical_index_with_shards(hybrid_manager):
+    for entry in hybrid_manager.manifest.values():
+        assert "lexical.sqlite" in os.listdir(hybrid_manager._shard_path(entry["hash"]))
+
+def test_hybrid_retrieval_fuses_vector_and_keyword_results(hybrid_manager, fake_embeddings):
+    docs = hybrid_manager._retrieve("Why does my upload fail with a quota error?")
+
+    assert fake_embeddings.queries == ["Why does my upload fail with a quota error?"]
+    assert "The upload fails with error ERR-1042 when the disk quota is exceeded." in [doc.page_content for doc in docs]
+    assert len(docs) == 3
+
+def test_keyword_query_skips_embedder(hybrid_manager, fake_embeddings):
+    docs = hybrid_manager._retrieve("ERR-1042")
+
+    assert fake_embeddings.queries == []
+    assert [doc.page_content for doc in docs] == ["The upload fails with error ERR-1042 when the disk quota is exceeded."]
+
+def test_keyword_query_without_matches_falls_back_to_hybrid(hybrid_manager, fake_embeddings):
+    docs = hybrid_manager._retrieve("E9999")
+
+    assert fake_embeddings.queries == ["E9999"]
+    assert len(docs) == 3
+
+def test_lexical_mode_never_embeds(hybrid_manager, fake_embeddings, mock_config):
+    mock_config['retrieval_mode'] = 'lexical'
+
+    assert [doc.page_content for doc in hybrid_manager._retrieve("disk quota")] == \
+        ["The upload fails with error ERR-1042 when the disk quota is exceeded."]
+    assert hybrid_manager._retrieve("zebra unicorn") == []
+    assert fake_embeddings.queries == []
+
+def test_lexical_index_is_built_for_existing_shards(rag_manager, fake_embeddings, mock_config):
+    rag_manager._create_index()
+    shard_paths = [rag_manager._shard_path(entry["hash"]) for entry in rag_manager.manifest.values()]
+    assert not any(os.path.exists(os.path.join(path, "lexical.sqlite")) for path in shard_paths)
+
+    mock_config['retrieval_mode'] = 'hybrid'
+    with patch('rag_manager.ChatOllama'):
+        rag_manager.build_chain()
+
+    assert all(os.path.exists(os.path.join(path, "lexical.sqlite")) for path in shard_paths)
+    assert rag_manager.lexical_index.num_docs == 2
+
+def test_is_keyword_query():
+    from rag_manager import _is_keyword_query
+    assert _is_keyword_query("ERR-1042")
+    assert _is_keyword_query("what is E1042?")
+    assert _is_keyword_query("MAX_RETRIES")
+    assert _is_keyword_query('"disk quota exceeded"')
+    assert not _is_keyword_query("why does the upload fail")
+    assert not _is_keyword_query("what changed between version 2 and version 3 of the API")
+
+def test_indexing_and_retrieval_stages_are_timed(hybrid_manager):
+    metrics.reset()
+    hybrid_manager._create_index()
+    docs = hybrid_manager._retrieve("Why does my upload fail with a quota error?")
+
+    snapshot = metrics.snapshot()
+    for stage in ("index.create_seconds", "index.hash_files_seconds", "index.load_shards_seconds",
+                  "ask.retrieve_seconds", "ask.embed_query_seconds", "ask.vector_search_seconds", "ask.lexical_search_seconds"):
+        assert snapshot["summaries"][stage]["count"] == 1
+    assert snapshot["summaries"]["ask.retrieved_chunks"]["sum"] == len(docs)
+    metrics.reset()
+
+def test_loader_classes_resolve_by_extension():
+    assert rag_manager_module._get_loader_class(".txt") is TextLoader
+    assert rag_manager_module._get_loader_class(".md") is UnstructuredMarkdownLoader
+    assert rag_manager_module._get_loader_class(".csv") is None
+
+@pytest.mark.parametrize("index_load_mode", ['memory', 'mmap'])
+def test_refresh_index_swaps_in_updated_copy(rag_manager, fake_embeddings, mock_config, index_load_mode):
+    mock_config['index_load_mode'] = index_load_mode
+    rag_manager._create_index()
+    with patch('rag_manager.ChatOllama'):
+        rag_manager.build_chain()
+    old_store, old_chain = rag_manager.vector_store, rag_manager.chain
+
+    Path(rag_manager.file_paths[0]).write_text("The first file has changed.")
+    with patch('rag_manager.ChatOllama'):
+        assert rag_manager.refresh_index() is True
+
+    assert rag_manager.vector_store is not old_store
+    assert rag_manager.chain is not old_chain
+    assert _indexed_texts(rag_manager) == ["# This is a markdown file.", "The first file has changed."]
+    # The previous store is left untouched for questions still using it.
+    old_texts = sorted(old_store.docstore.search(doc_id).page_content for doc_id in old_store.index_to_docstore_id.values())
+    assert old_texts == ["# This is a markdown file.", "This is the first dummy file."]
+    query = fake_embeddings.embed_query("This is the first dummy file.")
+    assert old_store.similarity_search_by_vector(query, k=1)[0].page_content == "This is the first dummy file."
+
+def test_partitions_replaced_by_refresh_outlive_the_previous_store(rag_manager, fake_embeddings, mock_config):
+    mock_config.update({'search_partitions': 2, 'index_load_mode': 'mmap'})
+    markdown_hash = rag_manager.cache_manager.get_file_hash(rag_manager.file_paths[1])
+    query = fake_embeddings.embed_query("This is the first dummy file.")
+    with patch('rag_manager.partition_of', side_effect=lambda file_hash, n: int(file_hash != markdown_hash)), \
+            patch('rag_manager.ChatOllama'):
+        rag_manager._create_index()
+        rag_manager.build_chain()
+        old_store, old_dirs = rag_manager.vector_store, rag_manager.index_dirs
+
+        Path(rag_manager.file_paths[0]).write_text("The first file has changed.")
+        assert rag_manager.refresh_index() is True
+
+    replaced = set(old_dirs) - set(rag_manager.index_dirs)
+    assert len(replaced) == 1 and all(os.path.exists(path) for path in replaced)
+    # A question still in flight searches the previous partitions.
+    assert [doc.page_content for doc in old_store.similarity_search_by_vector(query, k=2)] == \
+        ["This is the first dummy file.", "# This is a markdown file."]
+
+    del old_store
+    gc.collect()
+    assert not any(os.path.exists(path) for path in replaced)
+    assert all(os.path.exists(path) for path in rag_manager.index_dirs)
+
+def test_refresh_index_without_changes_keeps_index(rag_manager, fake_embeddings):
+    rag_manager._create_index()
+    with patch('rag_manager.ChatOllama'):
+        rag_manager.build_chain()
+    vector_store = rag_manager.vector_store
+
+    assert rag_manager.refresh_index() is False
+    assert rag_manager.vector_store is vector_store
+
+def test_refresh_index_drops_removed_files(rag_manager, fake_embeddings):
+    rag_manager._create_index()
+    with patch('rag_manager.ChatOllama'):
+        rag_manager.build_chain()
+        rag_manager.refresh_index(rag_manager.file_paths[:1])
+
+    assert _indexed_texts(rag_manager) == ["This is the first dummy file."]
+    assert list(rag_manager.manifest) == rag_manager.file_paths
+
+def test_context_budget_leaves_room_for_history_and_answer(rag_manager, mock_config):
+    mock_config.update({'n_ctx': 1000, 'max_new_tokens': 200})
+    inputs = {"input": "q" * 40, "chat_history": [HumanMessage(content="h" * 400)]}
+    budget = rag_manager._context_budget(inputs)
+    assert budget == 1000 - 200 - rag_manager_module.estimate_tokens(rag_manager_module._QA_SYSTEM_PROMPT) - 10 - 100
+
+    mock_config['context_token_budget'] = 50
+    assert rag_manager._context_budget(inputs) == 50
+
+def test_assemble_context_merges_and_packs(rag_manager, mock_config):
+    mock_config.update({'n_ctx': 400, 'max_new_tokens': 100, 'chunk_overlap': 30})
+    first = Document(page_content="The installer writes its settings to /etc/app.conf and then", metadata={"source": "a.txt", "start_index": 0})
+    second = Document(page_content="and then restarts the service so the settings apply.", metadata={"source": "a.txt", "start_index": 51})
+    large = Document(page_content="z " * 2000, metadata={"source": "b.txt"})
+
+    docs = rag_manager._assemble_context({"docs": [second, large, first], "inputs": {"input": "What does the installer do?", "chat_history": []}})
+
+    assert [doc.page_content for doc in docs] == ["The installer writes its settings to /etc/app.conf and then restarts the service so the settings apply."]
+
+def test_summarized_history_is_sent_as_system_message(rag_manager):
+    history = ChatHistory(summarize=lambda summary, turns, max_tokens: "The user asked about uploads.", mode='summary', recent_turns=1, summary_tokens=50)
+    history.add("How large can uploads be?", "50 MB.")
+    history.add("Which formats?", "PDF and DOCX.")
+    history.wait()
+
+    messages = rag_manager._format_chat_history(history)
+
+    assert [message.type for message in messages] == ["system", "human", "ai"]
+    assert messages[0].content == "Summary of the earlier conversation: The user asked about uploads."
+    assert messages[1].content == "Which formats?"
+
+def test_summarize_history_uses_chat_model(rag_manager, fake_embeddings):
+    rag_manager._create_index()
+    prompts = []
+    llm = RunnableLambda(lambda prompt: prompts.append(prompt) or "Uploads are capped at 50 MB.")
+    with patch('rag_manager.ChatOllama', return_value=llm):
+        rag_manager.build_chain()
+
+    summary = rag_manager.summarize_history("", [("How large can uploads be?", "50 MB.")], 64)
+
+    assert summary == "Uploads are capped at 50 MB."
+    assert "User: How large can uploads be?\nAssistant: 50 MB." in prompts[-1].to_string()
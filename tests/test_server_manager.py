@@ -0,0 +1,236 @@
+import json
+import time
+import asyncio
+import datetime
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import pytest
+from unittest.mock import patch
+from aiohttp.test_utils import TestServer, TestClient
+from config import config
+from rag_manager import RAGManager
+from server_manager import ServerManager
+
+class FakeOllama:
+    """Local stand-in for the Ollama HTTP API, answering /api/embed and streaming /api/chat."""
+
+    def __init__(self, chat_delay=0.0):
+        self.embed_inputs = []
+        self.chat_messages = []
+        self.chat_delay = chat_delay
+        self.active_chats = 0
+        self.peak_chats = 0
+        self._lock = threading.Lock()
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                if self.path == '/api/embed':
+                    fake._embed(self, body)
+                elif self.path == '/api/chat':
+                    fake._chat(self, body)
+                else:
+                    self.send_error(404)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def _embed(self, handler, body):
+        inputs = body['input'] if isinstance(body['input'], list) else [body['input']]
+        with self._lock:
+            self.embed_inputs.append(inputs)
+        data = json.dumps({"model": body['model'], "embeddings": [[float(len(text)), 1.0, 0.5] for text in inputs]}).encode()
+        handler.send_response(200)
+        handler.send_header('Content-Type', 'application/json')
+        handler.send_header('Content-Length', str(len(data)))
+        handler.end_headers()
+        handler.wfile.write(data)
+
+    def _chat(self, handler, body):
+        with self._lock:
+            self.chat_messages.append(body['messages'])
+            self.active_chats += 1
+            self.peak_chats = max(self.peak_chats, self.active_chats)
+        time.sleep(self.chat_delay)
+        with self._lock:
+            self.active_chats -= 1
+
+        handler.send_response(200)
+        handler.send_header('Content-Type', 'application/x-ndjson')
+        handler.end_headers()
+        created_at = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        for token in ["Answer to: ", body['messages'][-1]['content']]:
+            line = {"model": body['model'], "created_at": created_at, "message": {"role": "assistant", "content": token}, "done": False}
+            handler.wfile.write((json.dumps(line) + "\n").encode())
+        last = {"model": body['model'], "created_at": created_at, "message": {"role": "assistant", "content": ""}, "done": True, "done_reason": "stop"}
+        handler.wfile.write((json.dumps(last) + "\n").encode())
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+@pytest.fixture
+def fake_ollama():
+    fake = FakeOllama()
+    yield fake
+    fake.close()
+
+@pytest.fixture
+def server_manager(tmp_path, fake_ollama):
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    (docs / "upload.txt").write_text("Uploads are limited to 50 MB per file.")
+    (docs / "server.txt").write_text("The server listens on port 8080 by default.")
+
+    with patch.dict(config, {
+        'ollama_base_url': fake_ollama.url,
+        'cache_path': str(tmp_path / "cache"),
+        'index_path': str(tmp_path / "indexes"),
+        'answer_cache': False,
+        'retrieval_mode': 'hybrid',
+        'query_batch_window_ms': 100,
+        'server_concurrency': 4,
+    }):
+        rag_manager = RAGManager(file_paths=[str(docs / "upload.txt"), str(docs / "server.txt")], index_path=str(tmp_path / "indexes"))
+        server_manager = ServerManager(rag_manager)
+        rag_manager.setup()
+        fake_ollama.embed_inputs.clear()
+        yield server_manager
+
+def _serve(server_manager, scenario):
+    async def run():
+        async with TestClient(TestServer(server_manager.create_app())) as client:
+            return await scenario(client)
+    return asyncio.run(run())
+
+def test_health(server_manager):
+    async def scenario(client):
+        response = await client.get('/health')
+        return response.status, await response.json()
+
+    status, body = _serve(server_manager, scenario)
+    assert status == 200
+    assert body["indexed"] is True
+
+def test_ask_returns_answer_and_session(server_manager):
+    async def scenario(client):
+        response = await client.post('/ask', json={"question": "How large can uploads be?"})
+        return await response.json()
+
+    body = _serve(server_manager, scenario)
+    assert body["answer"] == "Answer to: How large can uploads be?"
+    assert body["session_id"]
+
+def test_ask_without_question_is_rejected(server_manager):
+    async def scenario(client):
+        return (await client.post('/ask', json={})).status, (await client.post('/ask', data="not json")).status
+
+    assert _serve(server_manager, scenario) == (400, 400)
+
+def test_ask_with_non_string_fields_is_rejected(server_manager):
+    async def scenario(client):
+        bodies = [{"question": 5}, {"question": ["a"]}, {"question": "   "}, {"question": "Hi?", "session_id": 7}]
+        return [(await client.post(path, json=body)).status for body in bodies for path in ('/ask', '/ask/stream')]
+
+    assert set(_serve(server_manager, scenario)) == {400}
+
+def test_ask_stream_stops_generating_when_client_disconnects(server_manager):
+    closed = threading.Event()
+    state = {}
+
+    def endless(question, chat_history):
+        try:
+            while True:
+                time.sleep(0.01)
+                yield "token "
+        finally:
+            # The generator must be closed while the question still holds the index.
+            state["readers"] = server_manager._index_lock._readers
+            closed.set()
+
+    async def scenario(client):
+        response = await client.post('/ask/stream', json={"session_id": "s", "question": "Go on forever."})
+        await response.content.readline()
+        response.close()
+        # A reindex waits for the question to let go of the index.
+        status = (await client.post('/reindex')).status
+        return status, closed.is_set()
+
+    with patch.object(server_manager.rag_manager, 'ask_stream', side_effect=endless):
+        assert _serve(server_manager, scenario) == (200, True)
+    assert state["readers"] == 1
+    assert list(server_manager.sessions["s"]) == []
+
+def test_sessions_keep_separate_histories(server_manager, fake_ollama):
+    async def scenario(client):
+        await client.post('/ask', json={"session_id": "a", "question": "How large can uploads be?"})
+        await client.post('/ask', json={"session_id": "b", "question": "Which port does the server use?"})
+        fake_ollama.chat_messages.clear()
+        await client.post('/ask', json={"session_id": "b", "question": "Is the limit per file or per request?"})
+
+    _serve(server_manager, scenario)
+    assert list(server_manager.sessions["a"]) == [("How large can uploads be?", "Answer to: How large can uploads be?")]
+    assert len(server_manager.sessions["b"]) == 2
+    sent = [message["content"] for messages in fake_ollama.chat_messages for message in messages]
+    assert "Which port does the server use?" in sent
+    assert "How large can uploads be?" not in sent
+
+def test_ask_stream_yields_tokens(server_manager):
+    async def scenario(client):
+        response = await client.post('/ask/stream', json={"session_id": "s", "question": "How large can uploads be?"})
+        return response.headers["X-Session-Id"], [json.loads(line) for line in (await response.text()).splitlines()]
+
+    session_id, lines = _serve(server_manager, scenario)
+    assert session_id == "s"
+    assert "".join(line.get("token", "") for line in lines) == "Answer to: How large can uploads be?"
+    assert lines[-1] == {"done": True, "session_id": "s"}
+    assert list(server_manager.sessions["s"]) == [("How large can uploads be?", "Answer to: How large can uploads be?")]
+
+def test_concurrent_query_embeddings_are_batched(server_manager, fake_ollama):
+    questions = [f"What does paragraph number {word} say?" for word in ("one", "two", "three", "four")]
+
+    async def scenario(client):
+        await asyncio.gather(*(client.post('/ask', json={"question": question}) for question in questions))
+
+    _serve(server_manager, scenario)
+    embedded = [text for inputs in fake_ollama.embed_inputs for text in inputs]
+    assert sorted(embedded) == sorted(questions)
+    assert len(fake_ollama.embed_inputs) < len(questions)
+
+def test_backend_concurrency_is_bounded(server_manager, fake_ollama):
+    fake_ollama.chat_delay = 0.1
+    server_manager.concurrency = 2
+
+    async def scenario(client):
+        responses = await asyncio.gather(*(client.post('/ask', json={"question": f"Question {i} about uploads?"}) for i in range(5)))
+        return [response.status for response in responses]
+
+    assert _serve(server_manager, scenario) == [200] * 5
+    assert fake_ollama.peak_chats == 2
+
+def test_reindex_picks_up_changed_files(server_manager, fake_ollama):
+    with open(server_manager.rag_manager.file_paths[0], 'w') as f:
+        f.write("Uploads are now limited to 100 MB per file.")
+
+    async def scenario(client):
+        response = await client.post('/reindex')
+        return response.status, await response.json()
+
+    assert _serve(server_manager, scenario) == (200, {"status": "ok", "indexed": True})
+    assert ["Uploads are now limited to 100 MB per file."] in fake_ollama.embed_inputs
+
+def test_metrics_endpoint_reports_stage_timings(server_manager):
+    async def scenario(client):
+        await client.post('/ask', json={"question": "How large can uploads be?"})
+        response = await client.get('/metrics')
+        return response.status, await response.text()
+
+    status, text = _serve(server_manager, scenario)
+    assert status == 200
+    assert "rag_ask_total_seconds_count" in text
+    assert "rag_ask_generate_seconds_count" in text
@@ -0,0 +1,41 @@
+import concurrent.futures
+import faiss
+import numpy as np
+import pytest
+from sharded_index import ShardedIndex, partition_of
+
+@pytest.fixture
+def executor():
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+        yield executor
+
+def _flat(vectors):
+    index = faiss.IndexFlatL2(vectors.shape[1])
+    index.add(vectors)
+    return index
+
+def test_search_matches_one_index_over_all_vectors(executor):
+    vectors = np.random.default_rng(0).random((50, 8), dtype=np.float32)
+    sharded = ShardedIndex([_flat(vectors[:20]), _flat(vectors[20:35]), _flat(vectors[35:])], executor)
+    queries = vectors[:5] + 0.01
+
+    distances, positions = sharded.search(queries, 4)
+    expected_distances, expected_positions = _flat(vectors).search(queries, 4)
+
+    assert sharded.ntotal == 50 and sharded.d == 8
+    assert positions.tolist() == expected_positions.tolist()
+    assert np.allclose(distances, expected_distances)
+
+def test_search_drops_missing_results(executor):
+    vectors = np.eye(3, dtype=np.float32)
+    sharded = ShardedIndex([_flat(vectors[:1]), _flat(vectors[1:])], executor)
+
+    _, positions = sharded.search(vectors[2:], 4)
+
+    # Ties keep the order of the partitions.
+    assert positions.tolist() == [[2, 0, 1, -1]]
+
+def test_partition_of_is_stable():
+    file_hash = "f" * 64
+    assert partition_of(file_hash, 4) == partition_of(file_hash, 4)
+    assert {partition_of(f"{i:016x}" + "0" * 48, 4) for i in range(8)} == {0, 1, 2, 3}
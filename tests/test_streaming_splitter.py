@@ -0,0 +1,60 @@
+import random
+import pytest
+from langchain_community.document_loaders import TextLoader
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from streaming_splitter import split_text_file, stream_encoding
+
+def _split_whole(path, chunk_size, chunk_overlap):
+    splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap, add_start_index=True)
+    return splitter.split_documents(TextLoader(path).load())
+
+def _random_text(rng):
+    words = ["lorem", "ipsum", "dolor", "sit", "é", "中文", "😀", "x" * 150]
+    paragraphs = []
+    for _ in range(rng.randint(1, 30)):
+        lines = [" ".join(rng.choices(words, k=rng.randint(0, 40))) for _ in range(rng.randint(1, 6))]
+        paragraphs.append(rng.choice(["\n", "\r\n", "\r"]).join(lines))
+    return rng.choice(["\n\n", "\r\n\r\n", "\n\n\n", "\n"]).join(paragraphs)
+
+@pytest.mark.parametrize("seed", range(20))
+def test_chunks_match_loading_the_whole_file(tmp_path, seed):
+    rng = random.Random(seed)
+    path = tmp_path / "doc.txt"
+    path.write_bytes(_random_text(rng).encode("utf-8"))
+    chunk_size = rng.choice([10, 50, 200])
+    chunk_overlap = rng.choice([0, 5, chunk_size // 4])
+
+    # Tiny blocks put separators, CRLFs and multi-byte characters across block boundaries.
+    streamed = list(split_text_file(str(path), chunk_size, chunk_overlap, block_size=rng.choice([1, 7, 4096])))
+
+    assert streamed == _split_whole(str(path), chunk_size, chunk_overlap)
+
+def test_text_without_separators_is_split_by_character(tmp_path):
+    path = tmp_path / "doc.txt"
+    path.write_text("abcdefghij" * 30)
+
+    streamed = list(split_text_file(str(path), 40, 10, block_size=16))
+
+    assert streamed == _split_whole(str(path), 40, 10)
+    assert streamed[1].metadata == {"source": str(path), "start_index": 30}
+
+def test_empty_file_has_no_chunks(tmp_path):
+    path = tmp_path / "empty.txt"
+    path.write_text("")
+    assert list(split_text_file(str(path), 100, 10)) == []
+
+def test_long_paragraph_is_not_kept_whole(tmp_path):
+    path = tmp_path / "log.txt"
+    path.write_text("header\n\n" + "\n".join(f"line {i} of a long log" for i in range(2000)))
+
+    streamed = list(split_text_file(str(path), 100, 10, block_size=256))
+
+    assert streamed == _split_whole(str(path), 100, 10)
+
+def test_encodings_that_cannot_be_streamed_are_rejected(tmp_path):
+    path = tmp_path / "doc.txt"
+    path.write_text("text", encoding="utf-16")
+    assert stream_encoding("utf-8") == "utf-8"
+    assert stream_encoding("utf-16") is None
+    with pytest.raises(ValueError):
+        list(split_text_file(str(path), 100, 10, encoding="utf-16"))
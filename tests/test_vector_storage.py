@@ -0,0 +1,197 @@
+import os
+from unittest.mock import patch
+import faiss
+import numpy as np
+import pytest
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+import vector_storage
+from vector_storage import (
+    SQLiteDocstore,
+    ChainedDocstore,
+    SQLiteIdMap,
+    save_vector_store,
+    load_vector_store,
+    save_positions,
+    load_positions,
+    is_saved,
+    ShardVectors,
+    ChainedIdMap,
+    ShardWriter,
+    DOCSTORE_FILE,
+)
+
+class FakeEmbeddings(Embeddings):
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text):
+        return [float(len(text)), float(text.count("e")), 1.0]
+
+TEXTS = ["alpha", "beta gamma", "a much longer chunk of text here"]
+
+@pytest.fixture
+def vector_store():
+    return FAISS.from_texts(TEXTS, FakeEmbeddings(), metadatas=[{"n": i} for i in range(3)], ids=["a", "b", "c"])
+
+def test_docstore_add_search_delete(tmp_path):
+    docstore = SQLiteDocstore(str(tmp_path / DOCSTORE_FILE))
+    docstore.add({"x": Document(page_content="text", metadata={"source": "f.txt"})})
+
+    doc = docstore.search("x")
+    assert doc.page_content == "text"
+    assert doc.metadata == {"source": "f.txt"}
+    assert len(docstore) == 1
+
+    docstore.delete(["x"])
+    assert docstore.search("x") == "ID x not found."
+
+def test_chained_docstore_searches_all_and_hides_deleted(tmp_path):
+    first = SQLiteDocstore(str(tmp_path / "first.sqlite"))
+    second = SQLiteDocstore(str(tmp_path / "second.sqlite"))
+    first.add({"x": Document(page_content="one")})
+    second.add({"y": Document(page_content="two")})
+    chained = ChainedDocstore([first])
+    chained.append(second, 1)
+
+    assert chained.search("y").page_content == "two"
+    chained.delete(["y"])
+    assert chained.search("y") == "ID y not found."
+    # The underlying shard keeps its chunk for other selections.
+    assert second.search("y").page_content == "two"
+
+def test_chained_docstore_reads_a_position_from_the_docstore_owning_it(tmp_path):
+    docstores = [SQLiteDocstore(str(tmp_path / f"{i}.sqlite")) for i in range(3)]
+    for i, docstore in enumerate(docstores):
+        docstore.add({f"id{i}-{j}": Document(page_content=f"chunk {i}.{j}") for j in range(2)})
+    chained = ChainedDocstore(docstores, sizes=[2, 2, 2])
+
+    with patch.object(SQLiteDocstore, "search", autospec=True, side_effect=SQLiteDocstore.search) as mock_search, \
+            patch.object(SQLiteDocstore, "ids", autospec=True) as mock_ids:
+        assert chained.search_at(5, "id2-1").page_content == "chunk 2.1"
+        assert chained.search_in(docstores[1].db_path, "id1-0").page_content == "chunk 1.0"
+        assert chained.search_at(6, "id2-1") == "ID id2-1 not found."
+    assert [call.args[0] for call in mock_search.call_args_list] == [docstores[2], docstores[1]]
+    mock_ids.assert_not_called()
+
+    # Without sizes, each docstore's chunks are counted on the first lookup.
+    assert ChainedDocstore(docstores).search_at(2, "id1-0").page_content == "chunk 1.0"
+
+    copy = chained.copy()
+    extra = SQLiteDocstore(str(tmp_path / "extra.sqlite"))
+    extra.add({"x": Document(page_content="extra")})
+    copy.append(extra, 1)
+    # Deleting a docstore's chunks (and their vectors) moves the later positions down.
+    copy.delete(["id0-0", "id0-1"])
+    assert copy.search_at(4, "x").page_content == "extra"
+    assert copy.search_at(0, "id1-0").page_content == "chunk 1.0"
+    assert chained.search_at(0, "id0-0").page_content == "chunk 0.0"
+    assert chained.search("x") == "ID x not found."
+
+def test_connections_are_shared_and_bounded(tmp_path):
+    docstores = [SQLiteDocstore(str(tmp_path / f"{i}.sqlite")) for i in range(5)]
+    for i, docstore in enumerate(docstores):
+        docstore.add({f"id{i}": Document(page_content=f"chunk {i}")})
+
+    with patch.object(vector_storage, "MAX_OPEN_CONNECTIONS", 2):
+        for _ in range(2):
+            for i, docstore in enumerate(docstores):
+                assert docstore.search(f"id{i}").page_content == f"chunk {i}"
+                open_paths = [path for path in vector_storage._pool if path.startswith(str(tmp_path))]
+                assert len(open_paths) <= 2
+    # A second store over the same database shares its connection.
+    SQLiteIdMap(str(tmp_path / "4.sqlite"))
+    assert len([path for path in vector_storage._pool if path.endswith("4.sqlite")]) == 1
+
+def test_replacing_a_database_reopens_its_connection(tmp_path):
+    path = str(tmp_path / "assembled")
+    save_positions(path, ["a", "b"])
+    lazy = load_positions(path, mmap=True)
+    assert lazy[1] == "b"
+
+    save_positions(path, ["c", "d", "e"])
+
+    assert lazy[1] == "d"
+    assert len(lazy) == 3
+
+@pytest.mark.parametrize("mmap", [False, True])
+def test_save_and_load_round_trip(tmp_path, vector_store, mmap):
+    path = str(tmp_path / "store")
+    save_vector_store(vector_store, path)
+
+    assert is_saved(path)
+    assert not any(name.endswith(".pkl") for name in os.listdir(path))
+
+    loaded = load_vector_store(path, FakeEmbeddings(), mmap=mmap)
+    assert isinstance(loaded.index_to_docstore_id, SQLiteIdMap) == mmap
+    assert loaded.index.ntotal == 3
+    doc = loaded.similarity_search("beta gamma", k=1)[0]
+    assert (doc.page_content, doc.metadata) == ("beta gamma", {"n": 1})
+
+def test_positions_round_trip(tmp_path):
+    path = str(tmp_path / "assembled")
+    save_positions(path, ["a", "b"])
+    assert load_positions(path) == {0: "a", 1: "b"}
+    lazy = load_positions(path, mmap=True)
+    assert lazy[1] == "b"
+    assert len(lazy) == 2
+    with pytest.raises(KeyError):
+        lazy[2]
+
+def test_shard_vectors_address_shards_as_one_array(tmp_path):
+    first = FAISS.from_texts(TEXTS[:2], FakeEmbeddings())
+    second = FAISS.from_texts(TEXTS[2:], FakeEmbeddings())
+    save_vector_store(first, str(tmp_path / "first"))
+    save_vector_store(second, str(tmp_path / "second"))
+
+    vectors = ShardVectors([str(tmp_path / "first"), str(tmp_path / "second")])
+
+    assert vectors.ntotal == 3
+    assert vectors.get([2, 0]).tolist() == [FakeEmbeddings().embed_query(TEXTS[2]), FakeEmbeddings().embed_query(TEXTS[0])]
+
+def test_chained_id_map_offsets_positions():
+    id_map = ChainedIdMap([{0: "a", 1: "b"}, {}, {0: "c"}])
+
+    assert len(id_map) == 3
+    assert [id_map[position] for position in range(3)] == ["a", "b", "c"]
+    assert list(id_map.values()) == ["a", "b", "c"]
+    with pytest.raises(KeyError):
+        id_map[3]
+
+@pytest.mark.parametrize("dimension", [3, 768])
+def test_shard_writer_matches_save_vector_store(tmp_path, dimension):
+    rng = np.random.default_rng(0)
+    docs = [Document(page_content=f"chunk {i}", metadata={"n": i}) for i in range(5)]
+    ids = [f"id{i}" for i in range(5)]
+    vectors = rng.random((5, dimension), dtype=np.float32)
+
+    writer = ShardWriter(str(tmp_path / "shard"))
+    writer.add(ids[:2], docs[:2], vectors[:2])
+    writer.add(ids[2:], docs[2:], vectors[2:])
+    writer.close()
+
+    assert is_saved(str(tmp_path / "shard"))
+    assert sorted(os.listdir(tmp_path / "shard")) == [DOCSTORE_FILE, "index.faiss"]
+    loaded = load_vector_store(str(tmp_path / "shard"), FakeEmbeddings(), mmap=True)
+    assert loaded.index.ntotal == 5
+    assert np.array_equal(loaded.index.reconstruct_n(0, 5), vectors)
+    assert [loaded.index_to_docstore_id[i] for i in range(5)] == ids
+    assert loaded.docstore.search("id3") == Document(id="id3", page_content="chunk 3", metadata={"n": 3})
+
+def test_shard_writer_keeps_an_index_that_does_not_read_back_whole_out_of_place(tmp_path):
+    writer = ShardWriter(str(tmp_path / "shard"))
+    writer.add(["a", "b"], [Document(page_content="alpha"), Document(page_content="beta")], [[1.0, 2.0, 3.0], [4.0, 5.0, 6.0]])
+    with patch.object(vector_storage, "read_index", return_value=faiss.IndexFlatL2(3)):
+        with pytest.raises(ValueError, match="Wrote 0 vectors"):
+            writer.close()
+    assert not is_saved(str(tmp_path / "shard"))
+    writer.abort()
+    assert not os.path.exists(tmp_path / "shard")
+
+def test_shard_writer_abort_leaves_no_shard(tmp_path):
+    writer = ShardWriter(str(tmp_path / "shard"))
+    writer.add(["a"], [Document(page_content="alpha")], [[1.0, 2.0, 3.0]])
+    writer.abort()
+
+    assert not os.path.exists(tmp_path / "shard")
@@ -0,0 +1,86 @@
+import os
+import pytest
+from unittest.mock import MagicMock, patch
+from config import config
+from watch_manager import WatchManager
+
+@pytest.fixture
+def docs(tmp_path):
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    (docs / "a.txt").write_text("first")
+    (docs / "b.txt").write_text("second")
+    return docs
+
+@pytest.fixture
+def watch_manager(docs):
+    rag_manager = MagicMock()
+    rag_manager.file_paths = [str(docs / "a.txt"), str(docs / "b.txt")]
+    rag_manager.refresh_index.return_value = True
+    with patch.dict(config, {'watch_new_files': False}):
+        yield WatchManager(rag_manager, interval=0.01, debounce=1.0, docs_path=str(docs))
+
+def _touch(path, text):
+    path.write_text(text)
+    stat = os.stat(path)
+    # Move the modification time forward so the change is seen even on coarse-grained clocks.
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+def test_no_refresh_without_changes(watch_manager):
+    assert watch_manager.poll(now=100.0) is False
+    assert watch_manager.poll(now=200.0) is False
+    watch_manager.rag_manager.refresh_index.assert_not_called()
+
+def test_changes_are_debounced(watch_manager, docs):
+    _touch(docs / "a.txt", "first, edited")
+    assert watch_manager.poll(now=100.0) is False
+    _touch(docs / "a.txt", "first, edited again")
+    assert watch_manager.poll(now=100.5) is False
+    assert watch_manager.poll(now=101.0) is False
+    watch_manager.rag_manager.refresh_index.assert_not_called()
+
+    assert watch_manager.poll(now=101.6) is True
+    watch_manager.rag_manager.refresh_index.assert_called_once_with([str(docs / "a.txt"), str(docs / "b.txt")])
+    assert watch_manager.poll(now=200.0) is False
+
+def test_deleted_file_leaves_and_rejoins(watch_manager, docs):
+    (docs / "b.txt").unlink()
+    watch_manager.poll(now=100.0)
+    watch_manager.poll(now=102.0)
+    watch_manager.rag_manager.refresh_index.assert_called_with([str(docs / "a.txt")])
+
+    (docs / "b.txt").write_text("second is back")
+    watch_manager.poll(now=103.0)
+    watch_manager.poll(now=105.0)
+    watch_manager.rag_manager.refresh_index.assert_called_with([str(docs / "a.txt"), str(docs / "b.txt")])
+
+def test_new_files_join_when_enabled(watch_manager, docs):
+    (docs / "c.md").write_text("# third")
+    (docs / "ignored.csv").write_text("x")
+    with patch.dict(config, {'watch_new_files': True}):
+        watch_manager.poll(now=100.0)
+        watch_manager.poll(now=102.0)
+
+    expected = [str(docs / "a.txt"), str(docs / "b.txt"), os.path.abspath(docs / "c.md")]
+    watch_manager.rag_manager.refresh_index.assert_called_once_with(expected)
+
+def test_refresh_errors_are_reported(watch_manager, docs, capsys):
+    watch_manager.rag_manager.refresh_index.side_effect = RuntimeError("Ollama is down")
+    _touch(docs / "a.txt", "first, edited")
+    watch_manager.poll(now=100.0)
+
+    assert watch_manager.poll(now=102.0) is False
+    assert "Error updating the index in the background: Ollama is down" in capsys.readouterr().out
+
+def test_background_thread_refreshes(watch_manager, docs):
+    watch_manager.debounce = 0.0
+    watch_manager.start()
+    try:
+        _touch(docs / "a.txt", "first, edited")
+        for _ in range(200):
+            if watch_manager.rag_manager.refresh_index.called:
+                break
+            watch_manager._stop.wait(0.01)
+    finally:
+        watch_manager.stop()
+    watch_manager.rag_manager.refresh_index.assert_called()
@@ -0,0 +1,421 @@
+"""
+On-disk storage for FAISS vector stores without pickle.
+
+A stored vector store is a directory holding the FAISS index file and an SQLite database with
+the chunk texts, their metadata and the mapping of index positions to chunk IDs. Chunks are
+fetched only when a search returns them, and the index file can be memory-mapped.
+"""
+
+import os
+import json
+import bisect
+import itertools
+import sqlite3
+import threading
+import contextlib
+from collections import OrderedDict
+from collections.abc import Mapping
+import faiss
+import numpy as np
+from langchain_community.docstore.base import Docstore
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+
+INDEX_FILE = "index.faiss"
+DOCSTORE_FILE = "docstore.sqlite"
+POSITIONS_FILE = "positions.sqlite"
+VECTORS_SPOOL_FILE = "vectors.tmp"
+ADD_BATCH_BYTES = 1 << 20
+MAX_OPEN_CONNECTIONS = 64
+
+def _connect(db_path):
+    return sqlite3.connect(db_path, check_same_thread=False)
+
+class _PooledConnection:
+    def __init__(self, db_path):
+        self.conn = _connect(db_path)
+        self.lock = threading.Lock()
+        self.users = 0
+        self.retired = False
+
+_pool_lock = threading.Lock()
+_pool = OrderedDict()
+
+@contextlib.contextmanager
+def shared_connection(db_path):
+    """
+    Lend the connection to a database that every store reading it shares.
+
+    At most MAX_OPEN_CONNECTIONS are kept open; the least recently used idle ones are closed
+    and reopened on their next use, so selecting many shards does not exhaust file descriptors.
+    """
+    key = os.path.abspath(db_path)
+    with _pool_lock:
+        entry = _pool.get(key)
+        if entry is None:
+            entry = _pool[key] = _PooledConnection(key)
+        _pool.move_to_end(key)
+        entry.users += 1
+        excess = len(_pool) - MAX_OPEN_CONNECTIONS
+        for idle_key in [k for k, e in _pool.items() if e.users == 0][:max(excess, 0)]:
+            _pool.pop(idle_key).conn.close()
+    try:
+        with entry.lock:
+            yield entry.conn
+    finally:
+        with _pool_lock:
+            entry.users -= 1
+            if entry.retired and entry.users == 0:
+                entry.conn.close()
+
+def close_connections(path):
+    """Close the shared connections to a database, or to every database under a directory, before it is replaced or deleted."""
+    path = os.path.abspath(path)
+    with _pool_lock:
+        for key in [k for k in _pool if k == path or k.startswith(os.path.join(path, ""))]:
+            entry = _pool.pop(key)
+            # A connection in use is closed by its last user.
+            entry.retired = True
+            if entry.users == 0:
+                entry.conn.close()
+
+class SQLiteDocstore(Docstore):
+    """Chunks kept in SQLite and read one ID at a time."""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        with shared_connection(db_path) as conn, conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS docs (id TEXT PRIMARY KEY, page_content TEXT NOT NULL, metadata TEXT NOT NULL)")
+
+    def search(self, search):
+        with shared_connection(self.db_path) as conn:
+            row = conn.execute("SELECT page_content, metadata FROM docs WHERE id = ?", (search,)).fetchone()
+        if row is None:
+            return f"ID {search} not found."
+        return Document(id=search, page_content=row[0], metadata=json.loads(row[1]))
+
+    def add(self, texts):
+        rows = [(doc_id, doc.page_content, json.dumps(doc.metadata)) for doc_id, doc in texts.items()]
+        with shared_connection(self.db_path) as conn, conn:
+            conn.executemany("INSERT OR REPLACE INTO docs VALUES (?, ?, ?)", rows)
+
+    def delete(self, ids):
+        with shared_connection(self.db_path) as conn, conn:
+            conn.executemany("DELETE FROM docs WHERE id = ?", [(doc_id,) for doc_id in ids])
+
+    def ids(self):
+        with shared_connection(self.db_path) as conn:
+            return [row[0] for row in conn.execute("SELECT id FROM docs")]
+
+    def __len__(self):
+        with shared_connection(self.db_path) as conn:
+            return conn.execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+
+    def count(self, ids):
+        """Return how many of the IDs are stored here."""
+        ids = list(ids)
+        found = 0
+        with shared_connection(self.db_path) as conn:
+            # SQLite limits the number of parameters of a statement.
+            for start in range(0, len(ids), 500):
+                batch = ids[start:start + 500]
+                found += conn.execute(f"SELECT COUNT(*) FROM docs WHERE id IN ({','.join('?' * len(batch))})", batch).fetchone()[0]
+        return found
+
+class ChainedDocstore(Docstore):
+    """
+    Read-only view over the docstores of several shards, whose vectors follow each other in the index.
+
+    Deleting hides IDs instead of touching the shards, which stay reusable by other selections.
+    A chunk found by its index position is read from the docstore owning that position, found
+    from the number of vectors each docstore holds, so no map of chunk IDs is ever built. Sizes
+    not given are counted on the first lookup by position. search_in reads a chunk from the
+    docstore at a known path; search, given only an ID, asks each docstore in turn.
+    """
+
+    def __init__(self, docstores=None, sizes=None):
+        self.docstores = list(docstores or [])
+        self.sizes = list(sizes) if sizes is not None else None
+        self.deleted = set()
+        self._lock = threading.Lock()
+        self._starts = None
+
+    def append(self, docstore, size):
+        with self._lock:
+            self.sizes = self._sizes() + [size]
+            self.docstores.append(docstore)
+            self._starts = None
+
+    def copy(self):
+        """Return a chain over the same docstores whose appends and deletions do not affect this one."""
+        with self._lock:
+            chained = ChainedDocstore(self.docstores, self.sizes)
+        chained.deleted = set(self.deleted)
+        return chained
+
+    def _sizes(self):
+        """Return the number of vectors of each docstore. Caller holds _lock."""
+        if self.sizes is None:
+            self.sizes = [len(docstore) for docstore in self.docstores]
+        return self.sizes
+
+    def owner(self, position):
+        """Return the docstore holding the chunk at an index position, or None."""
+        with self._lock:
+            if self._starts is None:
+                self._starts = list(itertools.accumulate(self._sizes(), initial=0))
+            starts = self._starts
+        part = bisect.bisect_right(starts, position) - 1
+        if position < 0 or part >= len(self.docstores):
+            return None
+        return self.docstores[part]
+
+    def search_at(self, position, doc_id):
+        """Return the chunk with this ID at an index position."""
+        docstore = self.owner(position) if doc_id not in self.deleted else None
+        return docstore.search(doc_id) if docstore is not None else f"ID {doc_id} not found."
+
+    def search_in(self, db_path, doc_id):
+        """Return the chunk with this ID from the docstore at db_path."""
+        if doc_id not in self.deleted:
+            docstore = next((docstore for docstore in self.docstores if docstore.db_path == db_path), None)
+            if docstore is not None:
+                return docstore.search(doc_id)
+        return f"ID {doc_id} not found."
+
+    def search(self, search):
+        if search not in self.deleted:
+            for docstore in self.docstores:
+                doc = docstore.search(search)
+                if isinstance(doc, Document):
+                    return doc
+        return f"ID {search} not found."
+
+    def delete(self, ids):
+        """Hide the chunks, whose vectors the caller removes from the index, and shrink their docstores' share of positions."""
+        ids = set(ids) - self.deleted
+        self.deleted.update(ids)
+        with self._lock:
+            sizes = self._sizes()
+            self.sizes = [size - docstore.count(ids) if ids and size else size for docstore, size in zip(self.docstores, sizes)]
+            self._starts = None
+
+class SQLiteIdMap(Mapping):
+    """Mapping of index position to chunk ID, read from SQLite on access."""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+
+    def __getitem__(self, position):
+        with shared_connection(self.db_path) as conn:
+            row = conn.execute("SELECT doc_id FROM positions WHERE position = ?", (int(position),)).fetchone()
+        if row is None:
+            raise KeyError(position)
+        return row[0]
+
+    def __len__(self):
+        with shared_connection(self.db_path) as conn:
+            return conn.execute("SELECT COUNT(*) FROM positions").fetchone()[0]
+
+    def __iter__(self):
+        with shared_connection(self.db_path) as conn:
+            positions = [row[0] for row in conn.execute("SELECT position FROM positions ORDER BY position")]
+        return iter(positions)
+
+class ChainedIdMap(Mapping):
+    """Position-to-ID mappings of several indexes, addressed as if the indexes were concatenated."""
+
+    def __init__(self, id_maps):
+        self.id_maps = list(id_maps)
+        self._starts = list(itertools.accumulate((len(id_map) for id_map in self.id_maps), initial=0))
+
+    def __getitem__(self, position):
+        part = bisect.bisect_right(self._starts, position) - 1
+        if position < 0 or part >= len(self.id_maps):
+            raise KeyError(position)
+        return self.id_maps[part][position - self._starts[part]]
+
+    def __len__(self):
+        return self._starts[-1]
+
+    def __iter__(self):
+        return iter(range(len(self)))
+
+def _write_positions(conn, ids):
+    conn.execute("CREATE TABLE IF NOT EXISTS positions (position INTEGER PRIMARY KEY, doc_id TEXT NOT NULL)")
+    conn.executemany("INSERT INTO positions VALUES (?, ?)", enumerate(ids))
+
+def _replace_db(db_path, write):
+    """Write a fresh SQLite database next to db_path and move it into place once complete."""
+    tmp_path = f"{db_path}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    conn = sqlite3.connect(tmp_path)
+    try:
+        with conn:
+            write(conn)
+    finally:
+        conn.close()
+    os.replace(tmp_path, db_path)
+    close_connections(db_path)
+
+def write_index(index, index_file):
+    """Write a FAISS index next to index_file and move it into place, so open memory maps keep the old file."""
+    tmp_path = f"{index_file}.tmp"
+    faiss.write_index(index, tmp_path)
+    os.replace(tmp_path, index_file)
+
+def read_index(index_file, mmap=False):
+    """Read a FAISS index, memory-mapping it instead of loading it when mmap is set."""
+    # Memory-mapped indexes are read-only views of the file; callers must never add to or remove from them.
+    return faiss.read_index(index_file, faiss.IO_FLAG_MMAP_IFC if mmap else 0)
+
+def save_positions(path, ids):
+    os.makedirs(path, exist_ok=True)
+    _replace_db(os.path.join(path, POSITIONS_FILE), lambda conn: _write_positions(conn, ids))
+
+def load_positions(path, mmap=False):
+    """Return the position-to-ID mapping saved under path, lazily when mmap is set."""
+    id_map = SQLiteIdMap(os.path.join(path, POSITIONS_FILE))
+    return id_map if mmap else dict(id_map.items())
+
+def save_vector_store(vector_store, path):
+    """Save a FAISS vector store's index, chunks and ID mapping under path."""
+    os.makedirs(path, exist_ok=True)
+    num_vectors = vector_store.index.ntotal
+    ids = [vector_store.index_to_docstore_id[i] for i in range(num_vectors)]
+
+    def write(conn):
+        conn.execute("CREATE TABLE docs (id TEXT PRIMARY KEY, page_content TEXT NOT NULL, metadata TEXT NOT NULL)")
+        rows = []
+        for doc_id in ids:
+            doc = vector_store.docstore.search(doc_id)
+            rows.append((doc_id, doc.page_content, json.dumps(doc.metadata)))
+        conn.executemany("INSERT INTO docs VALUES (?, ?, ?)", rows)
+        _write_positions(conn, ids)
+
+    write_index(vector_store.index, os.path.join(path, INDEX_FILE))
+    _replace_db(os.path.join(path, DOCSTORE_FILE), write)
+
+class ShardWriter:
+    """
+    Write a shard batch by batch, so a file's chunks and vectors never all have to be in memory.
+
+    Vectors are appended to a spool file and chunks inserted into the docstore as they arrive.
+    close() adds the memory-mapped spool to a flat index, writes it with faiss.write_index and
+    checks the file reads back with every vector before moving it into place, so the result is
+    the same as save_vector_store's. abort() deletes what was written.
+    """
+
+    def __init__(self, path):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.dimension = None
+        self.ntotal = 0
+        self._lock = threading.Lock()
+        self._db_tmp = os.path.join(path, f"{DOCSTORE_FILE}.tmp")
+        if os.path.exists(self._db_tmp):
+            os.remove(self._db_tmp)
+        self._vectors = open(os.path.join(path, VECTORS_SPOOL_FILE), 'wb')
+        self._conn = _connect(self._db_tmp)
+        with self._conn:
+            self._conn.execute("CREATE TABLE docs (id TEXT PRIMARY KEY, page_content TEXT NOT NULL, metadata TEXT NOT NULL)")
+            self._conn.execute("CREATE TABLE positions (position INTEGER PRIMARY KEY, doc_id TEXT NOT NULL)")
+
+    def add(self, ids, docs, vectors):
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        with self._lock:
+            if self.dimension is None:
+                self.dimension = vectors.shape[1]
+            elif vectors.shape[1] != self.dimension:
+                raise ValueError(f"Got vectors of dimension {vectors.shape[1]} for a shard of dimension {self.dimension}.")
+            self._vectors.write(vectors.tobytes())
+            with self._conn:
+                self._conn.executemany("INSERT INTO docs VALUES (?, ?, ?)", [
+                    (doc_id, doc.page_content, json.dumps(doc.metadata)) for doc_id, doc in zip(ids, docs)
+                ])
+                self._conn.executemany("INSERT INTO positions VALUES (?, ?)", enumerate(ids, start=self.ntotal))
+            self.ntotal += len(ids)
+
+    def close(self):
+        with self._lock:
+            self._vectors.close()
+            self._conn.close()
+            index_file = os.path.join(self.path, INDEX_FILE)
+            spool_file = os.path.join(self.path, VECTORS_SPOOL_FILE)
+            index = faiss.IndexFlatL2(self.dimension)
+            if self.ntotal:
+                spool = np.memmap(spool_file, dtype=np.float32, mode='r', shape=(self.ntotal, self.dimension))
+                rows = max(1, ADD_BATCH_BYTES // (4 * self.dimension))
+                for start in range(0, self.ntotal, rows):
+                    index.add(np.ascontiguousarray(spool[start:start + rows]))
+                del spool
+            faiss.write_index(index, f"{index_file}.tmp")
+            written = read_index(f"{index_file}.tmp", mmap=True)
+            if (written.ntotal, written.d) != (self.ntotal, self.dimension):
+                raise ValueError(f"Wrote {written.ntotal} vectors of dimension {written.d} for a shard of {self.ntotal} of dimension {self.dimension}.")
+            del written
+            os.replace(f"{index_file}.tmp", index_file)
+            os.replace(self._db_tmp, os.path.join(self.path, DOCSTORE_FILE))
+            close_connections(os.path.join(self.path, DOCSTORE_FILE))
+            os.remove(spool_file)
+
+    def abort(self):
+        with self._lock:
+            self._vectors.close()
+            self._conn.close()
+            for name in (VECTORS_SPOOL_FILE, f"{DOCSTORE_FILE}.tmp", f"{INDEX_FILE}.tmp"):
+                if os.path.exists(os.path.join(self.path, name)):
+                    os.remove(os.path.join(self.path, name))
+            if not os.listdir(self.path):
+                os.rmdir(self.path)
+
+class ShardVectors:
+    """
+    The full-precision vectors of saved shards, addressed by position as if the shards were concatenated.
+
+    The shards' flat index files are memory-mapped, so only the vectors that are read become resident.
+    """
+
+    def __init__(self, shard_paths):
+        self._indexes = [read_index(os.path.join(path, INDEX_FILE), mmap=True) for path in shard_paths]
+        self._arrays = [
+            faiss.rev_swig_ptr(faiss.downcast_index(index).get_xb(), index.ntotal * index.d).reshape(index.ntotal, index.d)
+            for index in self._indexes if index.ntotal
+        ]
+        self._starts = np.cumsum([0] + [len(array) for array in self._arrays])
+        self.ntotal = int(self._starts[-1])
+
+    def get(self, positions):
+        shards = np.searchsorted(self._starts, positions, side="right") - 1
+        return np.array([self._arrays[shard][position - self._starts[shard]] for shard, position in zip(shards, positions)])
+
+def copy_vector_store(vector_store):
+    """Return a copy of an in-memory store over a ChainedDocstore that can be changed without affecting the original."""
+    return FAISS(
+        embedding_function=vector_store.embedding_function,
+        index=faiss.clone_index(vector_store.index),
+        docstore=vector_store.docstore.copy(),
+        index_to_docstore_id=dict(vector_store.index_to_docstore_id),
+    )
+
+def is_saved(path):
+    return os.path.exists(os.path.join(path, INDEX_FILE)) and os.path.exists(os.path.join(path, DOCSTORE_FILE))
+
+def load_vector_store(path, embeddings, mmap=False):
+    """
+    Load a vector store saved by save_vector_store.
+
+    Chunks stay in SQLite either way; with mmap the index file is memory-mapped and the ID
+    mapping is read lazily, so loading costs the same regardless of how many chunks it holds.
+    """
+    db_path = os.path.join(path, DOCSTORE_FILE)
+    index_to_docstore_id = SQLiteIdMap(db_path)
+    if not mmap:
+        index_to_docstore_id = dict(index_to_docstore_id.items())
+    return FAISS(
+        embedding_function=embeddings,
+        index=read_index(os.path.join(path, INDEX_FILE), mmap),
+        docstore=SQLiteDocstore(db_path),
+        index_to_docstore_id=index_to_docstore_id,
+    )
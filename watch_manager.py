@@ -0,0 +1,87 @@
+import os
+import time
+import threading
+from config import config
+from metrics import metrics
+
+class WatchManager:
+    """
+    Keep the index in sync with the selected files while the chat goes on.
+
+    The files, and with watch_new_files also docs_path, are polled every `interval` seconds.
+    Once changes have settled for `debounce` seconds, RAGManager.refresh_index re-embeds only the
+    affected files on this background thread and swaps the updated index in.
+    """
+
+    def __init__(self, rag_manager, interval=None, debounce=None, docs_path=None):
+        self.rag_manager = rag_manager
+        self.interval = interval if interval is not None else config['watch_interval']
+        self.debounce = debounce if debounce is not None else config['watch_debounce']
+        self.docs_path = docs_path or config['docs_path']
+        # Selected files that are deleted stay watched, so they rejoin the index if they come back.
+        self.watched_paths = list(rag_manager.file_paths)
+        self._last_seen = self._snapshot()
+        self._changed_at = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _new_files(self):
+        if not config['watch_new_files'] or not os.path.isdir(self.docs_path):
+            return []
+        supported_extensions = tuple(config['supported_extensions'])
+        watched = {os.path.abspath(p) for p in self.watched_paths}
+        paths = (os.path.abspath(os.path.join(self.docs_path, f)) for f in sorted(os.listdir(self.docs_path)))
+        return [p for p in paths if p.endswith(supported_extensions) and p not in watched]
+
+    def _snapshot(self):
+        """Return the (modification time, size) of every watched file that exists, by path."""
+        snapshot = {}
+        for path in self.watched_paths + self._new_files():
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            snapshot[path] = (stat.st_mtime_ns, stat.st_size)
+        return snapshot
+
+    def poll(self, now=None):
+        """Check the files once and refresh the index when changes have settled; return True if it was refreshed."""
+        now = time.monotonic() if now is None else now
+        snapshot = self._snapshot()
+        if snapshot != self._last_seen:
+            self._last_seen = snapshot
+            self._changed_at = now
+            return False
+        if self._changed_at is None or now - self._changed_at < self.debounce:
+            return False
+
+        self._changed_at = None
+        self.watched_paths.extend(p for p in snapshot if p not in self.watched_paths)
+        file_paths = [p for p in self.watched_paths if p in snapshot]
+        if not file_paths:
+            print("\nAll watched files are gone; keeping the current index.")
+            return False
+        try:
+            with metrics.timer("watch.refresh_seconds"):
+                refreshed = self.rag_manager.refresh_index(file_paths)
+        except Exception as e:
+            print(f"\nError updating the index in the background: {e}")
+            return False
+        if refreshed:
+            metrics.count("watch.refreshes")
+            print(f"\nDocuments changed; the index now covers {len(file_paths)} file(s).")
+        return refreshed
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.poll()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="rag-watch", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()